@@ -1,26 +1,46 @@
 ﻿from fastapi import FastAPI, UploadFile, File, Query, Form, Request, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import Any, Callable, Dict, Optional, List
+from typing import Any, BinaryIO, Callable, Dict, Optional, List, Union
 from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
+import openai
 import logging
 import asyncio
 import base64
+import bisect
+import functools
 import json
 import html
+import io
 import os
+import random
 import re
 import uuid
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as futures_wait
 import hashlib
+import heapq
+import sqlite3
+import threading
 import time
 from datetime import datetime, timezone, timedelta
+from email.utils import parsedate_to_datetime
 import jwt
 from jwt import PyJWKClient
 import httpx
 from urllib.parse import quote
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; uploads are then sent to the model unchanged.
+    Image = None
+    ImageOps = None
+
 _base_dir = Path(__file__).resolve().parent
 _env_path = _base_dir / ".env.runtime"
 if not _env_path.exists():
@@ -54,6 +74,33 @@ _default_origins = {
 
 ALLOWED_ORIGINS = set(_parse_origins(os.getenv("ALLOWED_ORIGINS"))) or _default_origins
 
+_image_upload_paths = {"/analyze", "/analyze_label"}
+# Room for the multipart boundaries and the small form fields sent next to the image.
+_image_upload_form_overhead_bytes = 64 * 1024
+
+
+def _image_upload_limit_middleware(app):
+    # Plain ASGI wrapper: rejects photo uploads from the declared Content-Length before
+    # the multipart parser spools the body. Chunked uploads without a length are still
+    # capped while _read_upload_image hashes them.
+    async def middleware(scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in _image_upload_paths:
+            declared = dict(scope.get("headers") or []).get(b"content-length")
+            if (
+                declared is not None
+                and declared.isdigit()
+                and int(declared) > IMAGE_UPLOAD_MAX_BYTES + _image_upload_form_overhead_bytes
+            ):
+                response = JSONResponse({"detail": "image_too_large"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await app(scope, receive, send)
+
+    return middleware
+
+
+# Added first so CORS wraps it and the 413 still carries CORS headers.
+app.add_middleware(_image_upload_limit_middleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=list(ALLOWED_ORIGINS),
@@ -361,6 +408,35 @@ class FoodSearchItem(BaseModel):
 
 class FoodSearchResponse(BaseModel):
     items: List[FoodSearchItem]
+    partial: bool = False
+
+
+class FoodSearchBatchRequest(BaseModel):
+    queries: List[str]
+    lang: Optional[str] = None
+    limit: int = 8
+
+
+class FoodSearchBatchResult(BaseModel):
+    query: str
+    items: List[FoodSearchItem]
+    best_match: Optional[FoodSearchItem] = None
+    partial: bool = False
+
+
+class FoodSearchBatchResponse(BaseModel):
+    results: List[FoodSearchBatchResult]
+
+
+class FoodSuggestItem(BaseModel):
+    food_id: str
+    food_name: str
+    alias: Optional[str] = None
+    score: float
+
+
+class FoodSuggestResponse(BaseModel):
+    items: List[FoodSuggestItem]
 
 
 class FoodSearchMissRequest(BaseModel):
@@ -397,6 +473,8 @@ class IosSubscriptionVerifyResponse(BaseModel):
 
 
 FREE_DAILY_LIMIT = int(os.getenv("FREE_DAILY_LIMIT", "1"))
+DAILY_COUNT_STORE = os.getenv("DAILY_COUNT_STORE", "memory").strip().lower()
+DAILY_COUNT_FLUSH_SEC = max(5, int(os.getenv("DAILY_COUNT_FLUSH_SEC", "30")))
 CALL_REAL_AI = os.getenv("CALL_REAL_AI", "false").lower() == "true"
 DEFAULT_LANG = os.getenv("DEFAULT_LANG", "zh-TW")
 API_KEY = os.getenv("API_KEY", "")
@@ -404,6 +482,53 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_FALLBACK_MODELS = _parse_csv_values(
     os.getenv("OPENAI_FALLBACK_MODELS", "gpt-4.1-mini,gpt-4o-mini")
 )
+# Per-model circuit breaker: a model whose calls in the last window mostly fail (or
+# exceed the slow threshold) is skipped for MODEL_CIRCUIT_OPEN_SEC, then probed once.
+MODEL_CIRCUIT_WINDOW_SEC = max(10, int(os.getenv("MODEL_CIRCUIT_WINDOW_SEC", "60")))
+MODEL_CIRCUIT_MIN_CALLS = max(1, int(os.getenv("MODEL_CIRCUIT_MIN_CALLS", "5")))
+MODEL_CIRCUIT_ERROR_RATE = max(0.05, min(1.0, float(os.getenv("MODEL_CIRCUIT_ERROR_RATE", "0.5"))))
+MODEL_CIRCUIT_SLOW_SEC = max(1.0, float(os.getenv("MODEL_CIRCUIT_SLOW_SEC", "25")))
+MODEL_CIRCUIT_OPEN_SEC = max(5, int(os.getenv("MODEL_CIRCUIT_OPEN_SEC", "30")))
+# Shared AI call policy: each endpoint gets a total time budget; transient failures are
+# retried with full-jitter backoff (or the server's Retry-After) only while budget remains.
+OPENAI_TIMEOUT_SEC = max(5.0, float(os.getenv("OPENAI_TIMEOUT_SEC", "60")))
+AI_RETRY_MAX = max(0, min(5, int(os.getenv("AI_RETRY_MAX", "2"))))
+AI_RETRY_BASE_SEC = max(0.05, float(os.getenv("AI_RETRY_BASE_SEC", "0.5")))
+AI_RETRY_MAX_DELAY_SEC = max(0.1, float(os.getenv("AI_RETRY_MAX_DELAY_SEC", "8")))
+AI_RETRY_MIN_ATTEMPT_SEC = max(0.5, float(os.getenv("AI_RETRY_MIN_ATTEMPT_SEC", "3")))
+AI_DEADLINE_DEFAULT_SEC = max(5.0, float(os.getenv("AI_DEADLINE_DEFAULT_SEC", "30")))
+AI_DEADLINE_CHAT_SEC = max(5.0, float(os.getenv("AI_DEADLINE_CHAT_SEC", "20")))
+AI_DEADLINE_VISION_SEC = max(5.0, float(os.getenv("AI_DEADLINE_VISION_SEC", "45")))
+AI_DEADLINE_PLAN_SEC = max(5.0, float(os.getenv("AI_DEADLINE_PLAN_SEC", "90")))
+_AI_DEADLINE_BY_PURPOSE = {
+    "chat": AI_DEADLINE_CHAT_SEC,
+    "chat_stream": AI_DEADLINE_CHAT_SEC,
+    "analyze": AI_DEADLINE_VISION_SEC,
+    "label": AI_DEADLINE_VISION_SEC,
+    "plan_week": AI_DEADLINE_PLAN_SEC,
+}
+# Admission control (per worker process): at most AI_MAX_INFLIGHT OpenAI calls run at
+# once and AI_INTERACTIVE_RESERVED of those slots are only usable by interactive calls.
+# Everything else queues by priority and is shed once it can no longer start in time.
+AI_MAX_INFLIGHT = max(1, int(os.getenv("AI_MAX_INFLIGHT", "8")))
+AI_INTERACTIVE_RESERVED = max(0, min(AI_MAX_INFLIGHT - 1, int(os.getenv("AI_INTERACTIVE_RESERVED", "2"))))
+AI_QUEUE_MAX = max(0, int(os.getenv("AI_QUEUE_MAX", "32")))
+# Replays of the text-only endpoints (day/week summary, meal advice, name analysis) are
+# answered from memory when the built prompt, model and temperature are unchanged.
+AI_TEXT_CACHE_TTL_SEC = max(0, int(os.getenv("AI_TEXT_CACHE_TTL_SEC", "900")))
+AI_TEXT_CACHE_MAX = max(10, int(os.getenv("AI_TEXT_CACHE_MAX", "1000")))
+_AI_PRIORITY_NAMES = ("interactive", "standard", "background")
+_AI_PRIORITY_BY_PURPOSE = {
+    "chat": 0,
+    "chat_stream": 0,
+    "analyze": 0,
+    "label": 0,
+    "analyze_name": 0,
+    "suggest_meal": 1,
+    "summarize_day": 1,
+    "summarize_week": 1,
+    "plan_week": 2,
+}
 PRICE_INPUT_PER_M = float(os.getenv("PRICE_INPUT_PER_M", "0.15"))
 PRICE_OUTPUT_PER_M = float(os.getenv("PRICE_OUTPUT_PER_M", "0.60"))
 RETURN_AI_ERROR = os.getenv("RETURN_AI_ERROR", "false").lower() == "true"
@@ -411,6 +536,8 @@ SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 TEST_BYPASS_EMAILS = _parse_email_set(os.getenv("TEST_BYPASS_EMAILS", ""))
 TRIAL_DAYS = int(os.getenv("TRIAL_DAYS", "2"))
+PROFILE_ACCESS_CACHE_TTL_SEC = max(0, int(os.getenv("PROFILE_ACCESS_CACHE_TTL_SEC", "60")))
+PROFILE_ACCESS_CACHE_MAX = 5000
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
 _AI_ENTITLEMENTS = (
     "ai_analyze",
@@ -463,32 +590,102 @@ _PLAN_ENTITLEMENTS = {
     "whitelisted": _AI_ENTITLEMENTS,
 }
 
-_client = OpenAI(api_key=API_KEY) if API_KEY else None
+# Retries are handled by _create_chat_completion so they respect the endpoint deadline.
+_client = AsyncOpenAI(api_key=API_KEY, timeout=OPENAI_TIMEOUT_SEC, max_retries=0) if API_KEY else None
 logging.basicConfig(level=logging.INFO)
 _last_ai_error: Optional[str] = None
+_ai_call_stats: ContextVar[Optional[dict]] = ContextVar("ai_call_stats", default=None)
+# Only touched from the event loop, so no lock.
+_ai_admission: Dict[str, Any] = {
+    "in_flight": 0,
+    "waiters": [],
+    "seq": 0,
+    "admitted": [0, 0, 0],
+    "shed": [0, 0, 0],
+}
+_model_circuits: Dict[str, Dict[str, Any]] = {}
+_model_circuits_lock = threading.Lock()
 _jwks_client: Optional[PyJWKClient] = None
 _supabase_http_client: Optional[httpx.Client] = None
+_analysis_cache_db: Optional[sqlite3.Connection] = None
+_analysis_cache_count = 0
+_analysis_cache_lock = threading.Lock()
+# image_hash -> 64-bit dHash of cached entries, for near-duplicate lookups.
+# image_hash -> (dhash, scope fingerprint, saved_at) for near-duplicate lookups.
+_analysis_dhash_index: Dict[str, tuple[int, str, float]] = {}
 _catalog_lang_active_filter_supported: Optional[bool] = None
 _catalog_market_code_filter_supported: Optional[bool] = None
 _catalog_retailer_code_filter_supported: Optional[bool] = None
 _profile_plan_columns_supported: Optional[bool] = None
-_chat_rate_state: dict[str, list[float]] = {}
+_food_search_rpc_supported: Optional[bool] = None
+_catalog_version_supported: Optional[bool] = None
+_food_search_index: Optional[Dict[str, Any]] = None
+_background_stop = threading.Event()
+_usage_log_lock = threading.Lock()
+_usage_log_compact_wakeup = threading.Event()
+_usage_log_estimated_lines = 0
+_usage_log_compact_lock = threading.Lock()
+_usage_rollups: Optional[Dict[str, Any]] = None
+_usage_tail: deque = deque()
+_daily_count_lock = threading.Lock()
+_daily_count_db: Optional[sqlite3.Connection] = None
+_daily_counts_day: Optional[str] = None
+_daily_counts: dict[str, int] = {}
+_daily_counts_dirty = False
+_profile_access_cache: dict[str, dict[str, Any]] = {}
+_profile_access_cache_lock = threading.Lock()
+_food_search_cache: OrderedDict = OrderedDict()
+_food_search_cache_lock = threading.Lock()
+_food_search_cache_stats = {"hits": 0, "misses": 0}
+_food_search_cache_version: Optional[str] = None
+_ai_text_cache: OrderedDict = OrderedDict()
+_ai_text_cache_lock = threading.Lock()
+_ai_text_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
 _chat_rate_limit = int(os.getenv("CHAT_RATE_LIMIT_PER_MIN", "5"))
 _chat_rate_window_sec = int(os.getenv("CHAT_RATE_WINDOW_SEC", "60"))
-_analysis_rate_state: dict[str, list[float]] = {}
 _analysis_rate_limit = int(os.getenv("ANALYZE_RATE_LIMIT_PER_MIN", "6"))
 _analysis_rate_window_sec = int(os.getenv("ANALYZE_RATE_WINDOW_SEC", "60"))
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory").strip().lower()
+RATE_LIMIT_MAX_KEYS = max(100, int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000")))
+_rate_limit_db: Optional[sqlite3.Connection] = None
+_rate_limit_db_lock = threading.Lock()
 
 
 @app.on_event("shutdown")
 def _shutdown_clients() -> None:
     global _supabase_http_client
+    _background_stop.set()
+    _usage_log_compact_wakeup.set()
     if _supabase_http_client is not None:
         try:
             _supabase_http_client.close()
         except Exception:
             pass
         _supabase_http_client = None
+    _close_analysis_cache()
+    _flush_daily_counts()
+    _food_search_executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.on_event("shutdown")
+async def _shutdown_async_clients() -> None:
+    global _week_plan_web_http_client
+    if _week_plan_web_prewarm_task is not None:
+        _week_plan_web_prewarm_task.cancel()
+    if _week_plan_web_cache_flush_task is not None:
+        _week_plan_web_cache_flush_task.cancel()
+    await _flush_week_plan_web_cache()
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception:
+            pass
+    if _week_plan_web_http_client is not None:
+        try:
+            await _week_plan_web_http_client.aclose()
+        except Exception:
+            pass
+        _week_plan_web_http_client = None
 
 
 _chat_blocklist = {
@@ -523,12 +720,54 @@ _usage_dir = _base_dir / "data"
 _usage_dir.mkdir(exist_ok=True)
 _usage_log_path = _usage_dir / "usage.jsonl"
 _daily_count_path = _usage_dir / "daily_counts.json"
+_daily_count_db_path = _usage_dir / "daily_counts.sqlite3"
+_rate_limit_db_path = _usage_dir / "rate_limits.sqlite3"
 _analysis_cache_path = _usage_dir / "analysis_cache.json"
+_analysis_cache_db_path = _usage_dir / "analysis_cache.sqlite3"
 
 ANALYSIS_CACHE_TTL_DAYS = int(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "30"))
 ANALYSIS_CACHE_MAX = int(os.getenv("ANALYSIS_CACHE_MAX", "5000"))
+ANALYSIS_CACHE_EVICT_BATCH = 64
+ANALYSIS_DHASH_ENABLED = os.getenv("ANALYSIS_DHASH_ENABLED", "false").lower() == "true"
+ANALYSIS_DHASH_MAX_DISTANCE = max(0, min(16, int(os.getenv("ANALYSIS_DHASH_MAX_DISTANCE", "6"))))
 USAGE_LOG_TTL_DAYS = int(os.getenv("USAGE_LOG_TTL_DAYS", "90"))
 USAGE_LOG_MAX = int(os.getenv("USAGE_LOG_MAX", "10000"))
+USAGE_LOG_COMPACT_SEC = max(30, int(os.getenv("USAGE_LOG_COMPACT_SEC", "600")))
+USAGE_TAIL_MAX = 500
+IMAGE_UPLOAD_MAX_BYTES = max(1, int(os.getenv("IMAGE_UPLOAD_MAX_MB", "12"))) * 1024 * 1024
+IMAGE_UPLOAD_CHUNK_BYTES = 256 * 1024
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true"
+IMAGE_MAX_EDGE = max(256, int(os.getenv("IMAGE_MAX_EDGE", "1280")))
+IMAGE_JPEG_QUALITY = max(40, min(95, int(os.getenv("IMAGE_JPEG_QUALITY", "82"))))
+FOOD_SEARCH_INDEX_ENABLED = os.getenv("FOOD_SEARCH_INDEX_ENABLED", "false").lower() == "true"
+FOOD_SEARCH_INDEX_REFRESH_SEC = max(
+    60,
+    int(os.getenv("FOOD_SEARCH_INDEX_REFRESH_SEC", "900")),
+)
+FOOD_SEARCH_INDEX_PAGE_SIZE = 1000
+FOOD_SUGGEST_SCAN_MAX = 200
+FOOD_SEARCH_BATCH_MAX = 20
+FOOD_SEARCH_DEADLINE_SEC = max(0.5, min(10.0, float(os.getenv("FOOD_SEARCH_DEADLINE_SEC", "3"))))
+# /foods/search_batch gets FOOD_SEARCH_DEADLINE_SEC per uncached dish, up to this cap.
+FOOD_SEARCH_BATCH_DEADLINE_SEC = max(
+    FOOD_SEARCH_DEADLINE_SEC,
+    min(30.0, float(os.getenv("FOOD_SEARCH_BATCH_DEADLINE_SEC", "10"))),
+)
+FOOD_SEARCH_CACHE_TTL_SEC = max(0, int(os.getenv("FOOD_SEARCH_CACHE_TTL_SEC", "300")))
+FOOD_SEARCH_CACHE_MAX = max(100, int(os.getenv("FOOD_SEARCH_CACHE_MAX", "2000")))
+FOOD_SEARCH_CACHE_VERSION_CHECK_SEC = max(5, int(os.getenv("FOOD_SEARCH_CACHE_VERSION_CHECK_SEC", "30")))
+FOOD_SEARCH_RPC_ENABLED = os.getenv("FOOD_SEARCH_RPC_ENABLED", "true").lower() == "true"
+FOOD_SEARCH_FANOUT_WORKERS = max(2, min(64, int(os.getenv("FOOD_SEARCH_FANOUT_WORKERS", "16"))))
+# Lookups one request may have in the shared pool at once, so a wide query cannot
+# occupy every worker while concurrent searches wait behind it.
+FOOD_SEARCH_FANOUT_PER_REQUEST = max(
+    1,
+    min(FOOD_SEARCH_FANOUT_WORKERS, int(os.getenv("FOOD_SEARCH_FANOUT_PER_REQUEST", "6"))),
+)
+_food_search_executor = ThreadPoolExecutor(
+    max_workers=FOOD_SEARCH_FANOUT_WORKERS,
+    thread_name_prefix="food-search",
+)
 
 _supported_langs = {"zh-TW", "en"}
 _week_plan_scenarios = ("home_cook", "eat_out", "convenience_store")
@@ -592,7 +831,33 @@ WEEK_PLAN_WEB_LOOKUP_CACHE_SEC = max(
     60,
     int(os.getenv("WEEK_PLAN_WEB_LOOKUP_CACHE_SEC", "21600")),
 )
+WEEK_PLAN_WEB_LOOKUP_DEADLINE_SEC = max(
+    3,
+    min(40, int(os.getenv("WEEK_PLAN_WEB_LOOKUP_DEADLINE_SEC", "18"))),
+)
+# Web searches start once the OpenAI lookup comes back short, or after this long
+# if it has not come back at all.
+WEEK_PLAN_WEB_LOOKUP_HEDGE_SEC = max(
+    0.0,
+    min(float(WEEK_PLAN_WEB_LOOKUP_DEADLINE_SEC), float(os.getenv("WEEK_PLAN_WEB_LOOKUP_HEDGE_SEC", "4"))),
+)
+WEEK_PLAN_WEB_PREWARM_ENABLED = os.getenv(
+    "WEEK_PLAN_WEB_PREWARM_ENABLED", "false"
+).lower() == "true"
+WEEK_PLAN_WEB_PREWARM_INTERVAL_SEC = max(
+    60,
+    int(os.getenv("WEEK_PLAN_WEB_PREWARM_INTERVAL_SEC", "600")),
+)
+# Lookups only mark the cache dirty; a background task writes the file at most once
+# per WEEK_PLAN_WEB_CACHE_FLUSH_SEC and again on shutdown.
+WEEK_PLAN_WEB_CACHE_FLUSH_SEC = max(5, int(os.getenv("WEEK_PLAN_WEB_CACHE_FLUSH_SEC", "30")))
 _week_plan_web_lookup_cache: Dict[str, Dict[str, Any]] = {}
+_week_plan_web_cache_path = _usage_dir / "week_plan_web_cache.json"
+_week_plan_web_cache_dirty = False
+_week_plan_web_prewarm_task: Optional[asyncio.Task] = None
+_week_plan_web_cache_flush_task: Optional[asyncio.Task] = None
+_week_plan_convenience_candidate_limit = 24
+_week_plan_web_http_client: Optional[httpx.AsyncClient] = None
 _week_plan_market_default_retailers: Dict[str, List[str]] = {
     "TW": ["7_11", "familymart", "hilife", "okmart"],
     "JP": ["lawson", "ministop"],
@@ -2283,7 +2548,18 @@ def _week_plan_normalize_web_candidate_name(raw_title: str) -> str:
     return ""
 
 
-def _week_plan_fetch_web_titles(
+def _get_week_plan_web_http_client() -> httpx.AsyncClient:
+    global _week_plan_web_http_client
+    if _week_plan_web_http_client is None:
+        _week_plan_web_http_client = httpx.AsyncClient(
+            timeout=WEEK_PLAN_WEB_LOOKUP_TIMEOUT_SEC,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return _week_plan_web_http_client
+
+
+async def _week_plan_fetch_web_titles(
     *,
     query: str,
     market_code: str,
@@ -2300,11 +2576,11 @@ def _week_plan_fetch_web_titles(
         )
     }
     try:
-        with httpx.Client(
-            timeout=WEEK_PLAN_WEB_LOOKUP_TIMEOUT_SEC,
-            follow_redirects=True,
-        ) as client:
-            resp = client.get("https://duckduckgo.com/html/", params=params, headers=headers)
+        resp = await _get_week_plan_web_http_client().get(
+            "https://duckduckgo.com/html/",
+            params=params,
+            headers=headers,
+        )
     except Exception as exc:
         logging.info("Week plan web lookup failed for query `%s`: %s", query, exc)
         return []
@@ -2443,7 +2719,7 @@ def _week_plan_parse_openai_web_candidates(
     return result
 
 
-def _week_plan_fetch_openai_online_convenience_candidates(
+async def _week_plan_fetch_openai_online_convenience_candidates(
     *,
     lang: str,
     market_code: str,
@@ -2491,8 +2767,12 @@ def _week_plan_fetch_openai_online_convenience_candidates(
             "tools": [{"type": "web_search_preview"}],
         }
         try:
-            with httpx.Client(timeout=WEEK_PLAN_OPENAI_WEB_LOOKUP_TIMEOUT_SEC) as client:
-                resp = client.post("https://api.openai.com/v1/responses", headers=headers, json=payload)
+            resp = await _get_week_plan_web_http_client().post(
+                "https://api.openai.com/v1/responses",
+                headers=headers,
+                json=payload,
+                timeout=WEEK_PLAN_OPENAI_WEB_LOOKUP_TIMEOUT_SEC,
+            )
         except Exception as exc:
             logging.info("Week plan OpenAI web lookup failed (model=%s): %s", model_name, exc)
             continue
@@ -2530,57 +2810,14 @@ def _week_plan_fetch_openai_online_convenience_candidates(
     return []
 
 
-def _week_plan_fetch_online_convenience_candidates(
+def _week_plan_merge_web_candidates(
     *,
-    lang: str,
-    market_code: str,
-    retailer_codes: List[str],
-    limit: int,
+    openai_candidates: List[str],
+    web_results: List[tuple[str, List[str]]],
+    max_items: int,
 ) -> List[str]:
-    if not WEEK_PLAN_WEB_LOOKUP_ENABLED:
-        return []
-
-    max_items = max(4, min(WEEK_PLAN_WEB_LOOKUP_MAX_ITEMS, int(limit)))
-    normalized_market = str(market_code or "").strip().upper() or "GLOBAL"
-    normalized_retailers = _week_plan_web_retailer_codes(
-        market_code=normalized_market,
-        retailer_codes=retailer_codes,
-    )
-    cache_key = json.dumps(
-        {
-            "lang": str(lang or "").strip(),
-            "market_code": normalized_market,
-            "retailers": normalized_retailers,
-            "limit": max_items,
-            "lookup_strategy": "openai_then_ddg_v1",
-            "openai_lookup": bool(WEEK_PLAN_OPENAI_WEB_LOOKUP_ENABLED),
-            "openai_model": WEEK_PLAN_OPENAI_WEB_LOOKUP_MODEL,
-        },
-        ensure_ascii=True,
-        sort_keys=True,
-    )
-    now_ts = time.time()
-    cached = _week_plan_web_lookup_cache.get(cache_key)
-    if isinstance(cached, dict):
-        expires_at = float(cached.get("expires_at") or 0)
-        if expires_at > now_ts:
-            cached_items = cached.get("items")
-            if isinstance(cached_items, list):
-                return [str(item or "").strip() for item in cached_items if str(item or "").strip()]
-
-    query_pairs = _week_plan_build_web_queries(
-        lang=lang,
-        market_code=normalized_market,
-        retailer_codes=normalized_retailers,
-    )
     candidates: List[str] = []
     seen: set[str] = set()
-    openai_candidates = _week_plan_fetch_openai_online_convenience_candidates(
-        lang=lang,
-        market_code=normalized_market,
-        retailer_codes=normalized_retailers,
-        limit=max_items,
-    )
     for item in openai_candidates:
         item_name = _week_plan_strip_candidate_source_suffix(item)
         if not item_name:
@@ -2595,17 +2832,9 @@ def _week_plan_fetch_online_convenience_candidates(
         seen.add(key)
         candidates.append(item)
         if len(candidates) >= max_items:
-            break
+            return candidates
 
-    for query, retailer_code in query_pairs:
-        if len(candidates) >= max_items:
-            break
-        query_limit = max(6, min(16, max_items))
-        titles = _week_plan_fetch_web_titles(
-            query=query,
-            market_code=normalized_market,
-            limit=query_limit,
-        )
+    for retailer_code, titles in web_results:
         source_label = _week_plan_retailer_display_label(retailer_code)
         for title in titles:
             item_name = _week_plan_strip_candidate_source_suffix(title)
@@ -2619,12 +2848,172 @@ def _week_plan_fetch_online_convenience_candidates(
             seen.add(key)
             candidates.append(f"{item_name} ({source_label})")
             if len(candidates) >= max_items:
+                return candidates
+    return candidates
+
+
+def _week_plan_web_lookup_cache_key(
+    *,
+    lang: str,
+    market_code: str,
+    retailer_codes: List[str],
+    max_items: int,
+) -> str:
+    return json.dumps(
+        {
+            "lang": str(lang or "").strip(),
+            "market_code": market_code,
+            "retailers": retailer_codes,
+            "limit": max_items,
+            "lookup_strategy": "openai_then_ddg_v1",
+            "openai_lookup": bool(WEEK_PLAN_OPENAI_WEB_LOOKUP_ENABLED),
+            "openai_model": WEEK_PLAN_OPENAI_WEB_LOOKUP_MODEL,
+        },
+        ensure_ascii=True,
+        sort_keys=True,
+    )
+
+
+async def _week_plan_fetch_online_convenience_candidates(
+    *,
+    lang: str,
+    market_code: str,
+    retailer_codes: List[str],
+    limit: int,
+    force_refresh: bool = False,
+) -> List[str]:
+    global _week_plan_web_cache_dirty
+    if not WEEK_PLAN_WEB_LOOKUP_ENABLED:
+        return []
+
+    max_items = max(4, min(WEEK_PLAN_WEB_LOOKUP_MAX_ITEMS, int(limit)))
+    normalized_market = str(market_code or "").strip().upper() or "GLOBAL"
+    normalized_retailers = _week_plan_web_retailer_codes(
+        market_code=normalized_market,
+        retailer_codes=retailer_codes,
+    )
+    cache_key = _week_plan_web_lookup_cache_key(
+        lang=lang,
+        market_code=normalized_market,
+        retailer_codes=normalized_retailers,
+        max_items=max_items,
+    )
+    now_ts = time.time()
+    cached = _week_plan_web_lookup_cache.get(cache_key)
+    if isinstance(cached, dict) and not force_refresh:
+        expires_at = float(cached.get("expires_at") or 0)
+        if expires_at > now_ts:
+            cached_items = cached.get("items")
+            if isinstance(cached_items, list):
+                return [str(item or "").strip() for item in cached_items if str(item or "").strip()]
+
+    query_pairs = _week_plan_build_web_queries(
+        lang=lang,
+        market_code=normalized_market,
+        retailer_codes=normalized_retailers,
+    )
+    query_limit = max(6, min(16, max_items))
+    # Slot 0 is the OpenAI lookup, slots 1.. are DuckDuckGo queries in priority order.
+    # The web queries are only sent when OpenAI comes back short (or is still running at
+    # the hedge point), then run together; the merge only consumes a finished prefix so
+    # the result matches the sequential order, and everything still pending is
+    # cancelled once it is full.
+    tasks: List[asyncio.Task] = [
+        asyncio.create_task(
+            _week_plan_fetch_openai_online_convenience_candidates(
+                lang=lang,
+                market_code=normalized_market,
+                retailer_codes=normalized_retailers,
+                limit=max_items,
+            )
+        )
+    ]
+
+    def start_web_queries() -> None:
+        for query, _ in query_pairs:
+            tasks.append(
+                asyncio.create_task(
+                    _week_plan_fetch_web_titles(
+                        query=query,
+                        market_code=normalized_market,
+                        limit=query_limit,
+                    )
+                )
+            )
+
+    def merge_finished_prefix() -> List[str]:
+        openai_candidates: List[str] = []
+        web_results: List[tuple[str, List[str]]] = []
+        for index, task in enumerate(tasks):
+            if not task.done():
+                break
+            items = [] if task.cancelled() or task.exception() else task.result()
+            if index == 0:
+                openai_candidates = items
+            else:
+                web_results.append((query_pairs[index - 1][1], items))
+        return _week_plan_merge_web_candidates(
+            openai_candidates=openai_candidates,
+            web_results=web_results,
+            max_items=max_items,
+        )
+
+    started_at = time.monotonic()
+    deadline = started_at + WEEK_PLAN_WEB_LOOKUP_DEADLINE_SEC
+    hedge_at = started_at + WEEK_PLAN_WEB_LOOKUP_HEDGE_SEC
+    pending = set(tasks)
+    web_started = False
+    timed_out = False
+    candidates: List[str] = []
+    while pending or not web_started:
+        now = time.monotonic()
+        remaining = deadline - now
+        if remaining <= 0:
+            timed_out = True
+            break
+        if not web_started and (tasks[0].done() or now >= hedge_at):
+            web_started = True
+            start_web_queries()
+            pending.update(tasks[1:])
+            if not pending:
                 break
+        wait_sec = remaining if web_started else min(remaining, max(0.0, hedge_at - now))
+        _, pending = await asyncio.wait(pending, timeout=wait_sec, return_when=asyncio.FIRST_COMPLETED)
+        candidates = merge_finished_prefix()
         if len(candidates) >= max_items:
             break
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    if timed_out:
+        # Fill from whatever finished, even past a slot that did not.
+        openai_task = tasks[0]
+        candidates = _week_plan_merge_web_candidates(
+            openai_candidates=(
+                openai_task.result()
+                if openai_task.done() and not openai_task.cancelled() and not openai_task.exception()
+                else []
+            ),
+            web_results=[
+                (query_pairs[index - 1][1], task.result())
+                for index, task in enumerate(tasks)
+                if index > 0 and task.done() and not task.cancelled() and not task.exception()
+            ],
+            max_items=max_items,
+        )
+        logging.info(
+            "Week plan web lookup hit deadline (%ss), partial items=%s",
+            WEEK_PLAN_WEB_LOOKUP_DEADLINE_SEC,
+            len(candidates),
+        )
 
+    cache_sec = WEEK_PLAN_WEB_LOOKUP_CACHE_SEC
+    if timed_out and len(candidates) < max_items:
+        cache_sec = min(cache_sec, 600)
+    _week_plan_web_lookup_cache.pop(cache_key, None)
     _week_plan_web_lookup_cache[cache_key] = {
-        "expires_at": now_ts + WEEK_PLAN_WEB_LOOKUP_CACHE_SEC,
+        "expires_at": now_ts + cache_sec,
         "items": list(candidates),
     }
     if len(_week_plan_web_lookup_cache) > 120:
@@ -2636,9 +3025,116 @@ def _week_plan_fetch_online_convenience_candidates(
         while len(_week_plan_web_lookup_cache) > 120:
             stale_key = next(iter(_week_plan_web_lookup_cache))
             _week_plan_web_lookup_cache.pop(stale_key, None)
+    _week_plan_web_cache_dirty = True
     return candidates
 
 
+def _load_week_plan_web_cache() -> None:
+    if not _week_plan_web_cache_path.exists():
+        return
+    try:
+        data = json.loads(_week_plan_web_cache_path.read_text(encoding="utf-8"))
+    except Exception as exc:
+        logging.warning("Week plan web cache load failed: %s", exc)
+        return
+    if not isinstance(data, dict):
+        return
+    now_ts = time.time()
+    loaded = 0
+    for key, entry in data.items():
+        if not isinstance(entry, dict) or not isinstance(entry.get("items"), list):
+            continue
+        if float(entry.get("expires_at") or 0) <= now_ts:
+            continue
+        _week_plan_web_lookup_cache[str(key)] = entry
+        loaded += 1
+    if loaded:
+        logging.info("Week plan web cache restored %s entries", loaded)
+
+
+def _save_week_plan_web_cache(content: str) -> None:
+    tmp_path = _week_plan_web_cache_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    os.replace(tmp_path, _week_plan_web_cache_path)
+
+
+async def _flush_week_plan_web_cache() -> None:
+    # Serialized on the event loop, which owns the cache dict; only the write is threaded.
+    global _week_plan_web_cache_dirty
+    if not _week_plan_web_cache_dirty:
+        return
+    content = json.dumps(_week_plan_web_lookup_cache, ensure_ascii=True)
+    _week_plan_web_cache_dirty = False
+    try:
+        await asyncio.to_thread(_save_week_plan_web_cache, content)
+    except Exception as exc:
+        logging.warning("Week plan web cache save failed: %s", exc)
+        _week_plan_web_cache_dirty = True
+
+
+async def _week_plan_web_cache_flush_loop() -> None:
+    while True:
+        await asyncio.sleep(WEEK_PLAN_WEB_CACHE_FLUSH_SEC)
+        await _flush_week_plan_web_cache()
+
+
+async def _week_plan_web_prewarm_once() -> int:
+    refreshed = 0
+    refresh_before = time.time() + max(
+        WEEK_PLAN_WEB_PREWARM_INTERVAL_SEC * 2,
+        WEEK_PLAN_WEB_LOOKUP_CACHE_SEC // 4,
+    )
+    for market_code, retailer_codes in _week_plan_market_default_retailers.items():
+        for lang in sorted(_supported_langs):
+            # Same arguments /plan/week ends up using for a market's default retailer set.
+            max_items = max(4, min(WEEK_PLAN_WEB_LOOKUP_MAX_ITEMS, _week_plan_convenience_candidate_limit))
+            normalized_retailers = _week_plan_web_retailer_codes(
+                market_code=market_code,
+                retailer_codes=retailer_codes,
+            )
+            cache_key = _week_plan_web_lookup_cache_key(
+                lang=lang,
+                market_code=market_code,
+                retailer_codes=normalized_retailers,
+                max_items=max_items,
+            )
+            cached = _week_plan_web_lookup_cache.get(cache_key)
+            if isinstance(cached, dict) and float(cached.get("expires_at") or 0) > refresh_before:
+                continue
+            try:
+                await _week_plan_fetch_online_convenience_candidates(
+                    lang=lang,
+                    market_code=market_code,
+                    retailer_codes=retailer_codes,
+                    limit=_week_plan_convenience_candidate_limit,
+                    force_refresh=True,
+                )
+                refreshed += 1
+            except Exception as exc:
+                logging.warning("Week plan web prewarm failed (%s/%s): %s", market_code, lang, exc)
+    return refreshed
+
+
+async def _week_plan_web_prewarm_loop() -> None:
+    while True:
+        refreshed = await _week_plan_web_prewarm_once()
+        if refreshed:
+            logging.info("Week plan web prewarm refreshed %s entries", refreshed)
+        await asyncio.sleep(WEEK_PLAN_WEB_PREWARM_INTERVAL_SEC)
+
+
+@app.on_event("startup")
+async def _start_week_plan_web_prewarm() -> None:
+    global _week_plan_web_prewarm_task, _week_plan_web_cache_flush_task
+    _load_week_plan_web_cache()
+    if not WEEK_PLAN_WEB_LOOKUP_ENABLED:
+        return
+    _week_plan_web_cache_flush_task = asyncio.create_task(_week_plan_web_cache_flush_loop())
+    if not WEEK_PLAN_WEB_PREWARM_ENABLED:
+        return
+    _week_plan_web_prewarm_task = asyncio.create_task(_week_plan_web_prewarm_loop())
+
+
 def _week_plan_catalog_convenience_candidates_legacy(
     *,
     lang: str,
@@ -2752,7 +3248,7 @@ def _week_plan_catalog_convenience_candidates_legacy(
     return candidates
 
 
-def _week_plan_catalog_convenience_candidates(
+async def _week_plan_catalog_convenience_candidates(
     *,
     lang: str,
     market_code: str,
@@ -2915,7 +3411,7 @@ def _week_plan_catalog_convenience_candidates(
             break
 
     catalog_candidates = list(candidates)
-    web_candidates = _week_plan_fetch_online_convenience_candidates(
+    web_candidates = await _week_plan_fetch_online_convenience_candidates(
         lang=lang,
         market_code=market_code,
         retailer_codes=normalized_retailers,
@@ -5068,6 +5564,7 @@ def _contains_any_token(text: str, tokens: tuple[str, ...]) -> bool:
     return any(token in text for token in tokens)
 
 
+@functools.lru_cache(maxsize=4096)
 def _is_probably_beverage_text(text: str) -> bool:
     normalized = _normalize_food_query(text)
     if not normalized:
@@ -5370,100 +5867,115 @@ def _pick_float(value: Any, fallback: float) -> float:
     return parsed
 
 
-def _parse_beverage_size(query_norm: str, base_ml: float, lang: str) -> tuple[float, str, bool]:
+_BEVERAGE_SIZE_RULES = (
+    (("特大杯", "超大杯", "x-large", "xlarge", "xl"), 1.45, "特大杯", "x-large"),
+    (("大杯", "large", "lg"), 1.25, "大杯", "large"),
+    (("中杯", "medium", "md"), 1.0, "中杯", "medium"),
+    (("小杯", "small", "sm"), 0.8, "小杯", "small"),
+)
+
+_BEVERAGE_SUGAR_RULES = (
+    (("無糖", "不加糖", "去糖", "no sugar", "sugar-free", "sugar free", "unsweetened"), 0.0),
+    (("微糖", "light sugar"), 0.25),
+    (("少糖", "less sugar"), 0.3),
+    (("半糖", "half sugar"), 0.5),
+    (("七分糖",), 0.7),
+    (("全糖", "正常糖", "full sugar", "regular sugar"), 1.0),
+)
+
+_BEVERAGE_ICE_RULES = (
+    (("去冰", "no ice"), "去冰", "no ice"),
+    (("少冰", "less ice"), "少冰", "less ice"),
+    (("微冰", "light ice"), "微冰", "light ice"),
+    (("正常冰", "regular ice"), "正常冰", "regular ice"),
+    (("常溫", "room temperature"), "常溫", "room temperature"),
+    (("熱飲", "熱的", "熱", "hot", "warm"), "熱飲", "hot"),
+)
+
+
+def _build_beverage_token_matcher() -> tuple[re.Pattern, dict[str, tuple[str, ...]]]:
+    tokens: set[str] = set()
+    for rule in _BEVERAGE_SIZE_RULES + _BEVERAGE_SUGAR_RULES + _BEVERAGE_ICE_RULES:
+        tokens.update(rule[0])
+    for topping in _BEVERAGE_TOPPINGS:
+        tokens.update(str(token) for token in topping.get("tokens") or ())
+    for component in _BEVERAGE_INTRINSIC_COMPONENTS:
+        tokens.update(str(token) for token in component.get("tokens") or ())
+    tokens.update(_FRUIT_HINT_TOKENS)
+    tokens.update(("果汁", "juice"))
+    tokens.discard("")
+    # Longest-first alternation inside a lookahead reports, for every start position,
+    # the longest token found there; every other token starting at that position is
+    # one of its prefixes, so expanding prefixes yields exactly the `token in text` set.
+    ordered = sorted(tokens, key=lambda token: (-len(token), token))
+    pattern = re.compile("(?=(" + "|".join(re.escape(token) for token in ordered) + "))")
+    prefixes = {
+        token: tuple(other for other in tokens if token.startswith(other))
+        for token in tokens
+    }
+    return pattern, prefixes
+
+
+_BEVERAGE_TOKEN_RE, _BEVERAGE_TOKEN_PREFIXES = _build_beverage_token_matcher()
+
+
+@functools.lru_cache(maxsize=4096)
+def _beverage_token_hits(text: str) -> frozenset[str]:
+    hits: set[str] = set()
+    for match in _BEVERAGE_TOKEN_RE.finditer(text):
+        hits.update(_BEVERAGE_TOKEN_PREFIXES[match.group(1)])
+    return frozenset(hits)
+
+
+@functools.lru_cache(maxsize=2048)
+def _beverage_query_modifiers(query_norm: str, lang: str) -> dict[str, Any]:
+    # Row-independent part of the beverage formula: parsed once per query and
+    # shared by every candidate row. Callers must treat the result as read-only.
+    hits = _beverage_token_hits(query_norm)
+
+    size_ml: Optional[int] = None
     ml_match = re.search(r"(\d{2,4})\s*(ml|cc)", query_norm)
     if ml_match is not None:
         amount = int(ml_match.group(1))
-        if 120 <= amount <= 1200 and base_ml > 0:
-            factor = amount / base_ml
-            label = f"{amount} ml"
-            return factor, label, True
-
-    rules = (
-        (("特大杯", "超大杯", "x-large", "xlarge", "xl"), 1.45, "特大杯", "x-large"),
-        (("大杯", "large", "lg"), 1.25, "大杯", "large"),
-        (("中杯", "medium", "md"), 1.0, "中杯", "medium"),
-        (("小杯", "small", "sm"), 0.8, "小杯", "small"),
-    )
-    for tokens, factor, zh_label, en_label in rules:
-        if any(token in query_norm for token in tokens):
-            return factor, (zh_label if lang == "zh-TW" else en_label), True
-
-    default_label = "中杯" if lang == "zh-TW" else "medium"
-    return 1.0, default_label, False
-
+        if 120 <= amount <= 1200:
+            size_ml = amount
+    size: Optional[tuple[float, str]] = None
+    for tokens, factor, zh_label, en_label in _BEVERAGE_SIZE_RULES:
+        if any(token in hits for token in tokens):
+            size = (factor, zh_label if lang == "zh-TW" else en_label)
+            break
 
-def _parse_beverage_sugar(query_norm: str, default_ratio: float, lang: str) -> tuple[float, str, bool]:
-    explicit = False
-    ratio = max(0.0, min(default_ratio, 1.0))
-
-    if any(token in query_norm for token in ("無糖", "不加糖", "去糖", "no sugar", "sugar-free", "sugar free", "unsweetened")):
-        ratio = 0.0
-        explicit = True
-    elif any(token in query_norm for token in ("微糖", "light sugar")):
-        ratio = 0.25
-        explicit = True
-    elif any(token in query_norm for token in ("少糖", "less sugar")):
-        ratio = 0.3
-        explicit = True
-    elif any(token in query_norm for token in ("半糖", "half sugar")):
-        ratio = 0.5
-        explicit = True
-    elif any(token in query_norm for token in ("七分糖",)):
-        ratio = 0.7
-        explicit = True
-    elif any(token in query_norm for token in ("全糖", "正常糖", "full sugar", "regular sugar")):
-        ratio = 1.0
-        explicit = True
-
-    if not explicit:
+    sugar_ratio: Optional[float] = None
+    for tokens, ratio in _BEVERAGE_SUGAR_RULES:
+        if any(token in hits for token in tokens):
+            sugar_ratio = ratio
+            break
+    if sugar_ratio is None:
         zh_fraction = re.search(r"([一二兩三四五六七八九十\d]{1,3})\s*分糖", query_norm)
         if zh_fraction is not None:
             number = _parse_zh_numeric_token(zh_fraction.group(1))
             if number is not None:
-                ratio = max(0.0, min(number / 10.0, 1.0))
-                explicit = True
-
-    if not explicit:
+                sugar_ratio = max(0.0, min(number / 10.0, 1.0))
+    if sugar_ratio is None:
         percent_match = re.search(r"(\d{1,3})\s*%?\s*(糖|sugar)", query_norm)
         if percent_match is not None:
-            number = int(percent_match.group(1))
-            ratio = max(0.0, min(number / 100.0, 1.0))
-            explicit = True
-
-    percent = int(round(max(0.0, min(ratio, 1.0)) * 100))
-    label = f"{percent}%糖" if lang == "zh-TW" else f"{percent}% sugar"
-    return ratio, label, explicit
-
-
-def _parse_beverage_ice(query_norm: str, lang: str) -> tuple[str, bool]:
-    rules = (
-        (("去冰", "no ice"), "去冰", "no ice"),
-        (("少冰", "less ice"), "少冰", "less ice"),
-        (("微冰", "light ice"), "微冰", "light ice"),
-        (("正常冰", "regular ice"), "正常冰", "regular ice"),
-        (("常溫", "room temperature"), "常溫", "room temperature"),
-        (("熱飲", "熱的", "熱", "hot", "warm"), "熱飲", "hot"),
-    )
-    for tokens, zh_label, en_label in rules:
-        if any(token in query_norm for token in tokens):
-            return (zh_label if lang == "zh-TW" else en_label), True
-    return "", False
+            sugar_ratio = max(0.0, min(int(percent_match.group(1)) / 100.0, 1.0))
 
+    ice: Optional[str] = None
+    for tokens, zh_label, en_label in _BEVERAGE_ICE_RULES:
+        if any(token in hits for token in tokens):
+            ice = zh_label if lang == "zh-TW" else en_label
+            break
 
-def _parse_beverage_toppings(query_norm: str, lang: str) -> list[dict[str, Any]]:
-    matched: list[dict[str, Any]] = []
+    toppings: list[dict[str, Any]] = []
     seen: set[str] = set()
     for topping in _BEVERAGE_TOPPINGS:
         key = str(topping.get("zh") or topping.get("en") or "")
-        if not key:
-            continue
-        if key in seen:
+        if not key or key in seen:
             continue
-        tokens = tuple(str(token) for token in topping.get("tokens") or [])
-        if any(token in query_norm for token in tokens):
+        if any(str(token) in hits for token in topping.get("tokens") or []):
             seen.add(key)
-            matched.append(
+            toppings.append(
                 {
                     "name": topping.get("zh") if lang == "zh-TW" else topping.get("en"),
                     "protein": float(topping.get("protein") or 0.0),
@@ -5472,8 +5984,50 @@ def _parse_beverage_toppings(query_norm: str, lang: str) -> list[dict[str, Any]]
                     "sodium": float(topping.get("sodium") or 0.0),
                 }
             )
-    return matched
-
+
+    return {
+        "hits": hits,
+        "size_ml": size_ml,
+        "size": size,
+        "sugar_ratio": sugar_ratio,
+        "ice": ice,
+        "toppings": tuple(toppings),
+    }
+
+
+def _parse_beverage_size(query_norm: str, base_ml: float, lang: str) -> tuple[float, str, bool]:
+    modifiers = _beverage_query_modifiers(query_norm, lang)
+    size_ml = modifiers["size_ml"]
+    if size_ml is not None and base_ml > 0:
+        return size_ml / base_ml, f"{size_ml} ml", True
+    if modifiers["size"] is not None:
+        factor, label = modifiers["size"]
+        return factor, label, True
+
+    default_label = "中杯" if lang == "zh-TW" else "medium"
+    return 1.0, default_label, False
+
+
+def _parse_beverage_sugar(query_norm: str, default_ratio: float, lang: str) -> tuple[float, str, bool]:
+    explicit_ratio = _beverage_query_modifiers(query_norm, lang)["sugar_ratio"]
+    explicit = explicit_ratio is not None
+    ratio = explicit_ratio if explicit else max(0.0, min(default_ratio, 1.0))
+
+    percent = int(round(max(0.0, min(ratio, 1.0)) * 100))
+    label = f"{percent}%糖" if lang == "zh-TW" else f"{percent}% sugar"
+    return ratio, label, explicit
+
+
+def _parse_beverage_ice(query_norm: str, lang: str) -> tuple[str, bool]:
+    ice = _beverage_query_modifiers(query_norm, lang)["ice"]
+    if ice is None:
+        return "", False
+    return ice, True
+
+
+def _parse_beverage_toppings(query_norm: str, lang: str) -> list[dict[str, Any]]:
+    return list(_beverage_query_modifiers(query_norm, lang)["toppings"])
+
 
 def _parse_beverage_intrinsic_components(
     query_norm: str,
@@ -5483,6 +6037,8 @@ def _parse_beverage_intrinsic_components(
 ) -> list[dict[str, Any]]:
     matched: list[dict[str, Any]] = []
     seen_keys: set[str] = set()
+    query_hits = _beverage_query_modifiers(query_norm, lang)["hits"]
+    base_hits = _beverage_token_hits(base_name_norm) if base_name_norm else frozenset()
 
     def add_component(raw: dict[str, Any]) -> None:
         key = str(raw.get("key") or "").strip()
@@ -5503,21 +6059,21 @@ def _parse_beverage_intrinsic_components(
         tokens = tuple(str(token) for token in component.get("tokens") or ())
         if not tokens:
             continue
-        if not any(token in query_norm for token in tokens):
+        if not any(token in query_hits for token in tokens):
             continue
         # If base row name already includes this ingredient and carbs are already
         # high enough, treat intrinsic sugar as included and avoid double count.
-        if base_name_norm and any(token in base_name_norm for token in tokens):
+        if base_name_norm and any(token in base_hits for token in tokens):
             component_carbs = max(0.0, _safe_float(component.get("carbs")) or 0.0)
             if component_carbs <= 0 or base_carbs_hint >= component_carbs * 0.7:
                 continue
         add_component(component)
 
-    has_fruit_hint = any(token in query_norm for token in _FRUIT_HINT_TOKENS)
+    has_fruit_hint = any(token in query_hits for token in _FRUIT_HINT_TOKENS)
     base_has_fruit_hint = (
-        any(token in base_name_norm for token in _FRUIT_HINT_TOKENS)
-        or ("果汁" in base_name_norm)
-        or ("juice" in base_name_norm)
+        any(token in base_hits for token in _FRUIT_HINT_TOKENS)
+        or ("果汁" in base_hits)
+        or ("juice" in base_hits)
     )
     fruit_component_carbs = max(
         0.0,
@@ -5588,8 +6144,8 @@ def _apply_beverage_formula(
     macros: dict[str, float],
     use_lang: str,
 ) -> Optional[dict[str, Any]]:
-    is_beverage = catalog_row.get("is_beverage") if isinstance(catalog_row.get("is_beverage"), bool) else False
-    if not is_beverage:
+    row_norms = _catalog_row_norms(catalog_row)
+    if not row_norms["is_beverage"]:
         return None
     query_norm = _normalize_food_query(raw_query)
     if not query_norm or not _is_probably_beverage_text(query_norm):
@@ -5597,7 +6153,7 @@ def _apply_beverage_formula(
 
     row_profile_raw = catalog_row.get("beverage_profile")
     row_profile: dict[str, Any] = row_profile_raw if isinstance(row_profile_raw, dict) else {}
-    name_norm = _normalize_food_query(str(catalog_row.get("food_name") or catalog_row.get("canonical_name") or ""))
+    name_norm = row_norms["name_norm"]
     defaults = _beverage_profile_defaults(name_norm)
 
     base_ml = _pick_float(
@@ -5967,22 +6523,22 @@ def _parse_json_response_utf8(resp: httpx.Response) -> Any:
         return None
 
 
+_CJK_RE = re.compile("[\u3400-\u9fff]")
+_MOJIBAKE_LATIN1_RE = re.compile("[\u00c0-\u00ff]")
+
+
 def _contains_cjk(text: str) -> bool:
-    for ch in text:
-        code = ord(ch)
-        if 0x3400 <= code <= 0x9FFF:
-            return True
-    return False
+    return _CJK_RE.search(text) is not None
 
 
 def _fix_mojibake_value(value: Any) -> Any:
     if isinstance(value, str):
         text = value
-        if not text or _contains_cjk(text):
+        # Nearly every field is plain ASCII or clean CJK; only strings carrying
+        # UTF-8-as-latin1 signatures (and no CJK yet) are worth a repair attempt.
+        if not text or text.isascii() or _MOJIBAKE_LATIN1_RE.search(text) is None:
             return text
-        # Common UTF-8-as-latin1 mojibake signatures.
-        has_latin1 = any(0x00C0 <= ord(ch) <= 0x00FF for ch in text)
-        if not has_latin1:
+        if _contains_cjk(text):
             return text
         try:
             repaired = text.encode("latin1").decode("utf-8")
@@ -5998,7 +6554,12 @@ def _fix_mojibake_value(value: Any) -> Any:
     return value
 
 
-def _supabase_rest_list(table: str, params: list[tuple[str, str]]) -> list[dict]:
+def _supabase_rest_list(
+    table: str,
+    params: list[tuple[str, str]],
+    *,
+    timeout: Optional[float] = None,
+) -> list[dict]:
     try:
         headers = _supabase_headers()
     except HTTPException:
@@ -6006,7 +6567,10 @@ def _supabase_rest_list(table: str, params: list[tuple[str, str]]) -> list[dict]
     url = f"{SUPABASE_URL}/rest/v1/{table}"
     try:
         client = _get_supabase_http_client()
-        resp = client.get(url, headers=headers, params=params)
+        if timeout is not None:
+            resp = client.get(url, headers=headers, params=params, timeout=timeout)
+        else:
+            resp = client.get(url, headers=headers, params=params)
     except Exception as exc:
         logging.warning("Supabase %s query error: %s", table, exc)
         return []
@@ -6025,6 +6589,33 @@ def _supabase_rest_list(table: str, params: list[tuple[str, str]]) -> list[dict]
     return normalized
 
 
+def _supabase_rest_rpc(
+    function_name: str,
+    payload: dict,
+    *,
+    timeout: Optional[float] = None,
+) -> tuple[int, Any]:
+    try:
+        headers = _supabase_headers()
+    except HTTPException:
+        return 0, None
+    url = f"{SUPABASE_URL}/rest/v1/rpc/{function_name}"
+    try:
+        client = _get_supabase_http_client()
+        if timeout is not None:
+            resp = client.post(url, headers=headers, json=payload, timeout=timeout)
+        else:
+            resp = client.post(url, headers=headers, json=payload)
+    except Exception as exc:
+        logging.warning("Supabase rpc %s error: %s", function_name, exc)
+        return 0, None
+    if resp.status_code >= 400:
+        if resp.status_code != 404:
+            logging.warning("Supabase rpc %s failed (%s): %s", function_name, resp.status_code, resp.text[:180])
+        return resp.status_code, None
+    return resp.status_code, _parse_json_response_utf8(resp)
+
+
 def _supabase_rest_insert(table: str, payload: dict) -> bool:
     try:
         headers = _supabase_headers()
@@ -6114,12 +6705,50 @@ def _supports_catalog_retailer_code_filter() -> bool:
     return bool(_catalog_retailer_code_filter_supported)
 
 
+def _catalog_row_norms(catalog_row: dict) -> dict[str, Any]:
+    # Normalized name forms and flags, computed once per fetched row and reused by
+    # every scorer (index rows are prepared at build time, live rows on first use).
+    norms = catalog_row.get("_norms")
+    if norms is None:
+        food_norm = _normalize_food_query(str(catalog_row.get("food_name") or ""))
+        canonical_norm = _normalize_food_query(str(catalog_row.get("canonical_name") or ""))
+        name_norm = _normalize_food_query(
+            str(catalog_row.get("food_name") or catalog_row.get("canonical_name") or "")
+        )
+        verified = _safe_float(catalog_row.get("verified_level"))
+        norms = {
+            "name_norm": name_norm,
+            "name_compact": name_norm.replace(" ", ""),
+            "food_norm": food_norm,
+            "food_compact": food_norm.replace(" ", ""),
+            "canonical_norm": canonical_norm,
+            "canonical_compact": canonical_norm.replace(" ", ""),
+            "is_beverage": catalog_row.get("is_beverage") is True,
+            "verified_bonus": min(verified, 5.0) / 10.0 if verified is not None and verified > 0 else 0.0,
+        }
+        catalog_row["_norms"] = norms
+    return norms
+
+
+def _alias_row_norms(alias_row: dict) -> dict[str, Any]:
+    norms = alias_row.get("_norms")
+    if norms is None:
+        alias_norm = _normalize_food_query(str(alias_row.get("alias") or ""))
+        norms = {
+            "alias_norm": alias_norm,
+            "alias_compact": alias_norm.replace(" ", ""),
+            "alias_lang": str(alias_row.get("lang") or "").strip(),
+        }
+        alias_row["_norms"] = norms
+    return norms
+
+
 def _food_match_score(query_norm: str, alias_row: dict, catalog_row: dict, lang: str) -> float:
-    alias = str(alias_row.get("alias") or "").strip()
-    alias_norm = _normalize_food_query(alias)
-    food_name = str(catalog_row.get("food_name") or catalog_row.get("canonical_name") or "").strip()
-    food_norm = _normalize_food_query(food_name)
-    alias_lang = str(alias_row.get("lang") or "").strip()
+    alias_norms = _alias_row_norms(alias_row)
+    row_norms = _catalog_row_norms(catalog_row)
+    alias_norm = alias_norms["alias_norm"]
+    food_norm = row_norms["name_norm"]
+    alias_lang = alias_norms["alias_lang"]
 
     score = 0.0
     if alias_lang and alias_lang == lang:
@@ -6136,17 +6765,14 @@ def _food_match_score(query_norm: str, alias_row: dict, catalog_row: dict, lang:
         score += 1.0
     elif query_norm in food_norm:
         score += 0.7
-    verified = _safe_float(catalog_row.get("verified_level"))
-    if verified is not None and verified > 0:
-        score += min(verified, 5.0) / 10.0
+    score += row_norms["verified_bonus"]
     return score
 
 
 def _direct_food_match_score(query_norm: str, catalog_row: dict) -> float:
-    food_name = str(catalog_row.get("food_name") or "").strip()
-    canonical_name = str(catalog_row.get("canonical_name") or "").strip()
-    food_norm = _normalize_food_query(food_name)
-    canonical_norm = _normalize_food_query(canonical_name)
+    row_norms = _catalog_row_norms(catalog_row)
+    food_norm = row_norms["food_norm"]
+    canonical_norm = row_norms["canonical_norm"]
 
     score = 0.0
     if food_norm == query_norm:
@@ -6163,19 +6789,20 @@ def _direct_food_match_score(query_norm: str, catalog_row: dict) -> float:
     elif query_norm in canonical_norm:
         score += 1.6
 
-    verified = _safe_float(catalog_row.get("verified_level"))
-    if verified is not None and verified > 0:
-        score += min(verified, 5.0) / 10.0
+    score += row_norms["verified_bonus"]
     return score
 
 
+@functools.lru_cache(maxsize=4096)
 def _compact_norm_text(value: str) -> str:
     return _normalize_food_query(value).replace(" ", "")
 
 
 def _relation_score(query_norm: str, target_norm: str) -> float:
-    query = _compact_norm_text(query_norm)
-    target = _compact_norm_text(target_norm)
+    return _relation_score_compact(_compact_norm_text(query_norm), _compact_norm_text(target_norm))
+
+
+def _relation_score_compact(query: str, target: str) -> float:
     if not query or not target:
         return 0.0
     if query == target:
@@ -6221,23 +6848,27 @@ def _primary_query_bonus(
     if not primary_query_norm:
         return 0.0
 
-    alias_norm = _normalize_food_query(str(alias_row.get("alias") or "").strip()) if alias_row else ""
-    food_norm = _normalize_food_query(str(catalog_row.get("food_name") or "").strip())
-    canonical_norm = _normalize_food_query(str(catalog_row.get("canonical_name") or "").strip())
+    primary_compact = _compact_norm_text(primary_query_norm)
+    row_norms = _catalog_row_norms(catalog_row)
+    alias_compact = _alias_row_norms(alias_row)["alias_compact"] if alias_row else ""
+    canonical_compact = row_norms["canonical_compact"]
 
-    alias_score = _relation_score(primary_query_norm, alias_norm) * 1.15 if alias_norm else 0.0
-    food_score = _relation_score(primary_query_norm, food_norm)
-    canonical_score = _relation_score(primary_query_norm, canonical_norm) * 0.9 if canonical_norm else 0.0
+    alias_score = _relation_score_compact(primary_compact, alias_compact) * 1.15 if alias_compact else 0.0
+    food_score = _relation_score_compact(primary_compact, row_norms["food_compact"])
+    canonical_score = (
+        _relation_score_compact(primary_compact, canonical_compact) * 0.9 if canonical_compact else 0.0
+    )
     bonus = max(alias_score, food_score, canonical_score)
 
-    primary_len = len(_compact_norm_text(primary_query_norm))
-    alias_len = len(_compact_norm_text(alias_norm))
+    primary_len = len(primary_compact)
+    alias_len = len(alias_compact)
     if alias_len > 0 and alias_len <= 2 and primary_len >= 4 and alias_len < primary_len:
         bonus -= 1.0
 
     return bonus
 
 
+@functools.lru_cache(maxsize=4096)
 def _beverage_modifier_present(query_norm: str) -> bool:
     if not query_norm:
         return False
@@ -6263,8 +6894,7 @@ def _beverage_query_preference_delta(query_norm: str, catalog_row: dict) -> floa
         return 0.0
     if not _beverage_modifier_present(query_norm):
         return 0.0
-    is_beverage = catalog_row.get("is_beverage") if isinstance(catalog_row.get("is_beverage"), bool) else False
-    return 1.0 if is_beverage else -10.0
+    return 1.0 if _catalog_row_norms(catalog_row)["is_beverage"] else -10.0
 
 
 def _build_food_search_item(
@@ -6534,117 +7164,911 @@ def _catalog_item_to_analysis_result(
     )
 
 
-def _require_admin(request: Request) -> None:
-    if ADMIN_API_KEY:
-        provided = request.headers.get("x-admin-key") or request.headers.get("X-Admin-Key")
-        if not provided or provided.strip() != ADMIN_API_KEY:
-            raise HTTPException(status_code=401, detail="admin_required")
-        return
-    client_host = request.client.host if request.client else ""
-    if client_host not in {"127.0.0.1", "::1", "localhost"}:
-        raise HTTPException(status_code=401, detail="admin_required")
-
+def _food_search_remote_collect(
+    *,
+    query_candidates: list[str],
+    use_lang: str,
+    query_limit: int,
+    deadline: Optional[float] = None,
+) -> tuple[list[tuple[str, int, dict]], list[tuple[str, int, dict]], dict[str, dict], set[str]]:
+    supports_lang_active = _supports_catalog_lang_active_filters()
+    # Use "*" so optional columns (e.g. food_items/judgement_tags) do not break older schemas.
+    catalog_select = "*"
+    if deadline is None:
+        deadline = time.monotonic() + FOOD_SEARCH_DEADLINE_SEC
+
+    # Every alias/catalog query for every candidate is queued at once; results are read
+    # back in the same (candidate, lang) order the serial loop used so ranking ties
+    # resolve identically. Candidates with a lookup still running at the deadline are
+    # reported as incomplete.
+    specs: list[tuple[str, list[tuple[str, str]]]] = []
+    alias_specs: list[list[int]] = []
+    direct_specs: list[int] = []
+    for query_norm in query_candidates:
+        if supports_lang_active:
+            alias_langs = _alias_search_lang_candidates(use_lang, query_norm)
+            alias_params = [
+                [
+                    ("select", "food_id,alias,lang"),
+                    ("alias", f"ilike.*{query_norm}*"),
+                    ("lang", f"eq.{alias_lang}"),
+                    ("limit", str(query_limit)),
+                ]
+                for alias_lang in alias_langs
+            ]
+        else:
+            alias_params = [
+                [
+                    ("select", "food_id,alias,lang"),
+                    ("alias", f"ilike.*{query_norm}*"),
+                    ("limit", str(query_limit)),
+                ]
+            ]
+        alias_specs.append(list(range(len(specs), len(specs) + len(alias_params))))
+        specs.extend(("food_aliases", params) for params in alias_params)
+        direct_specs.append(len(specs))
+        specs.append(
+            (
+                "food_catalog",
+                [
+                    ("select", catalog_select),
+                    ("or", f"food_name.ilike.*{query_norm}*,canonical_name.ilike.*{query_norm}*"),
+                    *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if supports_lang_active else ()),
+                    ("limit", str(query_limit)),
+                ],
+            )
+        )
+    results, unfinished = _food_search_fetch_many(specs, deadline)
 
-def _get_jwks_client() -> PyJWKClient:
-    global _jwks_client
-    if _jwks_client is not None:
-        return _jwks_client
-    if not SUPABASE_URL:
-        raise HTTPException(status_code=500, detail="supabase_not_configured")
-    jwks_url = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"
-    _jwks_client = PyJWKClient(jwks_url)
-    return _jwks_client
+    incomplete: set[str] = set()
+    alias_candidates: list[tuple[str, int, dict]] = []
+    direct_candidates: list[tuple[str, int, dict]] = []
+    for candidate_rank, query_norm in enumerate(query_candidates):
+        if unfinished.intersection(alias_specs[candidate_rank]) or direct_specs[candidate_rank] in unfinished:
+            incomplete.add(query_norm)
+        alias_seen: set[tuple[str, str, str]] = set()
+        for spec_index in alias_specs[candidate_rank]:
+            for row in results[spec_index]:
+                key = (
+                    str(row.get("food_id") or "").strip(),
+                    str(row.get("alias") or "").strip(),
+                    str(row.get("lang") or "").strip(),
+                )
+                if key in alias_seen:
+                    continue
+                alias_seen.add(key)
+                alias_candidates.append((query_norm, candidate_rank, row))
+        for row in results[direct_specs[candidate_rank]]:
+            direct_candidates.append((query_norm, candidate_rank, row))
 
+    direct_ids = {str(row.get("id") or "").strip() for _, _, row in direct_candidates}
+    alias_needed_ids: list[str] = []
+    for _, _, row in alias_candidates:
+        food_id = str(row.get("food_id") or "").strip()
+        if food_id and food_id not in direct_ids and food_id not in alias_needed_ids:
+            alias_needed_ids.append(food_id)
 
-def _decode_bearer_token(token: str) -> dict:
-    jwks_client = _get_jwks_client()
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
-    header = jwt.get_unverified_header(token)
-    alg = header.get("alg") or "RS256"
-    allowed = {"RS256", "ES256"}
-    if alg not in allowed:
-        raise HTTPException(status_code=401, detail="invalid_token_alg")
-    return jwt.decode(
-        token,
-        signing_key.key,
-        algorithms=[alg],
-        audience="authenticated",
-        issuer=f"{SUPABASE_URL}/auth/v1",
-    )
+    hydrated_by_id: dict[str, dict] = {}
+    if alias_needed_ids:
+        hydrate_results, hydrate_unfinished = _food_search_fetch_many(
+            [
+                (
+                    "food_catalog",
+                    [
+                        ("select", catalog_select),
+                        ("id", f"in.({','.join(alias_needed_ids)})"),
+                        *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if supports_lang_active else ()),
+                        ("limit", str(len(alias_needed_ids))),
+                    ],
+                )
+            ],
+            deadline,
+        )
+        if hydrate_unfinished:
+            incomplete.update(query_norm for query_norm, _, _ in alias_candidates)
+        for row in hydrate_results[0]:
+            food_id = str(row.get("id") or "").strip()
+            if food_id and food_id not in hydrated_by_id:
+                hydrated_by_id[food_id] = row
+    return alias_candidates, direct_candidates, hydrated_by_id, incomplete
 
 
-def _parse_iso_datetime(value: Any) -> Optional[datetime]:
-    raw = str(value or "").strip()
-    if not raw:
+def _food_search_rpc_collect(
+    *,
+    query_candidates: list[str],
+    use_lang: str,
+    query_limit: int,
+    deadline: Optional[float] = None,
+) -> Optional[tuple[list[tuple[str, int, dict]], list[tuple[str, int, dict]], dict[str, dict]]]:
+    global _food_search_rpc_supported
+    if deadline is None:
+        deadline = time.monotonic() + FOOD_SEARCH_DEADLINE_SEC
+    status, data = _supabase_rest_rpc(
+        "search_food_catalog",
+        {
+            "p_queries": query_candidates,
+            "p_alias_langs": [
+                ",".join(_alias_search_lang_candidates(use_lang, query_norm))
+                for query_norm in query_candidates
+            ],
+            "p_lang": use_lang,
+            "p_limit": query_limit,
+        },
+        timeout=max(0.5, deadline - time.monotonic()),
+    )
+    if status == 404:
+        # Function not installed (backend/sql/food_catalog_search_rpc.sql); stop trying.
+        _food_search_rpc_supported = False
+        logging.info("Supabase rpc search_food_catalog not found, using table queries")
         return None
-    try:
-        parsed = datetime.fromisoformat(raw.replace("Z", "+00:00"))
-        if parsed.tzinfo is None:
-            parsed = parsed.replace(tzinfo=timezone.utc)
-        return parsed
-    except Exception:
+    if status >= 400 or status == 0 or not isinstance(data, list):
         return None
+    _food_search_rpc_supported = True
 
+    rows = sorted(
+        (row for row in data if isinstance(row, dict)),
+        key=lambda row: (int(row.get("candidate_rank") or 0), int(row.get("hit_rank") or 0)),
+    )
+    alias_candidates: list[tuple[str, int, dict]] = []
+    direct_candidates: list[tuple[str, int, dict]] = []
+    alias_foods: dict[str, dict] = {}
+    alias_seen: set[tuple[int, str, str, str]] = set()
+    for row in rows:
+        candidate_rank = int(row.get("candidate_rank") or 0)
+        if candidate_rank < 0 or candidate_rank >= len(query_candidates):
+            continue
+        query_norm = query_candidates[candidate_rank]
+        food = row.get("food")
+        food_row = (
+            {str(k): _fix_mojibake_value(v) for k, v in food.items()}
+            if isinstance(food, dict)
+            else None
+        )
+        if row.get("kind") == "direct":
+            if food_row is not None:
+                direct_candidates.append((query_norm, candidate_rank, food_row))
+            continue
+        alias_row = {
+            "food_id": str(row.get("food_id") or ""),
+            "alias": _fix_mojibake_value(row.get("alias") or ""),
+            "lang": str(row.get("alias_lang") or ""),
+        }
+        key = (candidate_rank, alias_row["food_id"].strip(), str(alias_row["alias"]).strip(), alias_row["lang"].strip())
+        if key in alias_seen:
+            continue
+        alias_seen.add(key)
+        alias_candidates.append((query_norm, candidate_rank, alias_row))
+        if food_row is not None and alias_row["food_id"]:
+            alias_foods.setdefault(alias_row["food_id"], food_row)
+
+    direct_ids = {str(row.get("id") or "").strip() for _, _, row in direct_candidates}
+    hydrated_by_id = {
+        food_id: row for food_id, row in alias_foods.items() if food_id not in direct_ids
+    }
+    return alias_candidates, direct_candidates, hydrated_by_id
+
+
+def _food_search_submit(table: str, params: list[tuple[str, str]], deadline: float) -> Future:
+    timeout = max(0.5, deadline - time.monotonic())
+    return _food_search_executor.submit(_supabase_rest_list, table, params, timeout=timeout)
+
+
+def _food_search_fetch_many(
+    specs: list[tuple[str, list[tuple[str, str]]]],
+    deadline: float,
+) -> tuple[list[list[dict]], set[int]]:
+    # Runs (table, params) lookups with at most FOOD_SEARCH_FANOUT_PER_REQUEST in the
+    # shared pool at a time. Returns rows per spec and the specs that did not finish.
+    results: list[list[dict]] = [[] for _ in specs]
+    running: dict[Future, int] = {}
+    next_spec = 0
+    while next_spec < len(specs) or running:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        while next_spec < len(specs) and len(running) < FOOD_SEARCH_FANOUT_PER_REQUEST:
+            running[_food_search_submit(*specs[next_spec], deadline)] = next_spec
+            next_spec += 1
+        done, _ = futures_wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for job in done:
+            results[running.pop(job)] = _food_search_result(job)
+    unfinished = set(running.values()) | set(range(next_spec, len(specs)))
+    for job in running:
+        job.cancel()
+    if unfinished:
+        logging.warning("Food search deadline hit: %s/%s queries unfinished", len(unfinished), len(specs))
+    return results, unfinished
+
+
+def _food_search_result(job: Future) -> list[dict]:
+    if not job.done() or job.cancelled() or job.exception() is not None:
+        return []
+    return job.result()
 
-def _normalize_plan_id(value: Any) -> Optional[str]:
-    plan = str(value or "").strip().lower()
-    if plan in {"free", "pro", "plus"}:
-        return plan
-    return None
 
+def _food_search_rank(
+    *,
+    raw_query: str,
+    primary_query_norm: str,
+    query_candidates: list[str],
+    use_lang: str,
+    alias_candidates: list[tuple[str, int, dict]],
+    direct_candidates: list[tuple[str, int, dict]],
+    hydrated_by_id: dict[str, dict],
+) -> list[FoodSearchItem]:
+    direct_by_id: dict[str, dict] = {}
+    direct_best_score: dict[str, float] = {}
+    direct_best_query: dict[str, str] = {}
+    fetched_by_id: dict[str, dict] = dict(hydrated_by_id)
+    for query_norm, candidate_rank, row in direct_candidates:
+        food_id = str(row.get("id") or "").strip()
+        if not food_id:
+            continue
+        fetched_by_id.setdefault(food_id, row)
+        score = _direct_food_match_score(query_norm, row)
+        score += _primary_query_bonus(primary_query_norm, row, alias_row=None)
+        score += _beverage_query_preference_delta(primary_query_norm, row)
+        score -= _candidate_rank_penalty(query_norm, primary_query_norm, candidate_rank)
+        previous = direct_best_score.get(food_id, -1.0)
+        if score > previous:
+            direct_best_score[food_id] = score
+            direct_best_query[food_id] = query_norm
+            direct_by_id[food_id] = row
+
+    for _, _, alias_row in alias_candidates:
+        food_id = str(alias_row.get("food_id") or "").strip()
+        if food_id and food_id not in direct_by_id and food_id in fetched_by_id:
+            direct_by_id[food_id] = fetched_by_id[food_id]
 
-def _parse_millis_datetime(value: Any) -> Optional[datetime]:
-    raw = str(value or "").strip()
-    if not raw:
-        return None
-    try:
-        millis = int(raw)
-    except Exception:
-        return None
-    if millis <= 0:
-        return None
-    try:
-        return datetime.fromtimestamp(millis / 1000.0, tz=timezone.utc)
-    except Exception:
-        return None
+    best_items: dict[str, FoodSearchItem] = {}
 
+    # Candidate set A: direct match from food_name/canonical_name.
+    for food_id, catalog_row in direct_by_id.items():
+        candidate_query = direct_best_query.get(food_id) or query_candidates[0]
+        candidate = _build_food_search_item(
+            query_norm=candidate_query,
+            catalog_row=catalog_row,
+            use_lang=use_lang,
+            alias_row=None,
+            score=direct_best_score.get(food_id),
+            raw_query=raw_query,
+        )
+        if candidate is None:
+            continue
+        best_items[food_id] = candidate
 
-def _ios_product_plan(product_id: str) -> Optional[str]:
-    pid = (product_id or "").strip()
-    if not pid:
-        return None
-    if pid in IOS_PLAN_PRO_PRODUCT_IDS:
-        return "pro"
-    if pid in IOS_PLAN_PLUS_PRODUCT_IDS:
-        return "plus"
-    return None
+    # Candidate set B: alias match (can outrank direct match).
+    for query_norm, candidate_rank, alias_row in alias_candidates:
+        food_id = str(alias_row.get("food_id") or "").strip()
+        if not food_id:
+            continue
+        catalog_row = direct_by_id.get(food_id)
+        if catalog_row is None:
+            continue
+        alias_score = _food_match_score(query_norm, alias_row, catalog_row, use_lang)
+        alias_score += _primary_query_bonus(primary_query_norm, catalog_row, alias_row=alias_row)
+        alias_score += _beverage_query_preference_delta(primary_query_norm, catalog_row)
+        alias_score -= _candidate_rank_penalty(query_norm, primary_query_norm, candidate_rank)
+        candidate = _build_food_search_item(
+            query_norm=query_norm,
+            catalog_row=catalog_row,
+            use_lang=use_lang,
+            alias_row=alias_row,
+            score=alias_score,
+            raw_query=raw_query,
+        )
+        if candidate is None:
+            continue
+        existing = best_items.get(food_id)
+        if existing is None or (candidate.match_score or 0.0) > (existing.match_score or 0.0):
+            best_items[food_id] = candidate
 
+    items = list(best_items.values())
+    items.sort(key=lambda item: item.match_score or 0.0, reverse=True)
+    return items
 
-def _ios_verify_status_detail(status: int) -> str:
-    mapping = {
-        0: "ok",
-        21000: "ios_receipt_bad_json",
-        21002: "ios_receipt_invalid",
-        21003: "ios_receipt_auth_failed",
-        21004: "ios_shared_secret_mismatch",
-        21005: "ios_verify_temporarily_unavailable",
-        21006: "subscription_expired",
-        21007: "ios_sandbox_receipt_on_production",
-        21008: "ios_production_receipt_on_sandbox",
-        21010: "ios_receipt_not_found",
-    }
-    if status in mapping:
-        return mapping[status]
-    return f"ios_verify_failed_{status}"
 
+def _food_search_index_grams(text: str) -> set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
 
-def _post_ios_verify(url: str, payload: dict) -> dict:
-    try:
-        with httpx.Client(timeout=15) as client:
-            resp = client.post(url, headers={"Content-Type": "application/json"}, json=payload)
-    except Exception as exc:
-        logging.warning("Apple verifyReceipt request failed: %s", exc)
-        raise HTTPException(status_code=502, detail="ios_verify_unavailable")
+
+def _food_search_index_add_postings(postings: dict[str, list[int]], position: int, texts: list[str]) -> None:
+    grams: set[str] = set()
+    for text in texts:
+        if not text:
+            continue
+        grams.update(text)
+        grams.update(_food_search_index_grams(text))
+    for gram in grams:
+        postings.setdefault(gram, []).append(position)
+
+
+def _food_search_index_lookup(postings: dict[str, list[int]], query_norm: str) -> list[int]:
+    grams = _food_search_index_grams(query_norm)
+    if not grams:
+        return []
+    lists: list[list[int]] = []
+    for gram in grams:
+        posting = postings.get(gram)
+        if not posting:
+            return []
+        lists.append(posting)
+    lists.sort(key=len)
+    matched = set(lists[0])
+    for posting in lists[1:]:
+        matched.intersection_update(posting)
+        if not matched:
+            return []
+    return sorted(matched)
+
+
+def _food_search_index_fetch_all(table: str, select: str) -> list[dict]:
+    # Unlike _supabase_rest_list, any failed page raises: a short page must mean the
+    # end of the table, never an error, or a refresh would swap in a truncated index.
+    headers = _supabase_headers()
+    client = _get_supabase_http_client()
+    rows: list[dict] = []
+    offset = 0
+    while True:
+        resp = client.get(
+            f"{SUPABASE_URL}/rest/v1/{table}",
+            headers=headers,
+            params=[
+                ("select", select),
+                ("order", "id.asc"),
+                ("limit", str(FOOD_SEARCH_INDEX_PAGE_SIZE)),
+                ("offset", str(offset)),
+            ],
+        )
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{table} page at offset {offset} failed ({resp.status_code}): {resp.text[:180]}")
+        data = _parse_json_response_utf8(resp)
+        if not isinstance(data, list):
+            raise RuntimeError(f"{table} page at offset {offset} returned invalid JSON")
+        batch = [
+            {str(k): _fix_mojibake_value(v) for k, v in row.items()}
+            for row in data
+            if isinstance(row, dict)
+        ]
+        rows.extend(batch)
+        if len(batch) < FOOD_SEARCH_INDEX_PAGE_SIZE:
+            break
+        offset += FOOD_SEARCH_INDEX_PAGE_SIZE
+    return rows
+
+
+def _food_search_index_build() -> Optional[dict[str, Any]]:
+    supports_lang_active = _supports_catalog_lang_active_filters()
+    catalog_rows = _food_search_index_fetch_all("food_catalog", "*")
+    if not catalog_rows:
+        return None
+    alias_rows = _food_search_index_fetch_all("food_aliases", "food_id,alias,lang")
+
+    catalog_by_id: dict[str, dict] = {}
+    catalog_entries: list[tuple[str, str, str]] = []
+    catalog_postings: dict[str, list[int]] = {}
+    for row in catalog_rows:
+        food_id = str(row.get("id") or "").strip()
+        if not food_id or food_id in catalog_by_id:
+            continue
+        catalog_by_id[food_id] = row
+        _catalog_row_norms(row)
+        # PostgREST ilike is a case-insensitive substring match on the raw column.
+        food_name_lower = str(row.get("food_name") or "").lower()
+        canonical_lower = str(row.get("canonical_name") or "").lower()
+        _food_search_index_add_postings(
+            catalog_postings,
+            len(catalog_entries),
+            [food_name_lower, canonical_lower],
+        )
+        catalog_entries.append((food_id, food_name_lower, canonical_lower))
+
+    alias_entries: list[tuple[dict, str]] = []
+    alias_postings: dict[str, list[int]] = {}
+    for row in alias_rows:
+        alias_lower = str(row.get("alias") or "").lower()
+        if not alias_lower or not str(row.get("food_id") or "").strip():
+            continue
+        _alias_row_norms(row)
+        _food_search_index_add_postings(alias_postings, len(alias_entries), [alias_lower])
+        alias_entries.append((row, alias_lower))
+
+    return {
+        "built_at": time.time(),
+        "supports_lang_active": supports_lang_active,
+        "catalog_by_id": catalog_by_id,
+        "catalog_entries": catalog_entries,
+        "catalog_postings": catalog_postings,
+        "alias_entries": alias_entries,
+        "alias_postings": alias_postings,
+        "suggest": _food_suggest_build(catalog_by_id, alias_entries, supports_lang_active),
+    }
+
+
+def _food_suggest_keys(text: str) -> list[str]:
+    norm = _normalize_food_query(text)
+    if not norm:
+        return []
+    compact = norm.replace(" ", "")
+    return [norm] if compact == norm else [norm, compact]
+
+
+def _food_suggest_build(
+    catalog_by_id: dict[str, dict],
+    alias_entries: list[tuple[dict, str]],
+    supports_lang_active: bool,
+) -> dict[str, dict[str, list]]:
+    # One sorted key array per catalog lang; a prefix lookup is a bisect plus a short scan.
+    # Entries are (key, food_id, food_name, alias) so the tuple sort keeps equal keys stable.
+    entries_by_lang: dict[str, list[tuple[str, str, str, str]]] = {}
+    for food_id, row in catalog_by_id.items():
+        if supports_lang_active and row.get("is_active") is not True:
+            continue
+        food_name = str(row.get("food_name") or row.get("canonical_name") or "").strip()
+        if not food_name:
+            continue
+        bucket = entries_by_lang.setdefault(str(row.get("lang") or "") if supports_lang_active else "", [])
+        keys = _food_suggest_keys(food_name)
+        for key in _food_suggest_keys(str(row.get("canonical_name") or "")):
+            if key not in keys:
+                keys.append(key)
+        for key in keys:
+            bucket.append((key, food_id, food_name, ""))
+    for alias_row, _ in alias_entries:
+        food_id = str(alias_row.get("food_id") or "").strip()
+        row = catalog_by_id.get(food_id)
+        if row is None or (supports_lang_active and row.get("is_active") is not True):
+            continue
+        food_name = str(row.get("food_name") or row.get("canonical_name") or "").strip()
+        alias = str(alias_row.get("alias") or "").strip()
+        if not food_name or not alias:
+            continue
+        bucket = entries_by_lang.setdefault(str(row.get("lang") or "") if supports_lang_active else "", [])
+        for key in _food_suggest_keys(alias):
+            bucket.append((key, food_id, food_name, alias))
+
+    suggest: dict[str, dict[str, list]] = {}
+    for lang, entries in entries_by_lang.items():
+        entries.sort()
+        suggest[lang] = {
+            "keys": [entry[0] for entry in entries],
+            "refs": [entry[1:] for entry in entries],
+        }
+    return suggest
+
+
+def _food_suggest_lookup(
+    suggest: dict[str, dict[str, list]],
+    *,
+    query: str,
+    use_lang: str,
+    limit: int,
+) -> list[FoodSuggestItem]:
+    bucket = suggest.get(use_lang) or suggest.get("")
+    prefixes = _food_suggest_keys(query)
+    if bucket is None or not prefixes:
+        return []
+    keys: list[str] = bucket["keys"]
+    refs: list[tuple[str, str, str]] = bucket["refs"]
+    best: dict[str, tuple[float, str, str]] = {}
+    for prefix in prefixes:
+        position = bisect.bisect_left(keys, prefix)
+        end = min(len(keys), position + FOOD_SUGGEST_SCAN_MAX)
+        while position < end and keys[position].startswith(prefix):
+            key = keys[position]
+            food_id, food_name, alias = refs[position]
+            position += 1
+            # Closer to a full-key match scores higher; name hits edge out alias hits.
+            score = len(prefix) / len(key)
+            if alias:
+                score *= 0.95
+            previous = best.get(food_id)
+            if previous is None or score > previous[0]:
+                best[food_id] = (score, food_name, alias)
+    ranked = sorted(best.items(), key=lambda item: (-item[1][0], len(item[1][1]), item[1][1]))
+    return [
+        FoodSuggestItem(
+            food_id=food_id,
+            food_name=food_name,
+            alias=alias or None,
+            score=round(score, 4),
+        )
+        for food_id, (score, food_name, alias) in ranked[:limit]
+    ]
+
+
+def _food_suggest_remote(*, query: str, use_lang: str, limit: int) -> list[FoodSuggestItem]:
+    query_norm = _normalize_food_query(query)
+    if not query_norm:
+        return []
+    supports_lang_active = _supports_catalog_lang_active_filters()
+    rows = _supabase_rest_list(
+        "food_catalog",
+        [
+            ("select", "id,food_name,canonical_name"),
+            ("or", f"food_name.ilike.{query_norm}*,canonical_name.ilike.{query_norm}*"),
+            *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if supports_lang_active else ()),
+            ("limit", str(limit * 3)),
+        ],
+        timeout=FOOD_SEARCH_DEADLINE_SEC,
+    )
+    best: dict[str, tuple[float, str]] = {}
+    for row in rows:
+        food_id = str(row.get("id") or "").strip()
+        food_name = str(row.get("food_name") or row.get("canonical_name") or "").strip()
+        if not food_id or not food_name:
+            continue
+        score = 0.0
+        for name in (row.get("food_name"), row.get("canonical_name")):
+            name_norm = _normalize_food_query(str(name or ""))
+            if name_norm.startswith(query_norm):
+                score = max(score, len(query_norm) / len(name_norm))
+        if food_id not in best or score > best[food_id][0]:
+            best[food_id] = (score, food_name)
+    ranked = sorted(best.items(), key=lambda item: (-item[1][0], len(item[1][1]), item[1][1]))
+    return [
+        FoodSuggestItem(food_id=food_id, food_name=food_name, score=round(score, 4))
+        for food_id, (score, food_name) in ranked[:limit]
+    ]
+
+
+def _food_search_index_catalog_visible(index: dict[str, Any], row: dict, use_lang: str) -> bool:
+    if not index.get("supports_lang_active"):
+        return True
+    return str(row.get("lang") or "") == use_lang and row.get("is_active") is True
+
+
+def _food_search_index_collect(
+    index: dict[str, Any],
+    *,
+    query_candidates: list[str],
+    use_lang: str,
+    query_limit: int,
+) -> tuple[list[tuple[str, int, dict]], list[tuple[str, int, dict]], dict[str, dict]]:
+    catalog_by_id: dict[str, dict] = index["catalog_by_id"]
+    catalog_entries: list[tuple[str, str, str]] = index["catalog_entries"]
+    alias_entries: list[tuple[dict, str]] = index["alias_entries"]
+    supports_lang_active = bool(index.get("supports_lang_active"))
+
+    alias_candidates: list[tuple[str, int, dict]] = []
+    direct_candidates: list[tuple[str, int, dict]] = []
+    for candidate_rank, query_norm in enumerate(query_candidates):
+        alias_positions = [
+            position
+            for position in _food_search_index_lookup(index["alias_postings"], query_norm)
+            if query_norm in alias_entries[position][1]
+        ]
+        if supports_lang_active:
+            alias_langs = _alias_search_lang_candidates(use_lang, query_norm)
+        else:
+            alias_langs = [""]
+        for alias_lang in alias_langs:
+            taken = 0
+            for position in alias_positions:
+                row = alias_entries[position][0]
+                if alias_lang and str(row.get("lang") or "") != alias_lang:
+                    continue
+                alias_candidates.append((query_norm, candidate_rank, row))
+                taken += 1
+                if taken >= query_limit:
+                    break
+
+        taken = 0
+        for position in _food_search_index_lookup(index["catalog_postings"], query_norm):
+            food_id, food_name_lower, canonical_lower = catalog_entries[position]
+            if query_norm not in food_name_lower and query_norm not in canonical_lower:
+                continue
+            row = catalog_by_id[food_id]
+            if not _food_search_index_catalog_visible(index, row, use_lang):
+                continue
+            direct_candidates.append((query_norm, candidate_rank, row))
+            taken += 1
+            if taken >= query_limit:
+                break
+
+    hydrated_by_id: dict[str, dict] = {}
+    for _, _, alias_row in alias_candidates:
+        food_id = str(alias_row.get("food_id") or "").strip()
+        row = catalog_by_id.get(food_id)
+        if row is None or food_id in hydrated_by_id:
+            continue
+        if _food_search_index_catalog_visible(index, row, use_lang):
+            hydrated_by_id[food_id] = row
+    return alias_candidates, direct_candidates, hydrated_by_id
+
+
+def _food_search_index_refresh() -> bool:
+    global _food_search_index
+    started = time.perf_counter()
+    try:
+        index = _food_search_index_build()
+    except Exception as exc:
+        logging.warning("Food search index refresh failed: %s", exc)
+        return False
+    if index is None:
+        logging.warning("Food search index refresh got no catalog rows; keeping previous index")
+        return False
+    _food_search_index = index
+    _clear_food_search_cache()
+    logging.info(
+        "Food search index refreshed: catalog=%s aliases=%s elapsed_ms=%s",
+        len(index["catalog_entries"]),
+        len(index["alias_entries"]),
+        int((time.perf_counter() - started) * 1000),
+    )
+    return True
+
+
+def _food_search_index_worker() -> None:
+    while not _background_stop.is_set():
+        _food_search_index_refresh()
+        _background_stop.wait(FOOD_SEARCH_INDEX_REFRESH_SEC)
+
+
+def _food_search_index_status() -> dict[str, Any]:
+    index = _food_search_index
+    if index is None:
+        return {"enabled": FOOD_SEARCH_INDEX_ENABLED, "ready": False}
+    return {
+        "enabled": FOOD_SEARCH_INDEX_ENABLED,
+        "ready": True,
+        "built_at": datetime.fromtimestamp(float(index["built_at"]), tz=timezone.utc).isoformat(),
+        "catalog_rows": len(index["catalog_entries"]),
+        "alias_rows": len(index["alias_entries"]),
+        "suggest_keys": {lang: len(bucket["keys"]) for lang, bucket in index.get("suggest", {}).items()},
+        "refresh_sec": FOOD_SEARCH_INDEX_REFRESH_SEC,
+    }
+
+
+@app.on_event("startup")
+def _start_usage_log_compactor() -> None:
+    threading.Thread(
+        target=_usage_log_worker,
+        name="usage-log-compactor",
+        daemon=True,
+    ).start()
+
+
+@app.on_event("startup")
+def _start_daily_count_flusher() -> None:
+    if DAILY_COUNT_STORE == "sqlite":
+        return
+    threading.Thread(
+        target=_daily_count_worker,
+        name="daily-count-flush",
+        daemon=True,
+    ).start()
+
+
+@app.on_event("startup")
+def _start_food_search_index() -> None:
+    if not FOOD_SEARCH_INDEX_ENABLED:
+        return
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logging.warning("Food search index enabled but Supabase is not configured; using live queries")
+        return
+    # Requests fall back to live PostgREST queries until the first build completes.
+    threading.Thread(
+        target=_food_search_index_worker,
+        name="food-search-index",
+        daemon=True,
+    ).start()
+
+
+def _food_search_cache_get(key: tuple[str, str, int]) -> Optional[FoodSearchResponse]:
+    if FOOD_SEARCH_CACHE_TTL_SEC <= 0:
+        return None
+    with _food_search_cache_lock:
+        entry = _food_search_cache.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                _food_search_cache.pop(key, None)
+            _food_search_cache_stats["misses"] += 1
+            return None
+        _food_search_cache.move_to_end(key)
+        _food_search_cache_stats["hits"] += 1
+        return entry[1].model_copy(deep=True)
+
+
+def _food_search_cache_put(key: tuple[str, str, int], response: FoodSearchResponse, version: Optional[str]) -> None:
+    if FOOD_SEARCH_CACHE_TTL_SEC <= 0:
+        return
+    with _food_search_cache_lock:
+        # Drop results computed against a catalog version that changed mid-request.
+        if version != _food_search_cache_version:
+            return
+        _food_search_cache[key] = (time.time() + FOOD_SEARCH_CACHE_TTL_SEC, response.model_copy(deep=True))
+        _food_search_cache.move_to_end(key)
+        while len(_food_search_cache) > FOOD_SEARCH_CACHE_MAX:
+            _food_search_cache.popitem(last=False)
+
+
+def _clear_food_search_cache() -> None:
+    with _food_search_cache_lock:
+        _food_search_cache.clear()
+
+
+def _fetch_catalog_version() -> Optional[str]:
+    global _catalog_version_supported
+    try:
+        headers = _supabase_headers()
+    except HTTPException:
+        return None
+    try:
+        resp = _get_supabase_http_client().get(
+            f"{SUPABASE_URL}/rest/v1/catalog_meta",
+            headers=headers,
+            params=[("select", "value"), ("key", "eq.catalog_version"), ("limit", "1")],
+        )
+    except Exception as exc:
+        logging.info("Catalog version check failed: %s", exc)
+        return None
+    if resp.status_code == 404:
+        # Table not installed (backend/sql/catalog_version.sql); rely on TTL only.
+        _catalog_version_supported = False
+        return None
+    if resp.status_code >= 400:
+        return None
+    rows = _parse_json_response_utf8(resp)
+    if isinstance(rows, list) and rows and isinstance(rows[0], dict):
+        return str(rows[0].get("value") or "")
+    return None
+
+
+def _catalog_version_worker() -> None:
+    global _food_search_cache_version
+    while _catalog_version_supported is not False:
+        version = _fetch_catalog_version()
+        if version is not None:
+            with _food_search_cache_lock:
+                if version != _food_search_cache_version:
+                    if _food_search_cache_version is not None:
+                        logging.info("Catalog version changed, clearing %s cached searches", len(_food_search_cache))
+                    _food_search_cache.clear()
+                    _food_search_cache_version = version
+        if _background_stop.wait(FOOD_SEARCH_CACHE_VERSION_CHECK_SEC):
+            return
+
+
+def _food_search_cache_status() -> dict[str, Any]:
+    with _food_search_cache_lock:
+        return {
+            "size": len(_food_search_cache),
+            "hits": _food_search_cache_stats["hits"],
+            "misses": _food_search_cache_stats["misses"],
+            "catalog_version": _food_search_cache_version,
+            "ttl_sec": FOOD_SEARCH_CACHE_TTL_SEC,
+        }
+
+
+@app.on_event("startup")
+def _start_catalog_version_watcher() -> None:
+    if FOOD_SEARCH_CACHE_TTL_SEC <= 0:
+        return
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        return
+    threading.Thread(
+        target=_catalog_version_worker,
+        name="catalog-version",
+        daemon=True,
+    ).start()
+
+
+def _require_admin(request: Request) -> None:
+    if ADMIN_API_KEY:
+        provided = request.headers.get("x-admin-key") or request.headers.get("X-Admin-Key")
+        if not provided or provided.strip() != ADMIN_API_KEY:
+            raise HTTPException(status_code=401, detail="admin_required")
+        return
+    client_host = request.client.host if request.client else ""
+    if client_host not in {"127.0.0.1", "::1", "localhost"}:
+        raise HTTPException(status_code=401, detail="admin_required")
+
+
+def _get_jwks_client() -> PyJWKClient:
+    global _jwks_client
+    if _jwks_client is not None:
+        return _jwks_client
+    if not SUPABASE_URL:
+        raise HTTPException(status_code=500, detail="supabase_not_configured")
+    jwks_url = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"
+    _jwks_client = PyJWKClient(jwks_url)
+    return _jwks_client
+
+
+def _decode_bearer_token(token: str) -> dict:
+    jwks_client = _get_jwks_client()
+    signing_key = jwks_client.get_signing_key_from_jwt(token)
+    header = jwt.get_unverified_header(token)
+    alg = header.get("alg") or "RS256"
+    allowed = {"RS256", "ES256"}
+    if alg not in allowed:
+        raise HTTPException(status_code=401, detail="invalid_token_alg")
+    return jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=[alg],
+        audience="authenticated",
+        issuer=f"{SUPABASE_URL}/auth/v1",
+    )
+
+
+def _parse_iso_datetime(value: Any) -> Optional[datetime]:
+    raw = str(value or "").strip()
+    if not raw:
+        return None
+    try:
+        parsed = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed
+    except Exception:
+        return None
+
+
+def _normalize_plan_id(value: Any) -> Optional[str]:
+    plan = str(value or "").strip().lower()
+    if plan in {"free", "pro", "plus"}:
+        return plan
+    return None
+
+
+def _parse_millis_datetime(value: Any) -> Optional[datetime]:
+    raw = str(value or "").strip()
+    if not raw:
+        return None
+    try:
+        millis = int(raw)
+    except Exception:
+        return None
+    if millis <= 0:
+        return None
+    try:
+        return datetime.fromtimestamp(millis / 1000.0, tz=timezone.utc)
+    except Exception:
+        return None
+
+
+def _ios_product_plan(product_id: str) -> Optional[str]:
+    pid = (product_id or "").strip()
+    if not pid:
+        return None
+    if pid in IOS_PLAN_PRO_PRODUCT_IDS:
+        return "pro"
+    if pid in IOS_PLAN_PLUS_PRODUCT_IDS:
+        return "plus"
+    return None
+
+
+def _ios_verify_status_detail(status: int) -> str:
+    mapping = {
+        0: "ok",
+        21000: "ios_receipt_bad_json",
+        21002: "ios_receipt_invalid",
+        21003: "ios_receipt_auth_failed",
+        21004: "ios_shared_secret_mismatch",
+        21005: "ios_verify_temporarily_unavailable",
+        21006: "subscription_expired",
+        21007: "ios_sandbox_receipt_on_production",
+        21008: "ios_production_receipt_on_sandbox",
+        21010: "ios_receipt_not_found",
+    }
+    if status in mapping:
+        return mapping[status]
+    return f"ios_verify_failed_{status}"
+
+
+def _post_ios_verify(url: str, payload: dict) -> dict:
+    try:
+        with httpx.Client(timeout=15) as client:
+            resp = client.post(url, headers={"Content-Type": "application/json"}, json=payload)
+    except Exception as exc:
+        logging.warning("Apple verifyReceipt request failed: %s", exc)
+        raise HTTPException(status_code=502, detail="ios_verify_unavailable")
     if resp.status_code >= 400:
         logging.warning("Apple verifyReceipt HTTP %s: %s", resp.status_code, resp.text[:180])
         raise HTTPException(status_code=502, detail="ios_verify_unavailable")
@@ -6714,7 +8138,8 @@ def _extract_ios_subscription(receipt_payload: dict, product_id: str) -> tuple[O
     return best_row, best_expires
 
 
-def _profile_access_from_profile(user_id: str) -> dict[str, Any]:
+def _profile_access_from_profile(user_id: str) -> Optional[dict[str, Any]]:
+    # None when the profile could not be read; {} when the user has no profile row yet.
     global _profile_plan_columns_supported
     headers = _supabase_headers()
     base_url = f"{SUPABASE_URL}/rest/v1/profiles?id=eq.{user_id}"
@@ -6723,8 +8148,7 @@ def _profile_access_from_profile(user_id: str) -> dict[str, Any]:
     select_with_plan = "trial_start,plan_id,subscription_expires_at"
     if _profile_plan_columns_supported is not False:
         try:
-            with httpx.Client(timeout=10) as client:
-                resp = client.get(f"{base_url}&select={select_with_plan}", headers=headers)
+            resp = _get_supabase_http_client().get(f"{base_url}&select={select_with_plan}", headers=headers)
             if resp.status_code < 400:
                 parsed = _parse_json_response_utf8(resp)
                 if isinstance(parsed, list):
@@ -6744,25 +8168,24 @@ def _profile_access_from_profile(user_id: str) -> dict[str, Any]:
                         resp.status_code,
                         resp.text[:180],
                     )
-                    return {}
+                    return None
         except Exception as exc:
             logging.warning("Supabase profiles fetch error (fallback to local): %s", exc)
-            return {}
+            return None
 
     if rows is None:
         try:
-            with httpx.Client(timeout=10) as client:
-                resp = client.get(f"{base_url}&select=trial_start", headers=headers)
+            resp = _get_supabase_http_client().get(f"{base_url}&select=trial_start", headers=headers)
         except Exception as exc:
             logging.warning("Supabase profiles fetch error (fallback to local): %s", exc)
-            return {}
+            return None
         if resp.status_code >= 400:
             logging.warning("Supabase profiles fetch failed (%s), fallback to local", resp.status_code)
-            return {}
+            return None
         parsed = _parse_json_response_utf8(resp)
         if not isinstance(parsed, list):
             logging.warning("Supabase profiles parse failed, fallback to local")
-            return {}
+            return None
         rows = parsed
 
     if not rows:
@@ -6785,8 +8208,7 @@ def _upsert_profile_trial(user_id: str, email: str, trial_start: datetime) -> No
     }]
     url = f"{SUPABASE_URL}/rest/v1/profiles"
     try:
-        with httpx.Client(timeout=10) as client:
-            resp = client.post(url, headers=headers, json=payload)
+        resp = _get_supabase_http_client().post(url, headers=headers, json=payload)
         if resp.status_code >= 400:
             logging.warning("Supabase profiles upsert failed (%s): %s", resp.status_code, resp.text)
     except Exception as exc:
@@ -6814,8 +8236,7 @@ def _upsert_profile_subscription(
     }]
     url = f"{SUPABASE_URL}/rest/v1/profiles"
     try:
-        with httpx.Client(timeout=10) as client:
-            resp = client.post(url, headers=headers, json=payload)
+        resp = _get_supabase_http_client().post(url, headers=headers, json=payload)
     except Exception as exc:
         logging.warning("Supabase profiles subscription upsert error (ignored): %s", exc)
         return
@@ -6839,13 +8260,57 @@ def _upsert_profile_subscription(
     _profile_plan_columns_supported = True
 
 
+def _cached_profile_access(user_id: str) -> Optional[dict[str, Any]]:
+    if PROFILE_ACCESS_CACHE_TTL_SEC <= 0:
+        return None
+    with _profile_access_cache_lock:
+        entry = _profile_access_cache.get(user_id)
+        if not entry:
+            return None
+        if entry["expires_at"] <= time.time():
+            _profile_access_cache.pop(user_id, None)
+            return None
+        return dict(entry["access"])
+
+
+def _store_profile_access(user_id: str, access: dict[str, Any]) -> None:
+    if PROFILE_ACCESS_CACHE_TTL_SEC <= 0:
+        return
+    now_ts = time.time()
+    with _profile_access_cache_lock:
+        _profile_access_cache.pop(user_id, None)
+        if len(_profile_access_cache) >= PROFILE_ACCESS_CACHE_MAX:
+            expired = [key for key, value in _profile_access_cache.items() if value["expires_at"] <= now_ts]
+            for key in expired:
+                _profile_access_cache.pop(key, None)
+            while len(_profile_access_cache) >= PROFILE_ACCESS_CACHE_MAX:
+                _profile_access_cache.pop(next(iter(_profile_access_cache)), None)
+        _profile_access_cache[user_id] = {
+            "access": dict(access),
+            "expires_at": now_ts + PROFILE_ACCESS_CACHE_TTL_SEC,
+        }
+
+
+def _invalidate_profile_access(user_id: str) -> None:
+    with _profile_access_cache_lock:
+        _profile_access_cache.pop(user_id, None)
+
+
 def _ensure_profile_access(user_id: str, email: str) -> dict[str, Any]:
+    cached = _cached_profile_access(user_id)
+    if cached is not None:
+        return cached
     access = _profile_access_from_profile(user_id)
+    if access is None:
+        # Supabase is unreachable: let this request through as a fresh trial, but do not
+        # cache that guess or write it back over a trial_start we could not read.
+        return {"trial_start": datetime.now(timezone.utc)}
     trial_start = access.get("trial_start")
     if trial_start is None:
         trial_start = datetime.now(timezone.utc)
         _upsert_profile_trial(user_id, email, trial_start)
     access["trial_start"] = trial_start
+    _store_profile_access(user_id, access)
     return access
 
 
@@ -7336,34 +8801,156 @@ def _parse_iso(ts: str) -> Optional[datetime]:
         return None
 
 
-def _prune_usage_log() -> None:
-    if not _usage_log_path.exists():
-        return
-    try:
-        lines = _usage_log_path.read_text(encoding="utf-8").splitlines()
-    except Exception:
-        return
-    if not lines:
-        return
-    cutoff = datetime.now(timezone.utc) - timedelta(days=USAGE_LOG_TTL_DAYS)
-    entries = []
-    for line in lines:
+def _new_usage_bucket() -> Dict[str, Any]:
+    return {
+        "count": 0,
+        "cost_usd": 0.0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "image_bytes": 0,
+        "ai_retries": 0,
+        "ai_errors": 0,
+    }
+
+
+def _new_usage_rollups() -> Dict[str, Any]:
+    return {
+        "totals": _new_usage_bucket(),
+        "by_day": {},
+        "by_model": {},
+        "by_source": {},
+        "by_lang": {},
+    }
+
+
+def _usage_rollups_add(rollups: Dict[str, Any], record: dict) -> None:
+    cost = float(record.get("cost_estimate_usd") or 0)
+    input_tokens = int(record.get("input_tokens") or 0)
+    output_tokens = int(record.get("output_tokens") or 0)
+    image_bytes = int(record.get("image_bytes") or 0)
+    ai_retries = int(record.get("ai_retries") or 0)
+    failed = bool(record.get("error"))
+    created_at = _parse_iso(str(record.get("created_at", "")))
+    keys = {
+        "by_day": created_at.date().isoformat() if created_at else "unknown",
+        "by_model": str(record.get("model") or "unknown"),
+        "by_source": str(record.get("source") or "unknown"),
+        "by_lang": str(record.get("lang") or "unknown"),
+    }
+    buckets = [rollups["totals"]]
+    for group, key in keys.items():
+        bucket = rollups[group].get(key)
+        if bucket is None:
+            bucket = _new_usage_bucket()
+            rollups[group][key] = bucket
+        buckets.append(bucket)
+    for bucket in buckets:
+        bucket["ai_retries"] += ai_retries
+        if failed:
+            bucket["ai_errors"] += 1
+            continue
+        bucket["count"] += 1
+        bucket["cost_usd"] += cost
+        bucket["input_tokens"] += input_tokens
+        bucket["output_tokens"] += output_tokens
+        bucket["image_bytes"] += image_bytes
+
+
+def _parse_usage_lines(raw: bytes) -> tuple[list[dict], int]:
+    records = []
+    total_lines = 0
+    for line in raw.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            continue
+        total_lines += 1
         try:
             record = json.loads(line)
         except Exception:
             continue
+        if isinstance(record, dict):
+            records.append(record)
+    return records, total_lines
+
+
+def _install_usage_state(records: list[dict], rollups: Dict[str, Any]) -> None:
+    # Caller holds _usage_log_lock.
+    global _usage_rollups, _usage_tail
+    _usage_rollups = rollups
+    _usage_tail = deque(records[-USAGE_TAIL_MAX:], maxlen=USAGE_TAIL_MAX)
+
+
+def _compact_usage_log() -> None:
+    with _usage_log_compact_lock:
+        _compact_usage_log_locked()
+
+
+def _compact_usage_log_locked() -> None:
+    global _usage_log_estimated_lines
+    with _usage_log_lock:
+        if not _usage_log_path.exists() or _usage_log_path.stat().st_size == 0:
+            _usage_log_estimated_lines = 0
+            _install_usage_state([], _new_usage_rollups())
+            return
+        snapshot_size = _usage_log_path.stat().st_size
+    try:
+        with _usage_log_path.open("rb") as handle:
+            raw = handle.read(snapshot_size)
+    except Exception as exc:
+        logging.warning("Usage log compaction read failed: %s", exc)
+        return
+    cutoff = datetime.now(timezone.utc) - timedelta(days=USAGE_LOG_TTL_DAYS)
+    records, total_lines = _parse_usage_lines(raw)
+    entries = []
+    for record in records:
         created_at = _parse_iso(str(record.get("created_at", "")))
         if created_at and created_at < cutoff:
             continue
-        entries.append(record)
-    if not entries:
-        _usage_log_path.write_text("", encoding="utf-8")
-        return
-    entries.sort(key=lambda item: _parse_iso(str(item.get("created_at", ""))) or datetime.min.replace(tzinfo=timezone.utc))
-    if len(entries) > USAGE_LOG_MAX:
-        entries = entries[-USAGE_LOG_MAX:]
-    content = "\n".join(json.dumps(item, ensure_ascii=True) for item in entries)
-    _usage_log_path.write_text(content + "\n", encoding="utf-8")
+        entries.append((created_at or datetime.min.replace(tzinfo=timezone.utc), record))
+    needs_rewrite = len(entries) != total_lines or total_lines > USAGE_LOG_MAX
+    if needs_rewrite:
+        entries.sort(key=lambda item: item[0])
+        if len(entries) > USAGE_LOG_MAX:
+            entries = entries[-USAGE_LOG_MAX:]
+    kept = [record for _, record in entries]
+    rollups = _new_usage_rollups()
+    for record in kept:
+        _usage_rollups_add(rollups, record)
+    tmp_path = _usage_log_path.with_suffix(".jsonl.tmp")
+    # Records appended while we were parsing are carried over verbatim.
+    with _usage_log_lock:
+        try:
+            with _usage_log_path.open("rb") as handle:
+                handle.seek(snapshot_size)
+                tail = handle.read()
+            if needs_rewrite:
+                content = "".join(json.dumps(record, ensure_ascii=True) + "\n" for record in kept)
+                tmp_path.write_bytes(content.encode("utf-8") + tail)
+                os.replace(tmp_path, _usage_log_path)
+        except Exception as exc:
+            logging.warning("Usage log compaction write failed: %s", exc)
+            return
+        tail_records, tail_lines = _parse_usage_lines(tail)
+        for record in tail_records:
+            _usage_rollups_add(rollups, record)
+        _install_usage_state(kept + tail_records, rollups)
+        _usage_log_estimated_lines = len(kept) + tail_lines
+    if needs_rewrite:
+        logging.info("Usage log compacted: %s -> %s records", total_lines, len(kept))
+
+
+def _ensure_usage_state() -> None:
+    if _usage_rollups is None:
+        _compact_usage_log()
+
+
+def _usage_log_worker() -> None:
+    while not _background_stop.is_set():
+        _usage_log_compact_wakeup.clear()
+        try:
+            _compact_usage_log()
+        except Exception as exc:
+            logging.warning("Usage log compaction failed: %s", exc)
+        _usage_log_compact_wakeup.wait(USAGE_LOG_COMPACT_SEC)
 
 
 def _prune_analysis_cache(data: dict) -> dict:
@@ -7387,10 +8974,22 @@ def _prune_analysis_cache(data: dict) -> dict:
 
 
 def _append_usage(record: dict) -> None:
+    global _usage_log_estimated_lines
     line = json.dumps(record, ensure_ascii=True)
-    with _usage_log_path.open("a", encoding="utf-8") as handle:
-        handle.write(line + "\n")
-    _prune_usage_log()
+    with _usage_log_lock:
+        with _usage_log_path.open("a", encoding="utf-8") as handle:
+            handle.write(line + "\n")
+        _usage_log_estimated_lines += 1
+        if _usage_rollups is not None:
+            _usage_rollups_add(_usage_rollups, record)
+            _usage_tail.append(record)
+        over_limit = _usage_log_estimated_lines > USAGE_LOG_MAX + max(100, USAGE_LOG_MAX // 10)
+    if over_limit:
+        _usage_log_compact_wakeup.set()
+
+
+def _today_key() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
 
 
 def _load_daily_counts() -> dict:
@@ -7403,31 +9002,397 @@ def _load_daily_counts() -> dict:
 
 
 def _save_daily_counts(data: dict) -> None:
-    _daily_count_path.write_text(json.dumps(data, ensure_ascii=True), encoding="utf-8")
+    tmp_path = _daily_count_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=True), encoding="utf-8")
+    os.replace(tmp_path, _daily_count_path)
+
+
+def _open_daily_count_db() -> sqlite3.Connection:
+    global _daily_count_db
+    if _daily_count_db is not None:
+        return _daily_count_db
+    conn = sqlite3.connect(str(_daily_count_db_path), check_same_thread=False, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS daily_counts ("
+        "day TEXT NOT NULL, user_key TEXT NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (day, user_key))"
+    )
+    conn.commit()
+    _daily_count_db = conn
+    return conn
 
 
-def _load_analysis_cache() -> dict:
-    if not _analysis_cache_path.exists():
-        return {}
+def _roll_daily_counts(today: str) -> None:
+    # Caller holds _daily_count_lock. Drops every past day on the first call of a new UTC day.
+    global _daily_counts_day, _daily_counts, _daily_counts_dirty
+    if _daily_counts_day == today:
+        return
+    if DAILY_COUNT_STORE == "sqlite":
+        conn = _open_daily_count_db()
+        with conn:
+            conn.execute("DELETE FROM daily_counts WHERE day < ?", (today,))
+        _daily_counts = {}
+    elif _daily_counts_day is None:
+        persisted = _load_daily_counts()
+        stored = persisted.get(today) if isinstance(persisted, dict) else None
+        _daily_counts = {
+            str(key): int(value or 0)
+            for key, value in (stored.items() if isinstance(stored, dict) else [])
+        }
+        _daily_counts_dirty = isinstance(persisted, dict) and len(persisted) > 1
+    else:
+        _daily_counts = {}
+        _daily_counts_dirty = True
+    _daily_counts_day = today
+
+
+def _get_daily_count(key: str) -> int:
+    today = _today_key()
+    with _daily_count_lock:
+        _roll_daily_counts(today)
+        if DAILY_COUNT_STORE == "sqlite":
+            row = _open_daily_count_db().execute(
+                "SELECT count FROM daily_counts WHERE day = ? AND user_key = ?",
+                (today, key),
+            ).fetchone()
+            return int(row[0]) if row else 0
+        return _daily_counts.get(key, 0)
+
+
+def _bump_daily_count(key: str) -> None:
+    global _daily_counts_dirty
+    today = _today_key()
+    with _daily_count_lock:
+        _roll_daily_counts(today)
+        if DAILY_COUNT_STORE == "sqlite":
+            conn = _open_daily_count_db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO daily_counts (day, user_key, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT (day, user_key) DO UPDATE SET count = count + 1",
+                    (today, key),
+                )
+            return
+        _daily_counts[key] = _daily_counts.get(key, 0) + 1
+        _daily_counts_dirty = True
+
+
+def _flush_daily_counts() -> None:
+    global _daily_counts_dirty
+    if DAILY_COUNT_STORE == "sqlite":
+        return
+    with _daily_count_lock:
+        if not _daily_counts_dirty or _daily_counts_day is None:
+            return
+        snapshot = {_daily_counts_day: dict(_daily_counts)}
+        _daily_counts_dirty = False
+    try:
+        _save_daily_counts(snapshot)
+    except Exception as exc:
+        logging.warning("Daily count flush failed: %s", exc)
+        with _daily_count_lock:
+            _daily_counts_dirty = True
+
+
+def _daily_count_worker() -> None:
+    while not _background_stop.wait(DAILY_COUNT_FLUSH_SEC):
+        _flush_daily_counts()
+
+
+def _open_analysis_cache() -> sqlite3.Connection:
+    global _analysis_cache_db, _analysis_cache_count
+    if _analysis_cache_db is not None:
+        return _analysis_cache_db
+    conn = sqlite3.connect(str(_analysis_cache_db_path), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS analysis_cache ("
+        "image_hash TEXT PRIMARY KEY, saved_at REAL NOT NULL, entry TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_saved_at ON analysis_cache (saved_at)")
+    columns = {str(row[1]) for row in conn.execute("PRAGMA table_info(analysis_cache)")}
+    if "dhash" not in columns:
+        conn.execute("ALTER TABLE analysis_cache ADD COLUMN dhash INTEGER")
+    if "dhash_scope" not in columns:
+        conn.execute("ALTER TABLE analysis_cache ADD COLUMN dhash_scope TEXT")
+    count = int(conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0])
+    if count == 0 and _analysis_cache_path.exists():
+        count = _import_legacy_analysis_cache(conn)
+    _analysis_dhash_index.clear()
+    # Rows written before dhash_scope existed have no owner fingerprint and are only
+    # served to exact-hash lookups.
+    for image_hash, dhash, scope, saved_at in conn.execute(
+        "SELECT image_hash, dhash, dhash_scope, saved_at FROM analysis_cache "
+        "WHERE dhash IS NOT NULL AND dhash_scope IS NOT NULL"
+    ):
+        _analysis_dhash_index[str(image_hash)] = (int(dhash) & 0xFFFFFFFFFFFFFFFF, str(scope), float(saved_at))
+    _analysis_cache_db = conn
+    _analysis_cache_count = count
+    return conn
+
+
+def _import_legacy_analysis_cache(conn: sqlite3.Connection) -> int:
+    # One-time migration from the old whole-file JSON cache.
     try:
         data = json.loads(_analysis_cache_path.read_text(encoding="utf-8"))
-        if not isinstance(data, dict):
-            return {}
-        pruned = _prune_analysis_cache(data)
-        if len(pruned) != len(data):
-            _analysis_cache_path.write_text(json.dumps(pruned, ensure_ascii=True), encoding="utf-8")
-        return pruned
     except Exception:
-        return {}
+        return 0
+    if not isinstance(data, dict):
+        return 0
+    rows = []
+    for key, value in _prune_analysis_cache(data).items():
+        saved_at = _parse_iso(str(value.get("saved_at", "")))
+        saved_ts = saved_at.timestamp() if saved_at else time.time()
+        rows.append((str(key), saved_ts, json.dumps(value, ensure_ascii=True)))
+    if not rows:
+        return 0
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO analysis_cache (image_hash, saved_at, entry) VALUES (?, ?, ?)",
+            rows,
+        )
+    try:
+        _analysis_cache_path.rename(_analysis_cache_path.with_suffix(".json.migrated"))
+    except Exception:
+        pass
+    logging.info("Analysis cache migrated %s entries to sqlite", len(rows))
+    return len(rows)
 
 
-def _save_analysis_cache(data: dict) -> None:
-    pruned = _prune_analysis_cache(data)
-    _analysis_cache_path.write_text(json.dumps(pruned, ensure_ascii=True), encoding="utf-8")
+def _close_analysis_cache() -> None:
+    global _analysis_cache_db
+    with _analysis_cache_lock:
+        if _analysis_cache_db is not None:
+            try:
+                _analysis_cache_db.close()
+            except Exception:
+                pass
+            _analysis_cache_db = None
 
 
-def _hash_image(image_bytes: bytes) -> str:
-    return hashlib.sha1(image_bytes).hexdigest()
+def _analysis_cache_cutoff_ts() -> float:
+    return time.time() - ANALYSIS_CACHE_TTL_DAYS * 86400
+
+
+def _evict_analysis_cache(conn: sqlite3.Connection) -> None:
+    # Bounded per call so a long-idle cache is drained over several writes
+    # instead of stalling one request.
+    expired = [
+        str(row[0])
+        for row in conn.execute(
+            "SELECT image_hash FROM analysis_cache WHERE saved_at < ? ORDER BY saved_at LIMIT ?",
+            (_analysis_cache_cutoff_ts(), ANALYSIS_CACHE_EVICT_BATCH),
+        )
+    ]
+    _delete_analysis_cache_rows(conn, expired)
+    overflow = _analysis_cache_count - ANALYSIS_CACHE_MAX
+    if overflow > 0:
+        oldest = [
+            str(row[0])
+            for row in conn.execute(
+                "SELECT image_hash FROM analysis_cache ORDER BY saved_at LIMIT ?",
+                (overflow,),
+            )
+        ]
+        _delete_analysis_cache_rows(conn, oldest)
+
+
+def _delete_analysis_cache_rows(conn: sqlite3.Connection, image_hashes: list[str]) -> None:
+    global _analysis_cache_count
+    if not image_hashes:
+        return
+    removed = conn.executemany(
+        "DELETE FROM analysis_cache WHERE image_hash = ?",
+        [(image_hash,) for image_hash in image_hashes],
+    ).rowcount
+    _analysis_cache_count -= max(0, removed)
+    for image_hash in image_hashes:
+        _analysis_dhash_index.pop(image_hash, None)
+
+
+def _analysis_cache_get(image_hash: str) -> Optional[dict]:
+    try:
+        with _analysis_cache_lock:
+            conn = _open_analysis_cache()
+            row = conn.execute(
+                "SELECT saved_at, entry FROM analysis_cache WHERE image_hash = ?",
+                (image_hash,),
+            ).fetchone()
+        if not row or float(row[0]) < _analysis_cache_cutoff_ts():
+            return None
+        entry = json.loads(row[1])
+        return entry if isinstance(entry, dict) else None
+    except Exception as exc:
+        logging.warning("Analysis cache read failed: %s", exc)
+        return None
+
+
+def _analysis_cache_put(
+    image_hash: str,
+    entry: dict,
+    dhash: Optional[int] = None,
+    dhash_scope: Optional[str] = None,
+) -> None:
+    global _analysis_cache_count
+    saved_at = _parse_iso(str(entry.get("saved_at", "")))
+    saved_ts = saved_at.timestamp() if saved_at else time.time()
+    # SQLite integers are signed 64-bit.
+    stored_dhash = dhash - (1 << 64) if dhash is not None and dhash >= (1 << 63) else dhash
+    try:
+        payload = json.dumps(entry, ensure_ascii=True)
+        with _analysis_cache_lock:
+            conn = _open_analysis_cache()
+            with conn:
+                existed = conn.execute(
+                    "SELECT 1 FROM analysis_cache WHERE image_hash = ?",
+                    (image_hash,),
+                ).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (image_hash, saved_at, entry, dhash, dhash_scope) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (image_hash, saved_ts, payload, stored_dhash, dhash_scope),
+                )
+                if not existed:
+                    _analysis_cache_count += 1
+                if dhash is not None and dhash_scope:
+                    _analysis_dhash_index[image_hash] = (dhash, dhash_scope, saved_ts)
+                else:
+                    _analysis_dhash_index.pop(image_hash, None)
+                _evict_analysis_cache(conn)
+    except Exception as exc:
+        logging.warning("Analysis cache write failed: %s", exc)
+
+
+def _analysis_dhash_scope(user_id: str, profile: dict) -> str:
+    # Near-duplicate hits are only shared between requests from the same user with the
+    # same profile, since the stored suggestion is personalized.
+    canonical = json.dumps({"user_id": user_id, "profile": profile}, ensure_ascii=True, sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _analysis_cache_find_similar(dhash: int, scope: str) -> Optional[tuple[str, dict, int]]:
+    # Linear Hamming scan: ANALYSIS_CACHE_MAX bounds the index to a few thousand ints.
+    cutoff = _analysis_cache_cutoff_ts()
+    matches: list[tuple[int, str]] = []
+    try:
+        with _analysis_cache_lock:
+            _open_analysis_cache()
+            expired = []
+            for image_hash, (candidate, candidate_scope, saved_at) in _analysis_dhash_index.items():
+                if saved_at < cutoff:
+                    expired.append(image_hash)
+                    continue
+                if candidate_scope != scope:
+                    continue
+                distance = (candidate ^ dhash).bit_count()
+                if distance <= ANALYSIS_DHASH_MAX_DISTANCE:
+                    matches.append((distance, image_hash))
+            # Expired rows stay in sqlite until eviction but never match again.
+            for image_hash in expired:
+                _analysis_dhash_index.pop(image_hash, None)
+    except Exception as exc:
+        logging.warning("Analysis dhash lookup failed: %s", exc)
+        return None
+    # Nearest first; fall through to the next candidate if a row vanished meanwhile.
+    for distance, image_hash in sorted(matches):
+        entry = _analysis_cache_get(image_hash)
+        if entry is not None:
+            return image_hash, entry, distance
+    return None
+
+
+async def _read_upload_image(upload: UploadFile) -> tuple[str, int]:
+    # The multipart parser spools uploads over 1 MB to disk; requests whose
+    # Content-Length is already too large never get here (_image_upload_limit_middleware).
+    # Reject oversized files from the declared part size, then hash in chunks straight
+    # from the spool so the raw upload is never held in memory; _prepare_vision_image
+    # decodes from the same file.
+    if upload.size is not None and upload.size > IMAGE_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="image_too_large")
+    digest = hashlib.sha1()
+    size = 0
+    while True:
+        chunk = await upload.read(IMAGE_UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > IMAGE_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="image_too_large")
+        digest.update(chunk)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="missing_image")
+    await upload.seek(0)
+    return digest.hexdigest(), size
+
+
+def _read_image_source(image: Union[bytes, BinaryIO]) -> bytes:
+    if isinstance(image, bytes):
+        return image
+    image.seek(0)
+    return image.read()
+
+
+def _image_dhash(image_bytes: bytes) -> Optional[int]:
+    # 64-bit difference hash (9x8 grayscale, adjacent-pixel gradients). Survives
+    # re-encoding, rescaling and small crops that change the SHA-1. CPU bound.
+    if Image is None or not image_bytes:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            source.draft("L", (64, 64))
+            image = ImageOps.exif_transpose(source).convert("L").resize((9, 8), Image.BILINEAR)
+            pixels = list(image.getdata())
+    except Exception as exc:
+        logging.warning("Image dhash failed: %s", exc)
+        return None
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+
+def _prepare_vision_image(image: Union[bytes, BinaryIO]) -> bytes:
+    # Decode, EXIF-rotate, shrink to IMAGE_MAX_EDGE and re-encode as JPEG before the
+    # bytes are base64-inlined into the vision request. Takes bytes or the spooled
+    # upload file; the full original is only read into memory when it is sent as-is.
+    # Blocking file I/O and CPU work: call via to_thread.
+    if not IMAGE_PREPROCESS_ENABLED or Image is None:
+        return _read_image_source(image)
+    if isinstance(image, bytes):
+        original_size = len(image)
+        stream: BinaryIO = io.BytesIO(image)
+    else:
+        stream = image
+        original_size = stream.seek(0, io.SEEK_END)
+        stream.seek(0)
+    try:
+        with Image.open(stream) as source:
+            rotated = source.getexif().get(0x0112, 1) not in (0, 1)
+            oversized = max(source.size) > IMAGE_MAX_EDGE
+            # Lets the JPEG decoder scale by 1/2..1/8 while decoding instead of afterwards.
+            source.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+            rendered = ImageOps.exif_transpose(source)
+            if rendered.mode in ("RGBA", "LA", "P"):
+                rendered = rendered.convert("RGBA")
+                background = Image.new("RGB", rendered.size, (255, 255, 255))
+                background.paste(rendered, mask=rendered.getchannel("A"))
+                rendered = background
+            elif rendered.mode != "RGB":
+                rendered = rendered.convert("RGB")
+            rendered.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+            buffer = io.BytesIO()
+            rendered.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except Exception as exc:
+        logging.warning("Image preprocess failed, sending original bytes: %s", exc)
+        return _read_image_source(image)
+    processed = buffer.getvalue()
+    if not rotated and not oversized and len(processed) >= original_size:
+        return _read_image_source(image)
+    return processed
 
 
 def _should_use_ai(user_id: str | None) -> bool:
@@ -7435,14 +9400,7 @@ def _should_use_ai(user_id: str | None) -> bool:
         return False
     if FREE_DAILY_LIMIT <= 0:
         return True
-    counts = _load_daily_counts()
-    today = datetime.now(timezone.utc).date().isoformat()
-    today_counts = counts.get(today, {})
-    if isinstance(today_counts, dict):
-        current = int(today_counts.get(user_id or "_global", 0))
-    else:
-        current = int(today_counts or 0)
-    return current < FREE_DAILY_LIMIT
+    return _get_daily_count(user_id or "_global") < FREE_DAILY_LIMIT
 
 
 def _ensure_ai_available(user_id: str | None) -> None:
@@ -7454,46 +9412,134 @@ def _ensure_ai_available(user_id: str | None) -> None:
         raise HTTPException(status_code=429, detail="ai_quota_exceeded")
 
 
-def _increment_daily_count(user_id: str | None) -> None:
-    counts = _load_daily_counts()
-    today = datetime.now(timezone.utc).date().isoformat()
-    today_counts = counts.get(today)
-    if not isinstance(today_counts, dict):
-        today_counts = {}
-    key = user_id or "_global"
-    today_counts[key] = int(today_counts.get(key, 0)) + 1
-    counts[today] = today_counts
-    _save_daily_counts(counts)
+def _increment_daily_count(user_id: str | None) -> None:
+    _bump_daily_count(user_id or "_global")
+
+
+def _new_rate_limiter(name: str, limit: int, window_sec: int) -> dict[str, Any]:
+    return {
+        "name": name,
+        "limit": limit,
+        "window_sec": max(1, window_sec),
+        "keys": OrderedDict(),
+        "lock": threading.Lock(),
+        "last_sweep_window": 0,
+    }
+
+
+def _sliding_window_estimate(window_sec: int, now: float, window_index: int, current: int, previous: int) -> float:
+    # Weighted two-bucket estimate of the trailing window; exact at window edges.
+    elapsed = (now - window_index * window_sec) / window_sec
+    return previous * max(0.0, 1.0 - elapsed) + current
+
+
+def _rate_limit_allowed(limiter: dict[str, Any], key: str) -> bool:
+    if limiter["limit"] <= 0:
+        return True
+    if RATE_LIMIT_STORE == "sqlite":
+        try:
+            return _rate_limit_allowed_sqlite(limiter, key)
+        except Exception as exc:
+            logging.warning("Shared rate limit store failed (%s), using local: %s", limiter["name"], exc)
+    now = time.time()
+    window_sec = limiter["window_sec"]
+    window_index = int(now // window_sec)
+    keys: OrderedDict = limiter["keys"]
+    with limiter["lock"]:
+        state = keys.get(key)
+        if state is None:
+            state = [window_index, 0, 0]
+            keys[key] = state
+        else:
+            keys.move_to_end(key)
+            if state[0] != window_index:
+                state[2] = state[1] if state[0] == window_index - 1 else 0
+                state[1] = 0
+                state[0] = window_index
+        while keys:
+            oldest_key, oldest = next(iter(keys.items()))
+            if len(keys) <= RATE_LIMIT_MAX_KEYS and oldest[0] >= window_index - 1:
+                break
+            keys.pop(oldest_key, None)
+        estimate = _sliding_window_estimate(window_sec, now, window_index, state[1], state[2])
+        if estimate + 1 > limiter["limit"]:
+            return False
+        state[1] += 1
+        return True
+
+
+def _open_rate_limit_db() -> sqlite3.Connection:
+    global _rate_limit_db
+    if _rate_limit_db is not None:
+        return _rate_limit_db
+    conn = sqlite3.connect(
+        str(_rate_limit_db_path),
+        check_same_thread=False,
+        timeout=5,
+        isolation_level=None,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS rate_limits ("
+        "scope TEXT NOT NULL, key TEXT NOT NULL, window_index INTEGER NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (scope, key, window_index))"
+    )
+    _rate_limit_db = conn
+    return conn
+
+
+def _rate_limit_allowed_sqlite(limiter: dict[str, Any], key: str) -> bool:
+    now = time.time()
+    window_sec = limiter["window_sec"]
+    window_index = int(now // window_sec)
+    scope = limiter["name"]
+    with _rate_limit_db_lock:
+        conn = _open_rate_limit_db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if limiter["last_sweep_window"] != window_index:
+                conn.execute(
+                    "DELETE FROM rate_limits WHERE scope = ? AND window_index < ?",
+                    (scope, window_index - 1),
+                )
+                limiter["last_sweep_window"] = window_index
+            rows = conn.execute(
+                "SELECT window_index, count FROM rate_limits "
+                "WHERE scope = ? AND key = ? AND window_index >= ?",
+                (scope, key, window_index - 1),
+            ).fetchall()
+            counts = {int(row[0]): int(row[1]) for row in rows}
+            estimate = _sliding_window_estimate(
+                window_sec,
+                now,
+                window_index,
+                counts.get(window_index, 0),
+                counts.get(window_index - 1, 0),
+            )
+            allowed = estimate + 1 <= limiter["limit"]
+            if allowed:
+                conn.execute(
+                    "INSERT INTO rate_limits (scope, key, window_index, count) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (scope, key, window_index) DO UPDATE SET count = count + 1",
+                    (scope, key, window_index),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return allowed
+
+
+_chat_rate_limiter = _new_rate_limiter("chat", _chat_rate_limit, _chat_rate_window_sec)
+_analysis_rate_limiter = _new_rate_limiter("analysis", _analysis_rate_limit, _analysis_rate_window_sec)
 
 
 def _chat_rate_allowed(user_id: str) -> bool:
-    if _chat_rate_limit <= 0:
-        return True
-    now = time.time()
-    window = _chat_rate_window_sec
-    entries = _chat_rate_state.get(user_id, [])
-    entries = [t for t in entries if now - t <= window]
-    if len(entries) >= _chat_rate_limit:
-        _chat_rate_state[user_id] = entries
-        return False
-    entries.append(now)
-    _chat_rate_state[user_id] = entries
-    return True
+    return _rate_limit_allowed(_chat_rate_limiter, user_id)
 
 
 def _analysis_rate_allowed(user_id: str) -> bool:
-    if _analysis_rate_limit <= 0:
-        return True
-    now = time.time()
-    window = _analysis_rate_window_sec
-    entries = _analysis_rate_state.get(user_id, [])
-    entries = [t for t in entries if now - t <= window]
-    if len(entries) >= _analysis_rate_limit:
-        _analysis_rate_state[user_id] = entries
-        return False
-    entries.append(now)
-    _analysis_rate_state[user_id] = entries
-    return True
+    return _rate_limit_allowed(_analysis_rate_limiter, user_id)
 
 
 def _find_latest_user_message(messages: List[ChatMessageInput]) -> str:
@@ -7755,50 +9801,386 @@ def _model_candidates(primary_model: str) -> list[str]:
     return candidates
 
 
-def _create_chat_completion(
+def _is_transient_ai_error(exc: Exception) -> bool:
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def _model_circuit(model_name: str) -> Dict[str, Any]:
+    # Caller holds _model_circuits_lock.
+    circuit = _model_circuits.get(model_name)
+    if circuit is None:
+        circuit = {"state": "closed", "events": deque(), "opened_at": 0.0, "probing": False, "opens": 0}
+        _model_circuits[model_name] = circuit
+    return circuit
+
+
+def _model_circuit_acquire(model_name: str) -> bool:
+    now = time.monotonic()
+    with _model_circuits_lock:
+        circuit = _model_circuit(model_name)
+        if circuit["state"] == "closed":
+            return True
+        if circuit["state"] == "open":
+            if now - circuit["opened_at"] < MODEL_CIRCUIT_OPEN_SEC:
+                return False
+            circuit["state"] = "half_open"
+            circuit["probing"] = False
+        # Half-open: exactly one request probes the model; the rest keep routing around it.
+        if circuit["probing"]:
+            return False
+        circuit["probing"] = True
+        return True
+
+
+def _model_circuit_record(model_name: str, ok: bool, latency_sec: float) -> None:
+    now = time.monotonic()
+    failed = not ok or latency_sec >= MODEL_CIRCUIT_SLOW_SEC
+    with _model_circuits_lock:
+        circuit = _model_circuit(model_name)
+        events: deque = circuit["events"]
+        events.append((now, failed, latency_sec))
+        cutoff = now - MODEL_CIRCUIT_WINDOW_SEC
+        while events and events[0][0] < cutoff:
+            events.popleft()
+        if circuit["state"] == "half_open":
+            circuit["probing"] = False
+            if failed:
+                circuit["state"] = "open"
+                circuit["opened_at"] = now
+            else:
+                circuit["state"] = "closed"
+                events.clear()
+            logging.warning("OpenAI model circuit probe: model=%s recovered=%s", model_name, not failed)
+            return
+        if circuit["state"] != "closed" or len(events) < MODEL_CIRCUIT_MIN_CALLS:
+            return
+        failures = sum(1 for event in events if event[1])
+        if failures / len(events) >= MODEL_CIRCUIT_ERROR_RATE:
+            circuit["state"] = "open"
+            circuit["opened_at"] = now
+            circuit["opens"] += 1
+            logging.warning(
+                "OpenAI model circuit opened: model=%s failures=%s/%s window=%ss",
+                model_name,
+                failures,
+                len(events),
+                MODEL_CIRCUIT_WINDOW_SEC,
+            )
+
+
+def _model_circuit_release(model_name: str) -> None:
+    # A half-open probe that ended without a health verdict (e.g. a 400 caused by the
+    # request itself) frees the probe slot for the next caller.
+    with _model_circuits_lock:
+        circuit = _model_circuits.get(model_name)
+        if circuit is not None and circuit["state"] == "half_open":
+            circuit["probing"] = False
+
+
+def _model_circuit_status() -> dict[str, Any]:
+    now = time.monotonic()
+    with _model_circuits_lock:
+        status: dict[str, Any] = {}
+        for model_name, circuit in _model_circuits.items():
+            events = [event for event in circuit["events"] if event[0] >= now - MODEL_CIRCUIT_WINDOW_SEC]
+            latencies = sorted(event[2] for event in events)
+            status[model_name] = {
+                "state": circuit["state"],
+                "calls": len(events),
+                "failures": sum(1 for event in events if event[1]),
+                "p50_latency_ms": int(latencies[len(latencies) // 2] * 1000) if latencies else None,
+                "max_latency_ms": int(latencies[-1] * 1000) if latencies else None,
+                "opens": circuit["opens"],
+            }
+        return status
+
+
+def _ai_retry_after_sec(exc: Exception) -> float | None:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = str(headers.get("retry-after") or "").strip()
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def _ai_retry_delay(exc: Exception, retries: int, remaining_sec: float) -> float | None:
+    if retries >= AI_RETRY_MAX or not _is_transient_ai_error(exc):
+        return None
+    delay = _ai_retry_after_sec(exc)
+    if delay is None:
+        delay = random.uniform(0, min(AI_RETRY_MAX_DELAY_SEC, AI_RETRY_BASE_SEC * (2 ** retries)))
+    elif delay > AI_RETRY_MAX_DELAY_SEC:
+        return None
+    # Only retry when the wait still leaves room for a useful attempt.
+    if remaining_sec - delay < AI_RETRY_MIN_ATTEMPT_SEC:
+        return None
+    return delay
+
+
+def _ai_usage_fields(stats: dict | None = None) -> dict:
+    stats = stats or _ai_call_stats.get()
+    if not stats:
+        return {}
+    return {
+        "ai_purpose": stats["purpose"],
+        "ai_attempts": stats["attempts"],
+        "ai_retries": stats["retries"],
+        "ai_backoff_ms": stats["backoff_ms"],
+        "ai_queue_ms": stats["queue_ms"],
+        "ai_latency_ms": stats["latency_ms"],
+    }
+
+
+def _ai_slot_limit(priority: int) -> int:
+    return AI_MAX_INFLIGHT if priority == 0 else AI_MAX_INFLIGHT - AI_INTERACTIVE_RESERVED
+
+
+def _ai_admission_dispatch() -> None:
+    waiters = _ai_admission["waiters"]
+    while waiters:
+        priority, _, future = waiters[0]
+        if future.done():
+            heapq.heappop(waiters)
+            continue
+        # The head is the highest-priority waiter; if it cannot start, nobody behind it can.
+        if _ai_admission["in_flight"] >= _ai_slot_limit(priority):
+            return
+        heapq.heappop(waiters)
+        _ai_admission["in_flight"] += 1
+        _ai_admission["admitted"][priority] += 1
+        future.set_result(None)
+
+
+def _ai_admission_release() -> None:
+    _ai_admission["in_flight"] = max(0, _ai_admission["in_flight"] - 1)
+    _ai_admission_dispatch()
+
+
+async def _ai_admission_acquire(purpose: str, deadline: float, stats: dict) -> None:
+    priority = _AI_PRIORITY_BY_PURPOSE.get(purpose, 1)
+    waiters = _ai_admission["waiters"]
+    while waiters and waiters[0][2].done():
+        heapq.heappop(waiters)
+    queued_ahead = bool(waiters) and waiters[0][0] <= priority
+    if not queued_ahead and _ai_admission["in_flight"] < _ai_slot_limit(priority):
+        _ai_admission["in_flight"] += 1
+        _ai_admission["admitted"][priority] += 1
+        return
+    # Shed now rather than queue a call that could not finish inside its deadline anyway.
+    budget = deadline - time.monotonic() - AI_RETRY_MIN_ATTEMPT_SEC
+    if budget <= 0 or len(waiters) >= AI_QUEUE_MAX:
+        _ai_admission["shed"][priority] += 1
+        raise RuntimeError("ai_overloaded")
+    future = asyncio.get_running_loop().create_future()
+    _ai_admission["seq"] += 1
+    entry = (priority, _ai_admission["seq"], future)
+    heapq.heappush(waiters, entry)
+    queued_at = time.monotonic()
+    try:
+        await asyncio.wait_for(asyncio.shield(future), budget)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+        if future.done() and not future.cancelled():
+            # Admitted in the same tick the wait gave up; hand the slot back.
+            _ai_admission_release()
+        else:
+            future.cancel()
+            waiters.remove(entry)
+            heapq.heapify(waiters)
+        if isinstance(exc, asyncio.CancelledError):
+            raise
+        _ai_admission["shed"][priority] += 1
+        logging.warning(
+            "AI call shed: purpose=%s class=%s waited=%.2fs in_flight=%s queued=%s",
+            purpose,
+            _AI_PRIORITY_NAMES[priority],
+            time.monotonic() - queued_at,
+            _ai_admission["in_flight"],
+            len(waiters),
+        )
+        raise RuntimeError("ai_overloaded") from None
+    finally:
+        stats["queue_ms"] += int((time.monotonic() - queued_at) * 1000)
+
+
+def _ai_admission_status() -> dict[str, Any]:
+    queued = [0, 0, 0]
+    for priority, _, future in _ai_admission["waiters"]:
+        if not future.done():
+            queued[priority] += 1
+    return {
+        "in_flight": _ai_admission["in_flight"],
+        "max_in_flight": AI_MAX_INFLIGHT,
+        "interactive_reserved": AI_INTERACTIVE_RESERVED,
+        "queued": dict(zip(_AI_PRIORITY_NAMES, queued)),
+        "admitted": dict(zip(_AI_PRIORITY_NAMES, _ai_admission["admitted"])),
+        "shed": dict(zip(_AI_PRIORITY_NAMES, _ai_admission["shed"])),
+    }
+
+
+async def _complete_with_model_fallback(
+    *,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    primary_model: str,
+    deadline: float,
+    stats: dict,
+    stream: bool,
+) -> tuple[Any, str]:
+    candidates = _model_candidates(primary_model)
+    # Models with an open circuit are skipped. If every circuit is open, go through
+    # the list anyway rather than failing without trying.
+    routed = [candidate for candidate in candidates if _model_circuit_acquire(candidate)]
+    if not routed:
+        routed = candidates
+    elif routed[0] != primary_model:
+        logging.info("OpenAI routing around open circuit: primary=%s using=%s", primary_model, routed[0])
+    last_exc: Exception | None = None
+    # Every routed model past this index still holds its half-open probe slot. The
+    # finally hands those back on any exit, including cancellation (a BaseException).
+    settled = 0
+    try:
+        for index, candidate in enumerate(routed):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("ai_deadline_exceeded")
+            started = time.monotonic()
+            stats["attempts"] += 1
+            stream_kwargs: Dict[str, Any] = {}
+            if stream:
+                stream_kwargs = {"stream": True, "stream_options": {"include_usage": True}}
+            try:
+                response = await _client.chat.completions.create(
+                    model=candidate,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=min(OPENAI_TIMEOUT_SEC, remaining),
+                    **stream_kwargs,
+                )
+                _model_circuit_record(candidate, True, time.monotonic() - started)
+                settled = index + 1
+                if candidate != primary_model:
+                    logging.warning(
+                        "OpenAI model fallback success: primary=%s used=%s",
+                        primary_model,
+                        candidate,
+                    )
+                return response, candidate
+            except Exception as exc:
+                last_exc = exc
+                unavailable = _is_model_unavailable_error(exc)
+                transient = _is_transient_ai_error(exc)
+                if unavailable or transient:
+                    _model_circuit_record(candidate, False, time.monotonic() - started)
+                    settled = index + 1
+                should_fallback = (unavailable or transient) and index < len(routed) - 1
+                if should_fallback:
+                    logging.warning(
+                        "OpenAI model %s: model=%s err=%s; trying fallback",
+                        "unavailable" if unavailable else "failed",
+                        candidate,
+                        exc,
+                    )
+                    continue
+                raise
+    finally:
+        for unsettled in routed[settled:]:
+            _model_circuit_release(unsettled)
+    if last_exc is not None:
+        raise last_exc
+    raise RuntimeError("openai_request_failed")
+
+
+async def _create_chat_completion(
     *,
     messages: List[Dict[str, Any]],
     temperature: float = 0.2,
     model: str | None = None,
+    purpose: str = "default",
+    stream: bool = False,
 ) -> tuple[Any, str]:
+    # With stream=True the response is an open stream (retries only cover opening it)
+    # and the caller keeps the admission slot until it calls _ai_admission_release().
     if _client is None:
         raise RuntimeError("openai_client_unavailable")
     primary_model = (model or OPENAI_MODEL).strip() or OPENAI_MODEL
-    candidates = _model_candidates(primary_model)
-    last_exc: Exception | None = None
-    for index, candidate in enumerate(candidates):
+    started = time.monotonic()
+    deadline = started + _AI_DEADLINE_BY_PURPOSE.get(purpose, AI_DEADLINE_DEFAULT_SEC)
+    stats = {"purpose": purpose, "attempts": 0, "retries": 0, "backoff_ms": 0, "queue_ms": 0, "latency_ms": 0}
+    # The calling endpoint reads these back through _ai_usage_fields() for its usage record.
+    _ai_call_stats.set(stats)
+    while True:
         try:
-            response = _client.chat.completions.create(
-                model=candidate,
-                messages=messages,
-                temperature=temperature,
-            )
-            if candidate != primary_model:
-                logging.warning(
-                    "OpenAI model fallback success: primary=%s used=%s",
-                    primary_model,
-                    candidate,
+            # The slot is held per attempt and given back while backing off.
+            await _ai_admission_acquire(purpose, deadline, stats)
+            try:
+                result = await _complete_with_model_fallback(
+                    messages=messages,
+                    temperature=temperature,
+                    primary_model=primary_model,
+                    deadline=deadline,
+                    stats=stats,
+                    stream=stream,
                 )
-            return response, candidate
+            except BaseException:
+                _ai_admission_release()
+                raise
+            if not stream:
+                _ai_admission_release()
+            stats["latency_ms"] = int((time.monotonic() - started) * 1000)
+            return result
         except Exception as exc:
-            last_exc = exc
-            should_fallback = _is_model_unavailable_error(exc) and index < len(candidates) - 1
-            if should_fallback:
-                logging.warning(
-                    "OpenAI model unavailable: model=%s err=%s; trying fallback",
-                    candidate,
-                    exc,
+            delay = _ai_retry_delay(exc, stats["retries"], deadline - time.monotonic())
+            if delay is None:
+                stats["latency_ms"] = int((time.monotonic() - started) * 1000)
+                _append_usage(
+                    {
+                        "id": str(uuid.uuid4()),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "model": primary_model,
+                        "source": "ai_error",
+                        "error": _ai_error_detail(exc),
+                        **_ai_usage_fields(),
+                    }
                 )
-                continue
-            raise
-    if last_exc is not None:
-        raise last_exc
-    raise RuntimeError("openai_request_failed")
+                raise
+            stats["retries"] += 1
+            stats["backoff_ms"] += int(delay * 1000)
+            logging.warning(
+                "OpenAI retry %s/%s: purpose=%s delay=%.2fs err=%s",
+                stats["retries"],
+                AI_RETRY_MAX,
+                purpose,
+                delay,
+                exc,
+            )
+            await asyncio.sleep(delay)
 
 
 def _ai_error_detail(exc: Exception) -> str:
     if _is_model_unavailable_error(exc):
         return "ai_model_unavailable"
+    if isinstance(exc, (TimeoutError, openai.APITimeoutError)):
+        return "ai_connection_error"
+    if str(exc) == "ai_overloaded":
+        return "ai_overloaded"
     text = str(exc).lower()
     if (
         "connection error" in text
@@ -7812,6 +10194,57 @@ def _ai_error_detail(exc: Exception) -> str:
     return "ai_failed"
 
 
+def _ai_text_cache_key(prompt: str, temperature: float, model: str | None = None) -> str:
+    canonical = json.dumps(
+        {"prompt": prompt, "model": (model or OPENAI_MODEL).strip() or OPENAI_MODEL, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _ai_text_cache_get(key: str) -> Optional[tuple[str, str]]:
+    if AI_TEXT_CACHE_TTL_SEC <= 0:
+        return None
+    with _ai_text_cache_lock:
+        entry = _ai_text_cache.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                _ai_text_cache.pop(key, None)
+            _ai_text_cache_stats["misses"] += 1
+            return None
+        _ai_text_cache.move_to_end(key)
+        _ai_text_cache_stats["hits"] += 1
+        return entry[1], entry[2]
+
+
+def _ai_text_cache_put(key: str, text: str, used_model: str, model: str | None = None) -> None:
+    # Only completions that passed the endpoint's validation are stored, and only when
+    # the keyed model answered: a fallback-model reply must not outlive the outage.
+    if AI_TEXT_CACHE_TTL_SEC <= 0:
+        return
+    if used_model != ((model or OPENAI_MODEL).strip() or OPENAI_MODEL):
+        return
+    with _ai_text_cache_lock:
+        _ai_text_cache[key] = (time.time() + AI_TEXT_CACHE_TTL_SEC, text, used_model)
+        _ai_text_cache.move_to_end(key)
+        while len(_ai_text_cache) > AI_TEXT_CACHE_MAX:
+            _ai_text_cache.popitem(last=False)
+            _ai_text_cache_stats["evictions"] += 1
+
+
+def _ai_text_cache_status() -> dict[str, Any]:
+    with _ai_text_cache_lock:
+        return {
+            "size": len(_ai_text_cache),
+            "hits": _ai_text_cache_stats["hits"],
+            "misses": _ai_text_cache_stats["misses"],
+            "evictions": _ai_text_cache_stats["evictions"],
+            "ttl_sec": AI_TEXT_CACHE_TTL_SEC,
+        }
+
+
 def _build_chat_prompt(
     lang: str,
     profile: dict | None,
@@ -8051,7 +10484,7 @@ def _build_chat_prompt(
     ) + profile_text
 
 
-def _analyze_with_openai(
+async def _analyze_with_openai(
     image_bytes: bytes,
     lang: str,
     food_name: str | None,
@@ -8102,7 +10535,7 @@ def _analyze_with_openai(
         prompt += f"\nUser provided food name: {food_name}. Use this as the primary dish name."
 
     image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    response, used_model = _create_chat_completion(
+    response, used_model = await _create_chat_completion(
         messages=[
             {
                 "role": "user",
@@ -8113,6 +10546,7 @@ def _analyze_with_openai(
             }
         ],
         temperature=0.2,
+        purpose="analyze",
     )
 
     text = response.choices[0].message.content or ""
@@ -8260,12 +10694,12 @@ def _coerce_food_flags(data: dict) -> tuple[bool, bool]:
     return is_beverage, is_food
 
 
-def _analyze_label_with_openai(image_bytes: bytes, lang: str) -> Optional[dict]:
+async def _analyze_label_with_openai(image_bytes: bytes, lang: str) -> Optional[dict]:
     if _client is None:
         return None
     prompt = _build_label_prompt(lang)
     image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    response, used_model = _create_chat_completion(
+    response, used_model = await _create_chat_completion(
         messages=[
             {
                 "role": "user",
@@ -8276,6 +10710,7 @@ def _analyze_label_with_openai(image_bytes: bytes, lang: str) -> Optional[dict]:
             }
         ],
         temperature=0.2,
+        purpose="label",
     )
     text = response.choices[0].message.content or ""
     data = _parse_json(text)
@@ -8304,6 +10739,29 @@ def _analyze_label_with_openai(image_bytes: bytes, lang: str) -> Optional[dict]:
     return {"result": data, "usage": usage_data, "model": used_model}
 
 
+def _analysis_result_from_cache(cached_result: dict, use_lang: str, source: str) -> AnalysisResult:
+    is_beverage, is_food = _coerce_food_flags(cached_result)
+    container_guess_type, container_guess_size = _normalize_container_guess(cached_result)
+    return AnalysisResult(
+        food_name=cached_result.get("food_name", ""),
+        calorie_range=cached_result.get("calorie_range", ""),
+        macros=_normalize_macros(cached_result, use_lang),
+        food_items=cached_result.get("food_items") or [],
+        judgement_tags=cached_result.get("judgement_tags") or [],
+        dish_summary=cached_result.get("dish_summary", ""),
+        suggestion=cached_result.get("suggestion", ""),
+        tier="cached",
+        source=source,
+        cost_estimate_usd=None,
+        is_beverage=is_beverage,
+        is_food=is_food,
+        non_food_reason=cached_result.get("non_food_reason"),
+        reference_used=cached_result.get("reference_used"),
+        container_guess_type=container_guess_type,
+        container_guess_size=container_guess_size,
+    )
+
+
 @app.post("/analyze", response_model=AnalysisResult)
 async def analyze_image(
     _auth: dict = Depends(_require_auth),
@@ -8344,8 +10802,7 @@ async def analyze_image(
     user_id = _auth.get("user_id", "")
     if user_id and not _analysis_rate_allowed(user_id):
         raise HTTPException(status_code=429, detail="analyze_rate_limited")
-    image_bytes = await image.read()
-    image_hash = _hash_image(image_bytes)
+    image_hash, image_size = await _read_upload_image(image)
 
     use_lang = lang or DEFAULT_LANG
     if use_lang not in _supported_langs:
@@ -8366,6 +10823,22 @@ async def analyze_image(
 
     tier = "full"
     portion_is_default = portion_percent in (None, 100)
+    profile = {
+        "height_cm": height_cm,
+        "weight_kg": weight_kg,
+        "age": age,
+        "gender": gender,
+        "tone": tone,
+        "persona": persona,
+        "activity_level": activity_level,
+        "target_calorie_range": target_calorie_range,
+        "goal": goal,
+        "plan_speed": plan_speed,
+    }
+    profile = {k: v for k, v in profile.items() if v not in (None, "", 0)}
+    dhash_scope = _analysis_dhash_scope(str(user_id or ""), profile)
+    vision_bytes: Optional[bytes] = None
+    image_dhash: Optional[int] = None
     if (
         not force_reanalyze_flag
         and advice_mode != "current_meal"
@@ -8386,51 +10859,34 @@ async def analyze_image(
         and today_remaining_kcal is None
         and today_protein_g is None
     ):
-        cache = _load_analysis_cache()
-        cached = cache.get(image_hash)
+        cached = _analysis_cache_get(image_hash)
         if isinstance(cached, dict) and isinstance(cached.get("result"), dict):
             logging.info("Analyze cache hit reason=%s hash=%s", analyze_reason, image_hash[:8])
-            cached_result = cached["result"]
-            is_beverage, is_food = _coerce_food_flags(cached_result)
-            container_guess_type, container_guess_size = _normalize_container_guess(cached_result)
-            return AnalysisResult(
-                food_name=cached_result.get("food_name", ""),
-                calorie_range=cached_result.get("calorie_range", ""),
-                macros=_normalize_macros(cached_result, use_lang),
-                food_items=cached_result.get("food_items") or [],
-                judgement_tags=cached_result.get("judgement_tags") or [],
-                dish_summary=cached_result.get("dish_summary", ""),
-                suggestion=cached_result.get("suggestion", ""),
-                tier="cached",
-                source="cache",
-                cost_estimate_usd=None,
-                is_beverage=is_beverage,
-                is_food=is_food,
-                non_food_reason=cached_result.get("non_food_reason"),
-                reference_used=cached_result.get("reference_used"),
-                container_guess_type=container_guess_type,
-                container_guess_size=container_guess_size,
-            )
+            return _analysis_result_from_cache(cached["result"], use_lang, source="cache")
+        if ANALYSIS_DHASH_ENABLED and Image is not None:
+            # Hash the downscaled image: cheaper to decode, and it is needed for the AI call anyway.
+            vision_bytes = await asyncio.to_thread(_prepare_vision_image, image.file)
+            image_dhash = await asyncio.to_thread(_image_dhash, vision_bytes)
+            similar = _analysis_cache_find_similar(image_dhash, dhash_scope) if image_dhash is not None else None
+            if similar is not None and isinstance(similar[1].get("result"), dict):
+                logging.info(
+                    "Analyze near-duplicate cache hit reason=%s hash=%s match=%s distance=%s",
+                    analyze_reason,
+                    image_hash[:8],
+                    similar[0][:8],
+                    similar[2],
+                )
+                return _analysis_result_from_cache(similar[1]["result"], use_lang, source="cache_similar")
 
     _ensure_ai_available(_auth.get("user_id"))
-    profile = {
-        "height_cm": height_cm,
-        "weight_kg": weight_kg,
-        "age": age,
-        "gender": gender,
-        "tone": tone,
-        "persona": persona,
-        "activity_level": activity_level,
-        "target_calorie_range": target_calorie_range,
-        "goal": goal,
-        "plan_speed": plan_speed,
-    }
-    profile = {k: v for k, v in profile.items() if v not in (None, "", 0)}
+    if vision_bytes is None:
+        vision_bytes = await asyncio.to_thread(_prepare_vision_image, image.file)
+    if ANALYSIS_DHASH_ENABLED and image_dhash is None:
+        image_dhash = await asyncio.to_thread(_image_dhash, vision_bytes)
 
     try:
-        payload = await asyncio.to_thread(
-            _analyze_with_openai,
-            image_bytes,
+        payload = await _analyze_with_openai(
+            vision_bytes,
             use_lang,
             food_name,
             profile,
@@ -8469,16 +10925,17 @@ async def analyze_image(
                 "output_tokens": output_tokens,
                 "total_tokens": int(usage_data.get("total_tokens") or 0),
                 "cost_estimate_usd": cost_estimate,
-                "image_bytes": len(image_bytes),
+                **_ai_usage_fields(),
+                "image_bytes": len(vision_bytes),
+                "image_bytes_original": image_size,
             }
         )
         final_name = food_name or payload["result"]["food_name"]
         _increment_daily_count(_auth.get("user_id"))
-        cache = _load_analysis_cache()
         is_beverage, is_food = _coerce_food_flags(payload["result"])
         normalized_macros = _normalize_macros(payload["result"], use_lang)
         container_guess_type, container_guess_size = _normalize_container_guess(payload["result"])
-        cache[image_hash] = {
+        _analysis_cache_put(image_hash, {
             "saved_at": datetime.now(timezone.utc).isoformat(),
             "result": {
                 "food_name": final_name,
@@ -8495,8 +10952,7 @@ async def analyze_image(
                 "container_guess_type": container_guess_type,
                 "container_guess_size": container_guess_size,
             },
-        }
-        _save_analysis_cache(cache)
+        }, dhash=image_dhash, dhash_scope=dhash_scope)
         return AnalysisResult(
             food_name=final_name,
             calorie_range=payload["result"]["calorie_range"],
@@ -8562,7 +11018,6 @@ async def analyze_name(
     user_id = _auth.get("user_id", "")
     if user_id and not _analysis_rate_allowed(user_id):
         raise HTTPException(status_code=429, detail="analyze_rate_limited")
-    _ensure_ai_available(_auth.get("user_id"))
     profile = payload.profile or {}
     try:
         prompt = _build_name_prompt(
@@ -8580,42 +11035,53 @@ async def analyze_name(
             payload.container_diameter_cm,
             payload.container_capacity_ml,
         )
-        response, used_model = _create_chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-        )
-        text = response.choices[0].message.content or ""
+        cache_key = _ai_text_cache_key(prompt, 0.2)
+        cached = _ai_text_cache_get(cache_key)
+        if cached is not None:
+            text, used_model = cached
+        else:
+            _ensure_ai_available(_auth.get("user_id"))
+            response, used_model = await _create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                purpose="analyze_name",
+            )
+            text = response.choices[0].message.content or ""
         data = _parse_json(text)
         if not isinstance(data, dict) or "food_name" not in data or "calorie_range" not in data:
             raise HTTPException(status_code=502, detail="ai_invalid_response")
-        usage = response.usage
         usage_data = None
-        if usage is not None:
-            usage_data = {
-                "input_tokens": usage.prompt_tokens,
-                "output_tokens": usage.completion_tokens,
-                "total_tokens": usage.total_tokens,
-            }
         cost_estimate = None
-        if usage_data is not None:
-            cost_estimate = _estimate_cost_usd(
-                int(usage_data.get("input_tokens") or 0),
-                int(usage_data.get("output_tokens") or 0),
+        # Replays cost nothing, so they are neither logged as usage nor counted against the quota.
+        if cached is None:
+            _ai_text_cache_put(cache_key, text, used_model)
+            usage = response.usage
+            if usage is not None:
+                usage_data = {
+                    "input_tokens": usage.prompt_tokens,
+                    "output_tokens": usage.completion_tokens,
+                    "total_tokens": usage.total_tokens,
+                }
+            if usage_data is not None:
+                cost_estimate = _estimate_cost_usd(
+                    int(usage_data.get("input_tokens") or 0),
+                    int(usage_data.get("output_tokens") or 0),
+                )
+            _append_usage(
+                {
+                    "id": str(uuid.uuid4()),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "model": used_model,
+                    "lang": use_lang,
+                    "source": "name",
+                    "input_tokens": int(usage_data.get("input_tokens") or 0) if usage_data else 0,
+                    "output_tokens": int(usage_data.get("output_tokens") or 0) if usage_data else 0,
+                    "total_tokens": int(usage_data.get("total_tokens") or 0) if usage_data else 0,
+                    "cost_estimate_usd": cost_estimate,
+                    **_ai_usage_fields(),
+                }
             )
-        _append_usage(
-            {
-                "id": str(uuid.uuid4()),
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "model": used_model,
-                "lang": use_lang,
-                "source": "name",
-                "input_tokens": int(usage_data.get("input_tokens") or 0) if usage_data else 0,
-                "output_tokens": int(usage_data.get("output_tokens") or 0) if usage_data else 0,
-                "total_tokens": int(usage_data.get("total_tokens") or 0) if usage_data else 0,
-                "cost_estimate_usd": cost_estimate,
-            }
-        )
-        _increment_daily_count(_auth.get("user_id"))
+            _increment_daily_count(_auth.get("user_id"))
         is_beverage, is_food = _coerce_food_flags(data)
         normalized_macros = _normalize_macros(data, use_lang)
         calorie_range = _normalize_calorie_range(
@@ -8653,6 +11119,47 @@ async def analyze_name(
         raise HTTPException(status_code=502, detail=_ai_error_detail(exc))
 
 
+def _food_search_collect(
+    *,
+    query_candidates: list[str],
+    use_lang: str,
+    query_limit: int,
+    deadline_sec: Optional[float] = None,
+) -> tuple[list[tuple[str, int, dict]], list[tuple[str, int, dict]], dict[str, dict], set[str]]:
+    # The last element lists candidates whose lookups did not finish in time; only the
+    # live table-query path can leave any. deadline_sec defaults to FOOD_SEARCH_DEADLINE_SEC
+    # and covers the RPC and any table-query fallback after it together.
+    deadline = time.monotonic() + (deadline_sec or FOOD_SEARCH_DEADLINE_SEC)
+    index = _food_search_index
+    collected = None
+    if index is not None:
+        collected = _food_search_index_collect(
+            index,
+            query_candidates=query_candidates,
+            use_lang=use_lang,
+            query_limit=query_limit,
+        )
+    elif (
+        FOOD_SEARCH_RPC_ENABLED
+        and _food_search_rpc_supported is not False
+        and _supports_catalog_lang_active_filters()
+    ):
+        collected = _food_search_rpc_collect(
+            query_candidates=query_candidates,
+            use_lang=use_lang,
+            query_limit=query_limit,
+            deadline=deadline,
+        )
+    if collected is None:
+        return _food_search_remote_collect(
+            query_candidates=query_candidates,
+            use_lang=use_lang,
+            query_limit=query_limit,
+            deadline=deadline,
+        )
+    return (*collected, set())
+
+
 @app.get("/foods/search", response_model=FoodSearchResponse)
 def foods_search(
     q: str = Query(..., min_length=1, max_length=80),
@@ -8660,156 +11167,191 @@ def foods_search(
     limit: int = Query(default=8, ge=1, le=20),
 ):
     query_candidates = _food_search_query_candidates(q)
-    if not query_candidates:
-        return FoodSearchResponse(items=[])
-    primary_query_norm = _normalize_food_query(q)
-    if not primary_query_norm:
-        primary_query_norm = query_candidates[0]
-
-    use_lang = lang or DEFAULT_LANG
-    if use_lang not in _supported_langs:
-        use_lang = "zh-TW"
-    supports_lang_active = _supports_catalog_lang_active_filters()
-
-    # Use "*" so optional columns (e.g. food_items/judgement_tags) do not break older schemas.
-    catalog_select = "*"
-    query_limit = min(60, max(20, limit * 3))
-
-    alias_candidates: list[tuple[str, int, dict]] = []
-    direct_by_id: dict[str, dict] = {}
-    direct_best_score: dict[str, float] = {}
-    direct_best_query: dict[str, str] = {}
-    for candidate_rank, query_norm in enumerate(query_candidates):
-        alias_rows: list[dict] = []
-        if supports_lang_active:
-            alias_langs = _alias_search_lang_candidates(use_lang, query_norm)
-            alias_seen: set[tuple[str, str, str]] = set()
-            for alias_lang in alias_langs:
-                rows = _supabase_rest_list(
-                    "food_aliases",
-                    [
-                        ("select", "food_id,alias,lang"),
-                        ("alias", f"ilike.*{query_norm}*"),
-                        ("lang", f"eq.{alias_lang}"),
-                        ("limit", str(query_limit)),
-                    ],
-                )
-                for row in rows:
-                    key = (
-                        str(row.get("food_id") or "").strip(),
-                        str(row.get("alias") or "").strip(),
-                        str(row.get("lang") or "").strip(),
-                    )
-                    if key in alias_seen:
-                        continue
-                    alias_seen.add(key)
-                    alias_rows.append(row)
-        else:
-            alias_rows = _supabase_rest_list(
-                "food_aliases",
-                [
-                    ("select", "food_id,alias,lang"),
-                    ("alias", f"ilike.*{query_norm}*"),
-                    ("limit", str(query_limit)),
-                ],
-            )
-        for row in alias_rows:
-            alias_candidates.append((query_norm, candidate_rank, row))
-
-        direct_rows = _supabase_rest_list(
-            "food_catalog",
-            [
-                ("select", catalog_select),
-                ("or", f"food_name.ilike.*{query_norm}*,canonical_name.ilike.*{query_norm}*"),
-                *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if supports_lang_active else ()),
-                ("limit", str(query_limit)),
-            ],
-        )
-        for row in direct_rows:
-            food_id = str(row.get("id") or "").strip()
-            if not food_id:
-                continue
-            score = _direct_food_match_score(query_norm, row)
-            score += _primary_query_bonus(primary_query_norm, row, alias_row=None)
-            score += _beverage_query_preference_delta(primary_query_norm, row)
-            score -= _candidate_rank_penalty(query_norm, primary_query_norm, candidate_rank)
-            previous = direct_best_score.get(food_id, -1.0)
-            if score > previous:
-                direct_best_score[food_id] = score
-                direct_best_query[food_id] = query_norm
-                direct_by_id[food_id] = row
-
-    alias_food_ids: list[str] = []
-    for _, _, row in alias_candidates:
-        food_id = str(row.get("food_id") or "").strip()
-        if food_id and food_id not in alias_food_ids:
-            alias_food_ids.append(food_id)
-
-    alias_needed_ids = [food_id for food_id in alias_food_ids if food_id not in direct_by_id]
-    if alias_needed_ids:
-        fetched_alias_rows = _supabase_rest_list(
-            "food_catalog",
-            [
-                ("select", catalog_select),
-                ("id", f"in.({','.join(alias_needed_ids)})"),
-                *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if supports_lang_active else ()),
-                ("limit", str(len(alias_needed_ids))),
-            ],
-        )
-        for row in fetched_alias_rows:
-            food_id = str(row.get("id") or "").strip()
-            if food_id and food_id not in direct_by_id:
-                direct_by_id[food_id] = row
-
-    if not alias_candidates and not direct_by_id:
+    if not query_candidates:
         return FoodSearchResponse(items=[])
+    primary_query_norm = _normalize_food_query(q)
+    if not primary_query_norm:
+        primary_query_norm = query_candidates[0]
 
-    best_items: dict[str, FoodSearchItem] = {}
-
-    # Candidate set A: direct match from food_name/canonical_name.
-    for food_id, catalog_row in direct_by_id.items():
-        candidate_query = direct_best_query.get(food_id) or query_candidates[0]
-        candidate = _build_food_search_item(
-            query_norm=candidate_query,
-            catalog_row=catalog_row,
-            use_lang=use_lang,
-            alias_row=None,
-            score=direct_best_score.get(food_id),
-            raw_query=q,
-        )
-        if candidate is None:
-            continue
-        best_items[food_id] = candidate
+    use_lang = lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    query_limit = min(60, max(20, limit * 3))
+    cache_key = (primary_query_norm, use_lang, limit)
+    cached = _food_search_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    cache_version = _food_search_cache_version
+
+    alias_candidates, direct_candidates, hydrated_by_id, incomplete = _food_search_collect(
+        query_candidates=query_candidates,
+        use_lang=use_lang,
+        query_limit=query_limit,
+    )
 
-    # Candidate set B: alias match (can outrank direct match).
-    for query_norm, candidate_rank, alias_row in alias_candidates:
-        food_id = str(alias_row.get("food_id") or "").strip()
-        if not food_id:
+    items = _food_search_rank(
+        raw_query=q,
+        primary_query_norm=primary_query_norm,
+        query_candidates=query_candidates,
+        use_lang=use_lang,
+        alias_candidates=alias_candidates,
+        direct_candidates=direct_candidates,
+        hydrated_by_id=hydrated_by_id,
+    )
+    # Rankings built from lookups cut off by the deadline are returned but never cached.
+    response = FoodSearchResponse(items=items[:limit], partial=bool(incomplete))
+    if not incomplete:
+        _food_search_cache_put(cache_key, response, cache_version)
+    return response
+
+
+@app.post("/foods/search_batch", response_model=FoodSearchBatchResponse)
+def foods_search_batch(payload: FoodSearchBatchRequest):
+    raw_queries = [str(query or "").strip()[:80] for query in payload.queries or []]
+    if not any(raw_queries):
+        raise HTTPException(status_code=400, detail="missing_queries")
+    if len(raw_queries) > FOOD_SEARCH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail="too_many_queries")
+    limit = max(1, min(20, int(payload.limit or 8)))
+    use_lang = payload.lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    query_limit = min(60, max(20, limit * 3))
+    cache_version = _food_search_cache_version
+
+    responses: dict[int, FoodSearchResponse] = {}
+    pending: list[tuple[int, str, str, list[str]]] = []
+    for position, raw_query in enumerate(raw_queries):
+        query_candidates = _food_search_query_candidates(raw_query) if raw_query else []
+        if not query_candidates:
+            responses[position] = FoodSearchResponse(items=[])
             continue
-        catalog_row = direct_by_id.get(food_id)
-        if catalog_row is None:
+        primary_query_norm = _normalize_food_query(raw_query) or query_candidates[0]
+        cached = _food_search_cache_get((primary_query_norm, use_lang, limit))
+        if cached is not None:
+            responses[position] = cached
             continue
-        alias_score = _food_match_score(query_norm, alias_row, catalog_row, use_lang)
-        alias_score += _primary_query_bonus(primary_query_norm, catalog_row, alias_row=alias_row)
-        alias_score += _beverage_query_preference_delta(primary_query_norm, catalog_row)
-        alias_score -= _candidate_rank_penalty(query_norm, primary_query_norm, candidate_rank)
-        candidate = _build_food_search_item(
-            query_norm=query_norm,
-            catalog_row=catalog_row,
+        pending.append((position, raw_query, primary_query_norm, query_candidates))
+
+    if pending:
+        # Dishes in one meal share many candidates (e.g. "紅茶" from several drinks), so
+        # the union is collected once and catalog rows are hydrated once per food_id.
+        merged_candidates: list[str] = []
+        for _, _, _, query_candidates in pending:
+            for query_norm in query_candidates:
+                if query_norm not in merged_candidates:
+                    merged_candidates.append(query_norm)
+        # The merged lookup covers every uncached dish, so it gets a budget sized to them
+        # rather than the single-search deadline.
+        alias_all, direct_all, hydrated_by_id, incomplete = _food_search_collect(
+            query_candidates=merged_candidates,
             use_lang=use_lang,
-            alias_row=alias_row,
-            score=alias_score,
-            raw_query=q,
+            query_limit=query_limit,
+            deadline_sec=min(FOOD_SEARCH_BATCH_DEADLINE_SEC, FOOD_SEARCH_DEADLINE_SEC * len(pending)),
         )
-        if candidate is None:
-            continue
-        existing = best_items.get(food_id)
-        if existing is None or (candidate.match_score or 0.0) > (existing.match_score or 0.0):
-            best_items[food_id] = candidate
+        # An alias hit in one dish may point at a row another dish matched directly.
+        for _, _, row in direct_all:
+            food_id = str(row.get("id") or "").strip()
+            if food_id:
+                hydrated_by_id.setdefault(food_id, row)
+        for position, raw_query, primary_query_norm, query_candidates in pending:
+            ranks = {query_norm: rank for rank, query_norm in enumerate(query_candidates)}
+            # Re-rank against this dish's own candidate order so score ties break as in /foods/search.
+            alias_candidates = sorted(
+                ((query_norm, ranks[query_norm], row) for query_norm, _, row in alias_all if query_norm in ranks),
+                key=lambda candidate: candidate[1],
+            )
+            direct_candidates = sorted(
+                ((query_norm, ranks[query_norm], row) for query_norm, _, row in direct_all if query_norm in ranks),
+                key=lambda candidate: candidate[1],
+            )
+            items = _food_search_rank(
+                raw_query=raw_query,
+                primary_query_norm=primary_query_norm,
+                query_candidates=query_candidates,
+                use_lang=use_lang,
+                alias_candidates=alias_candidates,
+                direct_candidates=direct_candidates,
+                hydrated_by_id=hydrated_by_id,
+            )
+            partial = not incomplete.isdisjoint(query_candidates)
+            response = FoodSearchResponse(items=items[:limit], partial=partial)
+            if not partial:
+                _food_search_cache_put((primary_query_norm, use_lang, limit), response, cache_version)
+            responses[position] = response
+
+    results: list[FoodSearchBatchResult] = []
+    for position, raw_query in enumerate(raw_queries):
+        items = responses[position].items
+        results.append(
+            FoodSearchBatchResult(
+                query=raw_query,
+                items=items,
+                best_match=_best_catalog_food_match(raw_query, items) if raw_query else None,
+                partial=responses[position].partial,
+            )
+        )
+    return FoodSearchBatchResponse(results=results)
 
-    items = list(best_items.values())
-    items.sort(key=lambda item: item.match_score or 0.0, reverse=True)
-    return FoodSearchResponse(items=items[:limit])
+
+@app.get("/foods/suggest", response_model=FoodSuggestResponse)
+def foods_suggest(
+    q: str = Query(..., min_length=1, max_length=80),
+    lang: str = Query(default=None),
+    limit: int = Query(default=8, ge=1, le=20),
+):
+    # Typeahead: ids and names only. The client calls /foods/item for the picked suggestion.
+    use_lang = lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    index = _food_search_index
+    if index is not None and "suggest" in index:
+        items = _food_suggest_lookup(index["suggest"], query=q, use_lang=use_lang, limit=limit)
+    else:
+        items = _food_suggest_remote(query=q, use_lang=use_lang, limit=limit)
+    return FoodSuggestResponse(items=items)
+
+
+@app.get("/foods/item", response_model=FoodSearchItem)
+def foods_item(
+    food_id: str = Query(..., min_length=1, max_length=64),
+    lang: str = Query(default=None),
+    q: Optional[str] = Query(default=None, max_length=80),
+):
+    use_lang = lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    food_id = food_id.strip()
+    # Same lang / is_active visibility as /foods/search, so a suggestion id from another
+    # language or a retired row does not resolve to an item search would never show.
+    index = _food_search_index
+    row = index["catalog_by_id"].get(food_id) if index is not None else None
+    if row is not None and not _food_search_index_catalog_visible(index, row, use_lang):
+        raise HTTPException(status_code=404, detail="food_not_found")
+    if row is None:
+        rows = _supabase_rest_list(
+            "food_catalog",
+            [
+                ("select", "*"),
+                ("id", f"eq.{food_id}"),
+                *((("lang", f"eq.{use_lang}"), ("is_active", "eq.true")) if _supports_catalog_lang_active_filters() else ()),
+                ("limit", "1"),
+            ],
+        )
+        row = rows[0] if rows else None
+    if row is None:
+        raise HTTPException(status_code=404, detail="food_not_found")
+    query_norm = _normalize_food_query(q or "") or _normalize_food_query(str(row.get("food_name") or ""))
+    # Passing the typed query keeps beverage modifiers (sugar/ice/size) in the result.
+    item = _build_food_search_item(
+        query_norm=query_norm,
+        catalog_row=row,
+        use_lang=use_lang,
+        raw_query=(q or "").strip() or None,
+    )
+    if item is None:
+        raise HTTPException(status_code=404, detail="food_not_found")
+    return item
 
 
 @app.post("/foods/search_miss")
@@ -8937,15 +11479,16 @@ async def analyze_label(
     user_id = _auth.get("user_id", "")
     if user_id and not _analysis_rate_allowed(user_id):
         raise HTTPException(status_code=429, detail="analyze_rate_limited")
-    image_bytes = await image.read()
+    _, image_size = await _read_upload_image(image)
 
     use_lang = lang or DEFAULT_LANG
     if use_lang not in _supported_langs:
         use_lang = "zh-TW"
 
     _ensure_ai_available(_auth.get("user_id"))
+    vision_bytes = await asyncio.to_thread(_prepare_vision_image, image.file)
     try:
-        payload = await asyncio.to_thread(_analyze_label_with_openai, image_bytes, use_lang)
+        payload = await _analyze_label_with_openai(vision_bytes, use_lang)
         if not payload or not payload.get("result"):
             raise HTTPException(status_code=502, detail="ai_invalid_response")
         usage_data = payload.get("usage") or {}
@@ -8968,7 +11511,9 @@ async def analyze_label(
                 "output_tokens": output_tokens,
                 "total_tokens": int(usage_data.get("total_tokens") or 0),
                 "cost_estimate_usd": cost_estimate,
-                "image_bytes": len(image_bytes),
+                **_ai_usage_fields(),
+                "image_bytes": len(vision_bytes),
+                "image_bytes_original": image_size,
             }
         )
         _increment_daily_count(_auth.get("user_id"))
@@ -8997,7 +11542,6 @@ async def summarize_day(
     use_lang = payload.lang or DEFAULT_LANG
     if use_lang not in _supported_langs:
         use_lang = "zh-TW"
-    _ensure_ai_available(_auth.get("user_id"))
     try:
         prompt = _build_day_prompt(
             use_lang,
@@ -9010,14 +11554,23 @@ async def summarize_day(
             payload.today_consumed_kcal,
             payload.today_remaining_kcal,
         )
-        response, _ = _create_chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-        )
-        text = response.choices[0].message.content or ""
+        cache_key = _ai_text_cache_key(prompt, 0.2)
+        cached = _ai_text_cache_get(cache_key)
+        if cached is not None:
+            text, used_model = cached
+        else:
+            _ensure_ai_available(_auth.get("user_id"))
+            response, used_model = await _create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                purpose="summarize_day",
+            )
+            text = response.choices[0].message.content or ""
         data = _parse_json(text)
         if not isinstance(data, dict) or "day_summary" not in data or "tomorrow_advice" not in data:
             raise HTTPException(status_code=502, detail="ai_invalid_response")
+        if cached is None:
+            _ai_text_cache_put(cache_key, text, used_model)
         return DaySummaryResponse(
             day_summary=data.get("day_summary", ""),
             tomorrow_advice=data.get("tomorrow_advice", ""),
@@ -9042,7 +11595,6 @@ async def summarize_week(
     use_lang = payload.lang or DEFAULT_LANG
     if use_lang not in _supported_langs:
         use_lang = "zh-TW"
-    _ensure_ai_available(_auth.get("user_id"))
     try:
         prompt = _build_week_prompt(
             use_lang,
@@ -9053,14 +11605,23 @@ async def summarize_week(
             payload.previous_week_summary,
             payload.previous_next_week_advice,
         )
-        response, _ = _create_chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-        )
-        text = response.choices[0].message.content or ""
+        cache_key = _ai_text_cache_key(prompt, 0.2)
+        cached = _ai_text_cache_get(cache_key)
+        if cached is not None:
+            text, used_model = cached
+        else:
+            _ensure_ai_available(_auth.get("user_id"))
+            response, used_model = await _create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                purpose="summarize_week",
+            )
+            text = response.choices[0].message.content or ""
         data = _parse_json(text)
         if not isinstance(data, dict) or "week_summary" not in data or "next_week_advice" not in data:
             raise HTTPException(status_code=502, detail="ai_invalid_response")
+        if cached is None:
+            _ai_text_cache_put(cache_key, text, used_model)
         return WeekSummaryResponse(
             week_summary=data.get("week_summary", ""),
             next_week_advice=data.get("next_week_advice", ""),
@@ -9076,6 +11637,17 @@ async def summarize_week(
         raise HTTPException(status_code=502, detail=_ai_error_detail(exc))
 
 
+def _meal_advice_response(data: dict) -> MealAdviceResponse:
+    return MealAdviceResponse(
+        self_cook=str(data.get("self_cook", "")).strip(),
+        convenience=str(data.get("convenience", "")).strip(),
+        bento=str(data.get("bento", "")).strip(),
+        other=str(data.get("other", "")).strip(),
+        source="ai",
+        confidence=data.get("confidence"),
+    )
+
+
 @app.post("/suggest_meal", response_model=MealAdviceResponse)
 async def suggest_meal(
     payload: MealAdviceRequest,
@@ -9086,18 +11658,27 @@ async def suggest_meal(
     if use_lang not in _supported_langs:
         use_lang = "zh-TW"
     profile = payload.profile or {}
-    _ensure_ai_available()
     try:
         prompt = _build_meal_advice_prompt(use_lang, profile, payload)
-        response, used_model = _create_chat_completion(
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-        )
-        text = response.choices[0].message.content or ""
+        cache_key = _ai_text_cache_key(prompt, 0.2)
+        cached = _ai_text_cache_get(cache_key)
+        if cached is not None:
+            text, used_model = cached
+        else:
+            _ensure_ai_available(_auth.get("user_id"))
+            response, used_model = await _create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                purpose="suggest_meal",
+            )
+            text = response.choices[0].message.content or ""
         data = _parse_json(text)
         required = {"self_cook", "convenience", "bento", "other"}
         if not isinstance(data, dict) or not required.issubset(set(data.keys())):
             raise HTTPException(status_code=502, detail="ai_invalid_response")
+        if cached is not None:
+            return _meal_advice_response(data)
+        _ai_text_cache_put(cache_key, text, used_model)
         usage = response.usage
         usage_data = None
         if usage is not None:
@@ -9123,17 +11704,11 @@ async def suggest_meal(
                 "output_tokens": int(usage_data.get("output_tokens") or 0) if usage_data else 0,
                 "total_tokens": int(usage_data.get("total_tokens") or 0) if usage_data else 0,
                 "cost_estimate_usd": cost_estimate,
+                **_ai_usage_fields(),
             }
         )
         _increment_daily_count(_auth.get("user_id"))
-        return MealAdviceResponse(
-            self_cook=str(data.get("self_cook", "")).strip(),
-            convenience=str(data.get("convenience", "")).strip(),
-            bento=str(data.get("bento", "")).strip(),
-            other=str(data.get("other", "")).strip(),
-            source="ai",
-            confidence=data.get("confidence"),
-        )
+        return _meal_advice_response(data)
     except HTTPException:
         raise
     except Exception as exc:
@@ -9199,11 +11774,11 @@ async def generate_week_plan(
         retailer_codes = _normalize_week_plan_retailer_codes(
             payload.retailer_codes or base_plan.retailer_codes_effective
         )
-        convenience_candidates = _week_plan_catalog_convenience_candidates(
+        convenience_candidates = await _week_plan_catalog_convenience_candidates(
             lang=use_lang,
             market_code=market_code,
             retailer_codes=retailer_codes,
-            limit=24,
+            limit=_week_plan_convenience_candidate_limit,
         )
         if len(convenience_candidates) >= 8:
             # Rotate candidate ordering per run to avoid repeatedly anchoring on the same top items.
@@ -9224,9 +11799,10 @@ async def generate_week_plan(
             fixed_meals=fixed_meals,
             convenience_candidates=convenience_candidates,
         )
-        response, used_model = _create_chat_completion(
+        response, used_model = await _create_chat_completion(
             messages=[{"role": "user", "content": prompt}],
             temperature=0.35,
+            purpose="plan_week",
         )
 
         usage = response.usage
@@ -9254,6 +11830,7 @@ async def generate_week_plan(
                 "output_tokens": int(usage_data.get("output_tokens") or 0) if usage_data else 0,
                 "total_tokens": int(usage_data.get("total_tokens") or 0) if usage_data else 0,
                 "cost_estimate_usd": cost_estimate,
+                **_ai_usage_fields(),
             }
         )
         _increment_daily_count(user_id)
@@ -9351,17 +11928,8 @@ async def replan_week(
     )
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(
-    payload: ChatRequest,
-    _auth: dict = Depends(_require_auth),
-):
-    _require_entitlement(_auth, "ai_chat")
-    use_lang = payload.lang or DEFAULT_LANG
-    if use_lang not in _supported_langs:
-        use_lang = "zh-TW"
+def _chat_precheck(payload: ChatRequest, _auth: dict, use_lang: str, latest_user: str) -> Optional[ChatResponse]:
     user_id = _auth.get("user_id", "")
-    latest_user = _find_latest_user_message(payload.messages or [])
     if _chat_is_blocked(latest_user):
         logging.warning("Chat blocked: user=%s text=%s", user_id or "-", latest_user[:200])
         return ChatResponse(
@@ -9383,94 +11951,192 @@ async def chat(
     except HTTPException as exc:
         if exc.detail in {"ai_disabled", "ai_not_configured", "ai_quota_exceeded"}:
             logging.warning("Chat AI unavailable: user=%s reason=%s", user_id or "-", exc.detail)
-            return ChatResponse(
-                reply=_chat_ai_fallback_reply(use_lang),
-                summary=payload.summary or "",
-                source="fallback",
-                confidence=0.0,
-            )
+            return _chat_fallback_response(payload, use_lang)
         raise
+    return None
+
+
+def _chat_fallback_response(payload: ChatRequest, use_lang: str) -> ChatResponse:
+    return ChatResponse(
+        reply=_chat_ai_fallback_reply(use_lang),
+        summary=payload.summary or "",
+        source="fallback",
+        confidence=0.0,
+    )
+
+
+def _chat_completion_messages(
+    payload: ChatRequest,
+    use_lang: str,
+    user_id: str,
+    latest_user: str,
+) -> List[Dict[str, Any]]:
+    today_meal_types = [
+        str(meal.get("meal_type") or "").strip()
+        for meal in (payload.today_meals or [])
+        if isinstance(meal, dict) and str(meal.get("meal_type") or "").strip()
+    ]
+    query_scope = _chat_query_day_scope(latest_user)
+    today_scoped = query_scope == "today"
+    summary_used = bool((payload.summary or "").strip()) and query_scope == "general"
+    logging.info(
+        "Chat payload debug: user=%s query_scope=%s today_scoped=%s days=%s today_meals=%s meal_types=%s summary_used=%s latest_user=%s",
+        user_id or "-",
+        query_scope,
+        today_scoped,
+        len(payload.days or []),
+        len(payload.today_meals or []),
+        today_meal_types,
+        summary_used,
+        latest_user[:120],
+    )
+    prompt = _build_chat_prompt(
+        use_lang,
+        payload.profile or {},
+        payload.days or [],
+        payload.today_meals or [],
+        payload.summary,
+        payload.context,
+        latest_user,
+    )
+    messages = [{"role": "system", "content": prompt}]
+    for msg in payload.messages:
+        role = msg.role if msg.role in {"user", "assistant"} else "user"
+        messages.append({"role": role, "content": msg.content})
+    return messages
+
+
+def _chat_response_from_text(text: str, payload: ChatRequest) -> ChatResponse:
+    data = _parse_json(text)
+    if not isinstance(data, dict) or "reply" not in data:
+        # Fallback: treat raw text as reply, allow empty summary
+        data = {
+            "reply": text.strip(),
+            "summary": payload.summary or "",
+        }
+    elif "summary" not in data:
+        data["summary"] = payload.summary or ""
+    return ChatResponse(
+        reply=str(data.get("reply", "")).strip(),
+        summary=str(data.get("summary", "")).strip(),
+        source="ai",
+        confidence=data.get("confidence"),
+    )
+
+
+def _chat_append_usage(
+    usage: Any,
+    *,
+    used_model: str,
+    use_lang: str,
+    source: str,
+    extra: Optional[dict] = None,
+) -> None:
+    input_tokens = int(getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else 0
+    output_tokens = int(getattr(usage, "completion_tokens", 0) or 0) if usage is not None else 0
+    total_tokens = int(getattr(usage, "total_tokens", 0) or 0) if usage is not None else 0
+    cost_estimate = _estimate_cost_usd(input_tokens, output_tokens) if usage is not None else None
+    _append_usage(
+        {
+            "id": str(uuid.uuid4()),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "model": used_model,
+            "lang": use_lang,
+            "source": source,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens,
+            "cost_estimate_usd": cost_estimate,
+            **(extra or _ai_usage_fields()),
+        }
+    )
+
+
+_CHAT_REPLY_KEY_RE = re.compile(r'"reply"\s*:\s*"')
+
+
+def _chat_reply_stream_delta(state: dict, chunk: str) -> str:
+    # Incrementally decodes the "reply" string out of the model's JSON output so its
+    # text can be forwarded before the object is complete. Models that answer with
+    # plain text instead of JSON are forwarded as-is.
+    state["buffer"] += chunk
+    buffer = state["buffer"]
+    if state.get("mode") is None:
+        head = buffer.lstrip()
+        if not head:
+            return ""
+        state["mode"] = "json" if head[0] in "{`" else "raw"
+    if state["mode"] == "raw":
+        return chunk
+    if state.get("done"):
+        return ""
+    pos = state.get("pos")
+    if pos is None:
+        match = _CHAT_REPLY_KEY_RE.search(buffer)
+        if match is None:
+            return ""
+        pos = match.end()
+    start = pos
+    while pos < len(buffer):
+        char = buffer[pos]
+        if char == '"':
+            state["done"] = True
+            break
+        if char != "\\":
+            pos += 1
+            continue
+        if pos + 1 >= len(buffer):
+            break
+        if buffer[pos + 1] != "u":
+            pos += 2
+            continue
+        code = buffer[pos + 2 : pos + 6]
+        if len(code) < 4:
+            break
+        # Keep surrogate pairs in one delta.
+        width = 12 if code[:2].lower() in {"d8", "d9", "da", "db"} else 6
+        if pos + width > len(buffer):
+            break
+        pos += width
+    state["pos"] = pos
+    if pos == start:
+        return ""
     try:
-        today_meal_types = [
-            str(meal.get("meal_type") or "").strip()
-            for meal in (payload.today_meals or [])
-            if isinstance(meal, dict) and str(meal.get("meal_type") or "").strip()
-        ]
-        query_scope = _chat_query_day_scope(latest_user)
-        today_scoped = query_scope == "today"
-        summary_used = bool((payload.summary or "").strip()) and query_scope == "general"
-        logging.info(
-            "Chat payload debug: user=%s query_scope=%s today_scoped=%s days=%s today_meals=%s meal_types=%s summary_used=%s latest_user=%s",
-            user_id or "-",
-            query_scope,
-            today_scoped,
-            len(payload.days or []),
-            len(payload.today_meals or []),
-            today_meal_types,
-            summary_used,
-            latest_user[:120],
-        )
-        prompt = _build_chat_prompt(
-            use_lang,
-            payload.profile or {},
-            payload.days or [],
-            payload.today_meals or [],
-            payload.summary,
-            payload.context,
-            latest_user,
-        )
-        messages = [{"role": "system", "content": prompt}]
-        for msg in payload.messages:
-            role = msg.role if msg.role in {"user", "assistant"} else "user"
-            messages.append({"role": role, "content": msg.content})
-        response, used_model = _create_chat_completion(
+        return json.loads('"' + buffer[start:pos] + '"')
+    except Exception:
+        return ""
+
+
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(
+    payload: ChatRequest,
+    _auth: dict = Depends(_require_auth),
+):
+    _require_entitlement(_auth, "ai_chat")
+    use_lang = payload.lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    user_id = _auth.get("user_id", "")
+    latest_user = _find_latest_user_message(payload.messages or [])
+    early = _chat_precheck(payload, _auth, use_lang, latest_user)
+    if early is not None:
+        return early
+    try:
+        messages = _chat_completion_messages(payload, use_lang, user_id, latest_user)
+        response, used_model = await _create_chat_completion(
             messages=messages,
             temperature=0.25,
+            purpose="chat",
         )
         text = response.choices[0].message.content or ""
-        data = _parse_json(text)
-        if not isinstance(data, dict) or "reply" not in data:
-            # Fallback: treat raw text as reply, allow empty summary
-            data = {
-                "reply": text.strip(),
-                "summary": payload.summary or "",
-            }
-        elif "summary" not in data:
-            data["summary"] = payload.summary or ""
-        usage = response.usage
-        usage_data = None
-        if usage is not None:
-            usage_data = {
-                "input_tokens": usage.prompt_tokens,
-                "output_tokens": usage.completion_tokens,
-                "total_tokens": usage.total_tokens,
-            }
-        cost_estimate = None
-        if usage_data is not None:
-            cost_estimate = _estimate_cost_usd(
-                int(usage_data.get("input_tokens") or 0),
-                int(usage_data.get("output_tokens") or 0),
-            )
-        _append_usage(
-            {
-                "id": str(uuid.uuid4()),
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "model": used_model,
-                "lang": use_lang,
-                "source": "chat",
-                "input_tokens": int(usage_data.get("input_tokens") or 0) if usage_data else 0,
-                "output_tokens": int(usage_data.get("output_tokens") or 0) if usage_data else 0,
-                "total_tokens": int(usage_data.get("total_tokens") or 0) if usage_data else 0,
-                "cost_estimate_usd": cost_estimate,
-            }
-        )
+        result = _chat_response_from_text(text, payload)
+        _chat_append_usage(response.usage, used_model=used_model, use_lang=use_lang, source="chat")
         _increment_daily_count(_auth.get("user_id"))
-        return ChatResponse(
-            reply=str(data.get("reply", "")).strip(),
-            summary=str(data.get("summary", "")).strip(),
-            source="ai",
-            confidence=data.get("confidence"),
-        )
+        return result
     except HTTPException as exc:
         if exc.detail in {
             "ai_failed",
@@ -9480,12 +12146,7 @@ async def chat(
             "ai_auth_error",
         }:
             logging.warning("Chat AI error: user=%s reason=%s", user_id or "-", exc.detail)
-            return ChatResponse(
-                reply=_chat_ai_fallback_reply(use_lang),
-                summary=payload.summary or "",
-                source="fallback",
-                confidence=0.0,
-            )
+            return _chat_fallback_response(payload, use_lang)
         raise
     except Exception as exc:
         global _last_ai_error
@@ -9494,6 +12155,100 @@ async def chat(
         raise HTTPException(status_code=502, detail=_ai_error_detail(exc))
 
 
+@app.post("/chat/stream")
+async def chat_stream(
+    payload: ChatRequest,
+    _auth: dict = Depends(_require_auth),
+):
+    # Server-sent events: "delta" events carry reply text as it is generated, and a
+    # final "done" event carries the full ChatResponse (its reply is authoritative).
+    _require_entitlement(_auth, "ai_chat")
+    use_lang = payload.lang or DEFAULT_LANG
+    if use_lang not in _supported_langs:
+        use_lang = "zh-TW"
+    user_id = _auth.get("user_id", "")
+    latest_user = _find_latest_user_message(payload.messages or [])
+    early = _chat_precheck(payload, _auth, use_lang, latest_user)
+    if early is None:
+        try:
+            messages = _chat_completion_messages(payload, use_lang, user_id, latest_user)
+            stream, used_model = await _create_chat_completion(
+                messages=messages,
+                temperature=0.25,
+                purpose="chat_stream",
+                stream=True,
+            )
+        except Exception as exc:
+            global _last_ai_error
+            _last_ai_error = str(exc)
+            logging.exception("Chat stream failed to start: %s", exc)
+            raise HTTPException(status_code=502, detail=_ai_error_detail(exc))
+        stats = _ai_call_stats.get()
+    stream_state = {"closed": early is not None}
+
+    async def close_stream() -> None:
+        # Runs from the generator and again as the response background task: Starlette
+        # still runs the background task when the client disconnects before (or while)
+        # the body is sent, which is when the generator never starts or never finishes.
+        if stream_state["closed"]:
+            return
+        stream_state["closed"] = True
+        _ai_admission_release()
+        try:
+            await stream.close()
+        except Exception as exc:
+            logging.info("Chat stream close failed: %s", exc)
+
+    async def events():
+        if early is not None:
+            yield _sse_event("done", early.model_dump())
+            return
+        started = time.monotonic()
+        first_token_ms: Optional[int] = None
+        parts: List[str] = []
+        usage = None
+        state = {"buffer": ""}
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content or ""
+                if not piece:
+                    continue
+                parts.append(piece)
+                delta = _chat_reply_stream_delta(state, piece)
+                if delta:
+                    if first_token_ms is None:
+                        first_token_ms = int((time.monotonic() - started) * 1000) + stats["latency_ms"]
+                    yield _sse_event("delta", {"text": delta})
+        except Exception as exc:
+            logging.warning("Chat stream interrupted: user=%s err=%s", user_id or "-", exc)
+            yield _sse_event("done", _chat_fallback_response(payload, use_lang).model_dump())
+            return
+        finally:
+            await close_stream()
+        result = _chat_response_from_text("".join(parts), payload)
+        stats["latency_ms"] += int((time.monotonic() - started) * 1000)
+        _chat_append_usage(
+            usage,
+            used_model=used_model,
+            use_lang=use_lang,
+            source="chat_stream",
+            extra={**_ai_usage_fields(stats), "ai_first_token_ms": first_token_ms},
+        )
+        _increment_daily_count(_auth.get("user_id"))
+        yield _sse_event("done", result.model_dump())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(close_stream),
+    )
+
+
 @app.post("/subscription/ios/verify", response_model=IosSubscriptionVerifyResponse)
 def verify_ios_subscription(
     payload: IosSubscriptionVerifyRequest,
@@ -9546,6 +12301,7 @@ def verify_ios_subscription(
         plan_id=plan_to_store,
         subscription_expires_at=expires_at,
     )
+    _invalidate_profile_access(str(_auth.get("user_id") or ""))
 
     next_auth = {
         **_auth,
@@ -9618,21 +12374,41 @@ def health(_admin: None = Depends(_require_admin)):
             "ios_plan_plus_product_ids_count": len(IOS_PLAN_PLUS_PRODUCT_IDS),
         },
         "supabase_catalog_probe": _probe_supabase_catalog(),
+        "food_search_index": _food_search_index_status(),
+        "food_search_cache": _food_search_cache_status(),
+        "model_circuits": _model_circuit_status(),
+        "ai_admission": _ai_admission_status(),
+        "ai_text_cache": _ai_text_cache_status(),
     }
 
 
+def _iter_usage_lines_reversed(block_size: int = 64 * 1024):
+    # Yields the log's lines newest first, reading fixed-size blocks back from the end
+    # so only the part that is actually returned is ever read.
+    with _usage_log_path.open("rb") as handle:
+        position = handle.seek(0, io.SEEK_END)
+        carry = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            handle.seek(position)
+            lines = (handle.read(step) + carry).split(b"\n")
+            carry = lines.pop(0)
+            for line in reversed(lines):
+                yield line
+        yield carry
+
+
 def _read_usage_records(limit: int) -> list[dict]:
-    if not _usage_log_path.exists():
+    if limit <= 0 or not _usage_log_path.exists():
         return []
-    with _usage_log_path.open("r", encoding="utf-8") as handle:
-        lines = handle.readlines()
     records = []
-    for line in reversed(lines):
+    for line in _iter_usage_lines_reversed():
         line = line.strip()
         if not line:
             continue
         try:
-            records.append(json.loads(line))
+            records.append(json.loads(line.decode("utf-8")))
         except Exception:
             continue
         if len(records) >= limit:
@@ -9719,33 +12495,44 @@ def _probe_supabase_catalog() -> dict:
 
 @app.get("/usage")
 def usage(limit: int = 50, _admin: None = Depends(_require_admin)):
+    _ensure_usage_state()
+    if limit <= USAGE_TAIL_MAX:
+        with _usage_log_lock:
+            tail = list(_usage_tail)
+        return {"records": tail[::-1][:max(0, limit)]}
     return {"records": _read_usage_records(limit)}
 
 
+def _round_usage_bucket(bucket: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "count": bucket["count"],
+        "cost_usd": round(bucket["cost_usd"], 6),
+        "input_tokens": bucket["input_tokens"],
+        "output_tokens": bucket["output_tokens"],
+        "image_bytes": bucket["image_bytes"],
+        "ai_retries": bucket["ai_retries"],
+        "ai_errors": bucket["ai_errors"],
+    }
+
+
 @app.get("/usage/summary")
 def usage_summary(_admin: None = Depends(_require_admin)):
-    total_cost = 0.0
-    total_input = 0
-    total_output = 0
-    count = 0
-    if _usage_log_path.exists():
-        with _usage_log_path.open("r", encoding="utf-8") as handle:
-            for line in handle:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    record = json.loads(line)
-                except Exception:
-                    continue
-                count += 1
-                total_cost += float(record.get("cost_estimate_usd") or 0)
-                total_input += int(record.get("input_tokens") or 0)
-                total_output += int(record.get("output_tokens") or 0)
+    _ensure_usage_state()
+    with _usage_log_lock:
+        rollups = _usage_rollups or _new_usage_rollups()
+        totals = dict(rollups["totals"])
+        groups = {
+            group: {key: _round_usage_bucket(bucket) for key, bucket in rollups[group].items()}
+            for group in ("by_day", "by_model", "by_source", "by_lang")
+        }
     return {
-        "count": count,
-        "total_cost_usd": round(total_cost, 6),
-        "total_input_tokens": total_input,
-        "total_output_tokens": total_output,
+        "count": totals["count"],
+        "total_cost_usd": round(totals["cost_usd"], 6),
+        "total_input_tokens": totals["input_tokens"],
+        "total_output_tokens": totals["output_tokens"],
+        "total_image_bytes": totals["image_bytes"],
+        "total_ai_retries": totals["ai_retries"],
+        "total_ai_errors": totals["ai_errors"],
+        **groups,
     }
 
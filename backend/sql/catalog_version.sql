@@ -0,0 +1,45 @@
+-- Catalog version stamp used by the backend to invalidate its /foods/search cache.
+-- Safe to run multiple times in Supabase SQL Editor.
+--
+-- Any write to food_catalog / food_aliases bumps catalog_meta('catalog_version');
+-- tools/catalog_upsert_supabase.py also bumps it explicitly after a sync.
+
+create table if not exists public.catalog_meta (
+  key text primary key,
+  value text not null,
+  updated_at timestamptz not null default now()
+);
+
+insert into public.catalog_meta (key, value)
+values ('catalog_version', to_char(now() at time zone 'utc', 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'))
+on conflict (key) do nothing;
+
+alter table public.catalog_meta enable row level security;
+
+create or replace function public.bump_catalog_version()
+returns trigger
+language plpgsql
+as $$
+begin
+  insert into public.catalog_meta (key, value, updated_at)
+  values (
+    'catalog_version',
+    to_char(clock_timestamp() at time zone 'utc', 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'),
+    now()
+  )
+  on conflict (key) do update
+    set value = excluded.value,
+        updated_at = excluded.updated_at;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_food_catalog_bump_version on public.food_catalog;
+create trigger trg_food_catalog_bump_version
+after insert or update or delete on public.food_catalog
+for each statement execute function public.bump_catalog_version();
+
+drop trigger if exists trg_food_aliases_bump_version on public.food_aliases;
+create trigger trg_food_aliases_bump_version
+after insert or update or delete on public.food_aliases
+for each statement execute function public.bump_catalog_version();
@@ -0,0 +1,110 @@
+-- Single round-trip search for /foods/search (called via PostgREST rpc/search_food_catalog).
+-- Safe to run multiple times in Supabase SQL Editor.
+--
+-- p_queries:     normalized query candidates, in priority order.
+-- p_alias_langs: per query, comma separated alias languages (e.g. 'zh-TW,en').
+-- p_lang:        catalog language to return.
+-- p_limit:       max hits per query (per alias language for aliases).
+--
+-- Returns direct catalog hits and alias hits with their catalog row already joined,
+-- ordered by trigram similarity inside each query so the limit keeps the closest rows.
+-- The ilike filters use idx_food_catalog_food_name_trgm / idx_food_catalog_canonical_name_trgm
+-- and idx_food_aliases_alias_trgm.
+
+create extension if not exists pg_trgm;
+
+create or replace function public.search_food_catalog(
+  p_queries text[],
+  p_alias_langs text[],
+  p_lang text,
+  p_limit integer default 24
+)
+returns table (
+  kind text,
+  candidate_rank integer,
+  hit_rank integer,
+  alias text,
+  alias_lang text,
+  food_id uuid,
+  food jsonb
+)
+language sql
+stable
+set search_path = public
+as $$
+  with q as (
+    select
+      (t.ord - 1)::integer as candidate_rank,
+      t.query_norm,
+      string_to_array(coalesce(nullif(p_alias_langs[t.ord], ''), p_lang), ',') as langs
+    from unnest(p_queries) with ordinality as t(query_norm, ord)
+    where coalesce(t.query_norm, '') <> ''
+  ),
+  direct_hits as (
+    select
+      'direct'::text as kind,
+      q.candidate_rank,
+      (row_number() over (partition by q.candidate_rank order by d.score desc, d.id))::integer as hit_rank,
+      null::text as alias,
+      null::text as alias_lang,
+      d.id as food_id,
+      to_jsonb(d) - 'score' as food
+    from q
+    cross join lateral (
+      select
+        c.*,
+        greatest(
+          similarity(c.food_name, q.query_norm),
+          similarity(coalesce(c.canonical_name, ''), q.query_norm)
+        ) as score
+      from public.food_catalog c
+      where c.lang = p_lang
+        and c.is_active
+        and (
+          c.food_name ilike '%' || q.query_norm || '%'
+          or c.canonical_name ilike '%' || q.query_norm || '%'
+        )
+      order by score desc, c.id
+      limit greatest(p_limit, 1)
+    ) d
+  ),
+  alias_hits as (
+    select
+      q.candidate_rank,
+      l.lang_ord,
+      a.alias,
+      a.lang as alias_lang,
+      a.food_id,
+      a.score,
+      a.id
+    from q
+    cross join lateral unnest(q.langs) with ordinality as l(alias_lang, lang_ord)
+    cross join lateral (
+      select fa.id, fa.alias, fa.lang, fa.food_id, similarity(fa.alias, q.query_norm) as score
+      from public.food_aliases fa
+      where fa.lang = btrim(l.alias_lang)
+        and fa.alias ilike '%' || q.query_norm || '%'
+      order by score desc, fa.id
+      limit greatest(p_limit, 1)
+    ) a
+  )
+  select * from direct_hits
+  union all
+  select
+    'alias'::text as kind,
+    ah.candidate_rank,
+    (row_number() over (partition by ah.candidate_rank order by ah.lang_ord, ah.score desc, ah.id))::integer as hit_rank,
+    ah.alias,
+    ah.alias_lang,
+    ah.food_id,
+    case when c.id is null then null else to_jsonb(c) end as food
+  from alias_hits ah
+  left join public.food_catalog c
+    on c.id = ah.food_id
+   and c.lang = p_lang
+   and c.is_active
+  order by candidate_rank, kind desc, hit_rank;
+$$;
+
+grant execute on function public.search_food_catalog(text[], text[], text, integer)
+  to service_role;
@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def test_only_primary_model_answers_are_cached(monkeypatch):
+    monkeypatch.setattr(app, "OPENAI_MODEL", "primary-model")
+    monkeypatch.setattr(app, "AI_TEXT_CACHE_TTL_SEC", 900)
+    app._ai_text_cache.clear()
+    key = app._ai_text_cache_key("summarize this day", 0.2)
+
+    app._ai_text_cache_put(key, "fallback answer", "fallback-model")
+    assert app._ai_text_cache_get(key) is None
+
+    app._ai_text_cache_put(key, "primary answer", "primary-model")
+    assert app._ai_text_cache_get(key) == ("primary answer", "primary-model")
+    app._ai_text_cache.clear()
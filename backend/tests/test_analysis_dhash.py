@@ -0,0 +1,44 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def _entry(name, saved_at):
+    return {"saved_at": saved_at.isoformat(), "result": {"food_name": name}}
+
+
+def test_similar_lookup_skips_expired_and_other_scopes(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_analysis_cache_db_path", tmp_path / "analysis_cache.sqlite3")
+    monkeypatch.setattr(app, "_analysis_cache_path", tmp_path / "analysis_cache.json")
+    monkeypatch.setattr(app, "_analysis_cache_db", None)
+    monkeypatch.setattr(app, "ANALYSIS_DHASH_MAX_DISTANCE", 6)
+    now = datetime.now(timezone.utc)
+    expired = now - timedelta(days=app.ANALYSIS_CACHE_TTL_DAYS + 1)
+    mine = app._analysis_dhash_scope("user-a", {"goal": "lose"})
+    other = app._analysis_dhash_scope("user-b", {"goal": "lose"})
+    query = 0b1111_0000
+
+    app._analysis_cache_put("nearest-expired", _entry("expired", now), dhash=query ^ 0b1, dhash_scope=mine)
+    app._analysis_cache_put("other-user", _entry("other", now), dhash=query, dhash_scope=other)
+    app._analysis_cache_put("valid", _entry("valid", now), dhash=query ^ 0b11, dhash_scope=mine)
+    # Let the nearest entry age past the TTL without an eviction pass running.
+    with app._analysis_cache_lock:
+        app._analysis_cache_db.execute(
+            "UPDATE analysis_cache SET saved_at = ? WHERE image_hash = ?",
+            (expired.timestamp(), "nearest-expired"),
+        )
+        dhash, scope, _ = app._analysis_dhash_index["nearest-expired"]
+        app._analysis_dhash_index["nearest-expired"] = (dhash, scope, expired.timestamp())
+    try:
+        found = app._analysis_cache_find_similar(query, mine)
+        assert found is not None
+        assert found[0] == "valid"
+        assert found[2] == 2
+        assert "nearest-expired" not in app._analysis_dhash_index
+        assert app._analysis_cache_find_similar(query, app._analysis_dhash_scope("user-c", {})) is None
+    finally:
+        app._close_analysis_cache()
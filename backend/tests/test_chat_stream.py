@@ -0,0 +1,81 @@
+import asyncio
+import json
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+class _FakeStream:
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+def _install_fake_client(monkeypatch, stream):
+    async def create(**kwargs):
+        return stream
+
+    monkeypatch.setattr(
+        app,
+        "_client",
+        types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create))),
+    )
+    monkeypatch.setattr(app, "CALL_REAL_AI", True)
+    monkeypatch.setattr(app, "FREE_DAILY_LIMIT", 0)
+    monkeypatch.setattr(app, "_require_entitlement", lambda auth, entitlement: None)
+    app.app.dependency_overrides[app._require_auth] = lambda: {"user_id": ""}
+
+
+def test_chat_stream_releases_slot_when_client_disconnects_before_first_chunk(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_usage_log_path", tmp_path / "usage.jsonl")
+    stream = _FakeStream()
+    _install_fake_client(monkeypatch, stream)
+    body = json.dumps({"messages": [{"role": "user", "content": "hi"}], "lang": "en"}).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/chat/stream",
+        "raw_path": b"/chat/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message["type"])
+        if message["type"] == "http.response.start":
+            # The disconnect lands while the response headers are still going out.
+            await asyncio.sleep(1)
+
+    try:
+        asyncio.run(app.app(scope, receive, send))
+    finally:
+        app.app.dependency_overrides.clear()
+
+    assert "http.response.body" not in sent
+    assert stream.closed
+    assert app._ai_admission["in_flight"] == 0
@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def _row(food_id, lang, is_active=True):
+    return {
+        "id": food_id,
+        "food_name": f"apple {lang}",
+        "canonical_name": None,
+        "lang": lang,
+        "is_active": is_active,
+    }
+
+
+def test_item_from_index_applies_lang_and_active_filters(monkeypatch):
+    index = {
+        "supports_lang_active": True,
+        "catalog_by_id": {
+            "zh": _row("zh", "zh-TW"),
+            "en": _row("en", "en"),
+            "retired": _row("retired", "en", is_active=False),
+        },
+    }
+    monkeypatch.setattr(app, "_food_search_index", index)
+    monkeypatch.setattr(app, "_supabase_rest_list", lambda *args, **kwargs: pytest.fail("unexpected remote lookup"))
+
+    assert app.foods_item(food_id="en", lang="en", q=None).food_id == "en"
+    for food_id in ("zh", "retired"):
+        with pytest.raises(HTTPException) as excinfo:
+            app.foods_item(food_id=food_id, lang="en", q=None)
+        assert excinfo.value.detail == "food_not_found"
+
+
+def test_item_remote_lookup_filters_lang_and_active(monkeypatch):
+    calls = []
+
+    def rest_list(table, params, *, timeout=None):
+        calls.append(params)
+        return []
+
+    monkeypatch.setattr(app, "_food_search_index", None)
+    monkeypatch.setattr(app, "_supports_catalog_lang_active_filters", lambda: True)
+    monkeypatch.setattr(app, "_supabase_rest_list", rest_list)
+
+    with pytest.raises(HTTPException):
+        app.foods_item(food_id="zh", lang="en", q=None)
+    assert ("lang", "eq.en") in calls[0]
+    assert ("is_active", "eq.true") in calls[0]
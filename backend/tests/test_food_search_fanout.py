@@ -0,0 +1,114 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def _use_remote_collect(monkeypatch, rest_list):
+    monkeypatch.setattr(app, "_food_search_index", None)
+    monkeypatch.setattr(app, "FOOD_SEARCH_RPC_ENABLED", False)
+    monkeypatch.setattr(app, "_supports_catalog_lang_active_filters", lambda: False)
+    monkeypatch.setattr(app, "_supabase_rest_list", rest_list)
+    monkeypatch.setattr(app, "_food_search_cache_version", None)
+    app._food_search_cache.clear()
+
+
+def test_fetch_many_caps_jobs_per_request(monkeypatch):
+    monkeypatch.setattr(app, "FOOD_SEARCH_FANOUT_PER_REQUEST", 2)
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+
+    def rest_list(table, params, *, timeout=None):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return [{"id": params[0][1]}]
+
+    monkeypatch.setattr(app, "_supabase_rest_list", rest_list)
+    specs = [("food_catalog", [("id", str(i))]) for i in range(6)]
+    results, unfinished = app._food_search_fetch_many(specs, time.monotonic() + 5)
+
+    assert unfinished == set()
+    assert [rows[0]["id"] for rows in results] == [str(i) for i in range(6)]
+    assert running["peak"] == 2
+
+
+def test_search_past_deadline_is_partial_and_not_cached(monkeypatch):
+    monkeypatch.setattr(app, "FOOD_SEARCH_DEADLINE_SEC", 0.2)
+    release = threading.Event()
+
+    def rest_list(table, params, *, timeout=None):
+        if table == "food_catalog":
+            release.wait(2)
+        return []
+
+    _use_remote_collect(monkeypatch, rest_list)
+    try:
+        response = app.foods_search(q="apple", lang="en", limit=8)
+    finally:
+        release.set()
+
+    assert response.partial
+    assert not app._food_search_cache
+
+    response = app.foods_search(q="apple", lang="en", limit=8)
+    assert not response.partial
+    assert len(app._food_search_cache) == 1
+
+
+def test_batch_deadline_scales_with_dishes_and_flags_slow_ones(monkeypatch):
+    monkeypatch.setattr(app, "FOOD_SEARCH_DEADLINE_SEC", 0.3)
+    monkeypatch.setattr(app, "FOOD_SEARCH_BATCH_DEADLINE_SEC", 5.0)
+    release = threading.Event()
+
+    def rest_list(table, params, *, timeout=None):
+        if any("banana" in value for _, value in params):
+            release.wait(2)
+        else:
+            # Slower than one search's budget, well inside the batch budget.
+            time.sleep(0.4)
+        return []
+
+    _use_remote_collect(monkeypatch, rest_list)
+    payload = app.FoodSearchBatchRequest(queries=["apple", "banana", "cherry"], lang="en")
+    try:
+        response = app.foods_search_batch(payload)
+    finally:
+        release.set()
+
+    assert [result.partial for result in response.results] == [False, True, False]
+    assert {key[0] for key in app._food_search_cache} == {"apple", "cherry"}
+
+
+def test_rpc_timeout_fallback_uses_what_is_left_of_the_deadline(monkeypatch):
+    monkeypatch.setattr(app, "FOOD_SEARCH_DEADLINE_SEC", 0.5)
+    release = threading.Event()
+
+    def rest_list(table, params, *, timeout=None):
+        release.wait(2)
+        return []
+
+    def rest_rpc(name, payload, *, timeout=None):
+        time.sleep(0.4)
+        return 0, None
+
+    _use_remote_collect(monkeypatch, rest_list)
+    monkeypatch.setattr(app, "FOOD_SEARCH_RPC_ENABLED", True)
+    monkeypatch.setattr(app, "_food_search_rpc_supported", None)
+    monkeypatch.setattr(app, "_supports_catalog_lang_active_filters", lambda: True)
+    monkeypatch.setattr(app, "_supabase_rest_rpc", rest_rpc)
+    started = time.monotonic()
+    try:
+        response = app.foods_search(q="apple", lang="en", limit=8)
+    finally:
+        release.set()
+
+    assert response.partial
+    assert time.monotonic() - started < 0.8
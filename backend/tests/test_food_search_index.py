@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def _catalog_row(index):
+    return {
+        "id": f"food-{index}",
+        "food_name": f"food {index}",
+        "canonical_name": None,
+        "lang": "en",
+        "is_active": True,
+    }
+
+
+def test_failed_page_keeps_previous_index(monkeypatch):
+    page_size = 2
+    monkeypatch.setattr(app, "FOOD_SEARCH_INDEX_PAGE_SIZE", page_size)
+    monkeypatch.setattr(app, "SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setattr(app, "_supabase_headers", lambda: {})
+    monkeypatch.setattr(app, "_supports_catalog_lang_active_filters", lambda: True)
+    fail_second_page = {"on": False}
+
+    def handler(request):
+        offset = int(request.url.params["offset"])
+        if request.url.path.endswith("/food_aliases"):
+            return httpx.Response(200, json=[])
+        if fail_second_page["on"] and offset == page_size:
+            return httpx.Response(503, text="unavailable")
+        rows = [_catalog_row(i) for i in range(offset, min(offset + page_size, 5))]
+        return httpx.Response(200, json=rows)
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(app, "_get_supabase_http_client", lambda: client)
+    monkeypatch.setattr(app, "_food_search_index", None)
+
+    assert app._food_search_index_refresh()
+    assert len(app._food_search_index["catalog_entries"]) == 5
+    previous = app._food_search_index
+
+    fail_second_page["on"] = True
+    assert not app._food_search_index_refresh()
+    assert app._food_search_index is previous
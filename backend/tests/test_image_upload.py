@@ -0,0 +1,87 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def _tiny_png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (50, 50), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def analyze_client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_analysis_cache_db_path", tmp_path / "analysis_cache.sqlite3")
+    monkeypatch.setattr(app, "_analysis_cache_path", tmp_path / "analysis_cache.json")
+    monkeypatch.setattr(app, "_analysis_cache_db", None)
+    monkeypatch.setattr(app, "_usage_log_path", tmp_path / "usage.jsonl")
+    monkeypatch.setattr(app, "IMAGE_PREPROCESS_ENABLED", True)
+    monkeypatch.setattr(app, "ANALYSIS_DHASH_ENABLED", True)
+    monkeypatch.setattr(app, "CALL_REAL_AI", True)
+    monkeypatch.setattr(app, "FREE_DAILY_LIMIT", 0)
+    monkeypatch.setattr(app, "_client", object())
+    monkeypatch.setattr(app, "_require_entitlement", lambda auth, entitlement: None)
+    app.app.dependency_overrides[app._require_auth] = lambda: {"user_id": ""}
+    sent = []
+
+    async def analyze_with_openai(image_bytes, *args, **kwargs):
+        sent.append(image_bytes)
+        raise HTTPException(status_code=502, detail="ai_invalid_response")
+
+    monkeypatch.setattr(app, "_analyze_with_openai", analyze_with_openai)
+    try:
+        yield TestClient(app.app), sent
+    finally:
+        app.app.dependency_overrides.clear()
+        app._close_analysis_cache()
+
+
+def test_small_png_that_does_not_shrink_is_sent_as_is(analyze_client):
+    client, sent = analyze_client
+    original = _tiny_png()
+    response = client.post("/analyze", files={"image": ("meal.png", original, "image/png")})
+
+    assert response.status_code == 502
+    assert sent == [original]
+
+
+def test_prepare_vision_image_falls_back_to_original_file():
+    original = _tiny_png()
+    assert app._prepare_vision_image(io.BytesIO(original)) == original
+
+
+def test_oversized_upload_is_rejected_before_the_body_is_parsed(analyze_client, monkeypatch):
+    client, sent = analyze_client
+    monkeypatch.setattr(app, "IMAGE_UPLOAD_MAX_BYTES", 1024)
+    parsed = []
+    read_upload_image = app._read_upload_image
+
+    async def tracking_read(upload):
+        parsed.append(upload.filename)
+        return await read_upload_image(upload)
+
+    monkeypatch.setattr(app, "_read_upload_image", tracking_read)
+    response = client.post("/analyze", files={"image": ("meal.jpg", b"\xff" * (200 * 1024), "image/jpeg")})
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "image_too_large"}
+    assert parsed == []
+    assert sent == []
+
+
+def test_empty_upload_is_rejected(analyze_client):
+    client, sent = analyze_client
+    response = client.post("/analyze_label", files={"image": ("label.jpg", b"", "image/jpeg")})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "missing_image"}
+    assert sent == []
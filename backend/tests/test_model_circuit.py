@@ -0,0 +1,46 @@
+import asyncio
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def test_cancelled_half_open_probe_frees_probe_slot(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_usage_log_path", tmp_path / "usage.jsonl")
+    monkeypatch.setattr(app, "OPENAI_FALLBACK_MODELS", [])
+    monkeypatch.setattr(app, "_model_circuits", {})
+    model = app.OPENAI_MODEL
+    with app._model_circuits_lock:
+        circuit = app._model_circuit(model)
+        circuit["state"] = "open"
+        circuit["opened_at"] = 0.0
+    started = asyncio.Event()
+
+    async def create(**kwargs):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(
+        app,
+        "_client",
+        types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create))),
+    )
+
+    async def run():
+        task = asyncio.create_task(app._create_chat_completion(messages=[], purpose="chat"))
+        await started.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+
+    assert app._model_circuits[model]["state"] == "half_open"
+    assert app._model_circuits[model]["probing"] is False
+    assert app._model_circuit_acquire(model)
+    assert app._ai_admission["in_flight"] == 0
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def test_failed_profile_fetch_is_not_cached_or_written_back(monkeypatch):
+    monkeypatch.setattr(app, "SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setattr(app, "_supabase_headers", lambda: {})
+    monkeypatch.setattr(app, "PROFILE_ACCESS_CACHE_TTL_SEC", 60)
+    monkeypatch.setattr(app, "_profile_plan_columns_supported", True)
+    app._profile_access_cache.clear()
+    state = {"up": False}
+    requests = []
+
+    def handler(request):
+        requests.append(request.method)
+        if not state["up"]:
+            return httpx.Response(503, text="unavailable")
+        return httpx.Response(
+            200,
+            json=[{"trial_start": "2026-01-02T00:00:00+00:00", "plan_id": None, "subscription_expires_at": None}],
+        )
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(app, "_get_supabase_http_client", lambda: client)
+
+    access = app._ensure_profile_access("user-a", "a@example.com")
+    assert access["trial_start"] is not None
+    assert "user-a" not in app._profile_access_cache
+    assert "POST" not in requests
+
+    state["up"] = True
+    access = app._ensure_profile_access("user-a", "a@example.com")
+    assert access["trial_start"].isoformat() == "2026-01-02T00:00:00+00:00"
+    assert app._cached_profile_access("user-a")["trial_start"] == access["trial_start"]
+    app._profile_access_cache.clear()
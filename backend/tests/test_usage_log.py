@@ -0,0 +1,26 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def test_usage_records_are_read_newest_first_across_blocks(monkeypatch, tmp_path):
+    path = tmp_path / "usage.jsonl"
+    records = [{"id": index, "note": "多" * (index % 7)} for index in range(300)]
+    content = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    path.write_text(content + '{"id": "half-writ', encoding="utf-8")
+    monkeypatch.setattr(app, "_usage_log_path", path)
+
+    # Small blocks split lines and multi-byte characters at block boundaries.
+    lines = list(app._iter_usage_lines_reversed(block_size=97))
+    assert [line.decode("utf-8") for line in lines if line] == [
+        '{"id": "half-writ',
+        *[json.dumps(record, ensure_ascii=False) for record in reversed(records)],
+    ]
+
+    assert app._read_usage_records(5) == records[::-1][:5]
+    assert app._read_usage_records(1000) == records[::-1]
+    assert app._read_usage_records(0) == []
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+
+def test_lookups_batch_cache_writes_until_flush(monkeypatch, tmp_path):
+    cache_path = tmp_path / "week_plan_web_cache.json"
+    monkeypatch.setattr(app, "_week_plan_web_cache_path", cache_path)
+    monkeypatch.setattr(app, "_week_plan_web_lookup_cache", {})
+    monkeypatch.setattr(app, "_week_plan_web_cache_dirty", False)
+    monkeypatch.setattr(app, "WEEK_PLAN_WEB_LOOKUP_ENABLED", True)
+
+    async def openai_candidates(**kwargs):
+        return [f"{kwargs['market_code']} onigiri", f"{kwargs['market_code']} salad"]
+
+    async def web_titles(**kwargs):
+        return []
+
+    monkeypatch.setattr(app, "_week_plan_fetch_openai_online_convenience_candidates", openai_candidates)
+    monkeypatch.setattr(app, "_week_plan_fetch_web_titles", web_titles)
+
+    async def run():
+        for market_code in ("TW", "JP", "US"):
+            await app._week_plan_fetch_online_convenience_candidates(
+                lang="en",
+                market_code=market_code,
+                retailer_codes=[],
+                limit=8,
+            )
+        assert not cache_path.exists()
+        await app._flush_week_plan_web_cache()
+
+    asyncio.run(run())
+
+    assert not app._week_plan_web_cache_dirty
+    assert json.loads(cache_path.read_text(encoding="utf-8")) == app._week_plan_web_lookup_cache
+    assert len(app._week_plan_web_lookup_cache) == 3
+
+
+def _stub_lookups(monkeypatch, tmp_path, openai_items, openai_delay=0.0):
+    monkeypatch.setattr(app, "_week_plan_web_cache_path", tmp_path / "week_plan_web_cache.json")
+    monkeypatch.setattr(app, "_week_plan_web_lookup_cache", {})
+    monkeypatch.setattr(app, "WEEK_PLAN_WEB_LOOKUP_ENABLED", True)
+    monkeypatch.setattr(app, "WEEK_PLAN_WEB_LOOKUP_HEDGE_SEC", 0.2)
+    monkeypatch.setattr(app, "_week_plan_convenience_name_quality", lambda name: 1)
+    monkeypatch.setattr(app, "_week_plan_is_beverage_only_name", lambda name: False)
+    web_queries = []
+
+    async def openai_candidates(**kwargs):
+        await asyncio.sleep(openai_delay)
+        return list(openai_items)
+
+    async def web_titles(**kwargs):
+        web_queries.append(kwargs["query"])
+        return []
+
+    monkeypatch.setattr(app, "_week_plan_fetch_openai_online_convenience_candidates", openai_candidates)
+    monkeypatch.setattr(app, "_week_plan_fetch_web_titles", web_titles)
+    return web_queries
+
+
+def _lookup():
+    return asyncio.run(
+        app._week_plan_fetch_online_convenience_candidates(
+            lang="en",
+            market_code="TW",
+            retailer_codes=[],
+            limit=8,
+        )
+    )
+
+
+def test_web_queries_are_skipped_when_openai_fills_the_list(monkeypatch, tmp_path):
+    web_queries = _stub_lookups(monkeypatch, tmp_path, [f"dish {index}" for index in range(12)])
+    assert len(_lookup()) == 8
+    assert web_queries == []
+
+
+def test_web_queries_run_when_openai_comes_back_short(monkeypatch, tmp_path):
+    web_queries = _stub_lookups(monkeypatch, tmp_path, ["dish 1"])
+    assert _lookup() == ["dish 1"]
+    assert web_queries
+
+
+def test_web_queries_start_at_the_hedge_point_while_openai_is_slow(monkeypatch, tmp_path):
+    web_queries = _stub_lookups(monkeypatch, tmp_path, [f"dish {index}" for index in range(12)], openai_delay=0.5)
+    assert len(_lookup()) == 8
+    assert web_queries
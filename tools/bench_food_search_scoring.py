@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+DEFAULT_QUERIES = [
+    "牛肉麵",
+    "珍珠奶茶半糖少冰",
+    "青茶半糖去冰加珍珠",
+    "大杯紅茶拿鐵微糖",
+    "滷肉飯",
+    "雞排",
+    "latte",
+    "chicken rice",
+]
+
+
+def resolve_paths(patterns: list[str]) -> list[Path]:
+    output: list[Path] = []
+    seen: set[str] = set()
+    for pattern in patterns:
+        matches = list(Path(".").glob(pattern))
+        if not matches and Path(pattern).exists():
+            matches = [Path(pattern)]
+        for path in matches:
+            key = str(path.resolve())
+            if key in seen:
+                continue
+            seen.add(key)
+            output.append(path)
+    output.sort(key=lambda p: str(p))
+    return output
+
+
+def load_catalog_rows(paths: list[Path]) -> list[dict[str, Any]]:
+    # Shape rows like PostgREST returns them (JSON columns decoded, booleans typed).
+    rows: list[dict[str, Any]] = []
+    for path in paths:
+        with path.open("r", encoding="utf-8-sig", newline="") as handle:
+            for index, row in enumerate(csv.DictReader(handle)):
+                item: dict[str, Any] = dict(row)
+                item["id"] = f"{path.stem}-{index}"
+                for key in ("macros", "food_items", "judgement_tags", "beverage_profile"):
+                    try:
+                        item[key] = json.loads(item[key]) if item.get(key) else None
+                    except Exception:
+                        pass
+                for key in ("is_beverage", "is_food", "is_active"):
+                    item[key] = str(item.get(key) or "").strip().lower() == "true"
+                rows.append(item)
+    return rows
+
+
+def score_rows(app: Any, rows: list[dict[str, Any]], queries: list[str]) -> None:
+    for query in queries:
+        query_norm = app._normalize_food_query(query)
+        for row in rows:
+            app._direct_food_match_score(query_norm, row)
+            app._primary_query_bonus(query_norm, row, alias_row=None)
+            app._beverage_query_preference_delta(query_norm, row)
+
+
+def score_rows_uncached(app: Any, rows: list[dict[str, Any]], queries: list[str]) -> None:
+    # Baseline: drop the memoized forms before every scorer call, so each one
+    # re-normalizes the row names the way scoring did before rows were prepared.
+    for query in queries:
+        query_norm = app._normalize_food_query(query)
+        for row in rows:
+            row.pop("_norms", None)
+            app._direct_food_match_score(query_norm, row)
+            row.pop("_norms", None)
+            app._primary_query_bonus(query_norm, row, alias_row=None)
+            row.pop("_norms", None)
+            app._beverage_query_preference_delta(query_norm, row)
+
+
+def per_row_us(elapsed: float, rows: int, rounds: int) -> float:
+    return elapsed * 1_000_000 / max(1, rows * rounds)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmark /foods/search row normalization and scoring cost."
+    )
+    parser.add_argument(
+        "--catalog-glob",
+        action="append",
+        default=[],
+        help="Catalog CSV glob (repeatable). Default: backend/sql/food_catalog*_draft.csv",
+    )
+    parser.add_argument("--query", action="append", default=[], help="Query to score (repeatable).")
+    parser.add_argument("--rounds", type=int, default=20, help="Timed rounds per measurement.")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    sys.path.insert(0, str(BACKEND_DIR))
+    import app  # noqa: E402
+
+    paths = resolve_paths(args.catalog_glob or ["backend/sql/food_catalog*_draft.csv"])
+    rows = load_catalog_rows(paths)
+    if not rows:
+        print("error: no catalog rows found", file=sys.stderr)
+        return 2
+    queries = args.query or DEFAULT_QUERIES
+    rounds = max(1, int(args.rounds))
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for row in rows:
+            {str(k): app._fix_mojibake_value(v) for k, v in row.items()}
+    mojibake_us = per_row_us(time.perf_counter() - started, len(rows), rounds)
+
+    baseline_rows = [dict(row) for row in rows]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        score_rows_uncached(app, baseline_rows, queries)
+    baseline_us = per_row_us(time.perf_counter() - started, len(rows) * len(queries), rounds)
+
+    # Live (RPC / table query) rows arrive without precomputed forms every request.
+    live_batches = [[dict(row) for row in rows] for _ in range(rounds)]
+    started = time.perf_counter()
+    for batch in live_batches:
+        score_rows(app, batch, queries)
+    live_us = per_row_us(time.perf_counter() - started, len(rows) * len(queries), rounds)
+
+    # Index rows are normalized once at build time and reused across requests.
+    indexed = [dict(row) for row in rows]
+    for row in indexed:
+        app._catalog_row_norms(row)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        score_rows(app, indexed, queries)
+    indexed_us = per_row_us(time.perf_counter() - started, len(rows) * len(queries), rounds)
+
+    print("food search scoring benchmark")
+    print(f"- catalog rows:         {len(rows)}")
+    print(f"- queries:              {len(queries)}")
+    print(f"- rounds:               {rounds}")
+    print(f"- mojibake fix:         {mojibake_us:.2f} us/row")
+    print(f"- score (per call):     {baseline_us:.2f} us/row/query")
+    print(f"- score (live rows):    {live_us:.2f} us/row/query ({baseline_us / max(live_us, 1e-9):.1f}x)")
+    print(f"- score (indexed rows): {indexed_us:.2f} us/row/query ({baseline_us / max(indexed_us, 1e-9):.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,6 +8,7 @@ import os
 import re
 import sys
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 from urllib import error, parse, request
@@ -178,6 +179,26 @@ class SupabaseClient:
             return [payload]
         return []
 
+    def upsert(self, table: str, row: dict[str, Any], on_conflict: str) -> None:
+        self._request(
+            "POST",
+            table,
+            params=[("on_conflict", on_conflict)],
+            body=row,
+            prefer="resolution=merge-duplicates,return=minimal",
+        )
+
+
+def bump_catalog_version(client: SupabaseClient) -> str:
+    # Backend search caches poll catalog_meta and drop cached results when this changes.
+    version = datetime.now(timezone.utc).isoformat()
+    client.upsert(
+        "catalog_meta",
+        {"key": "catalog_version", "value": version, "updated_at": version},
+        on_conflict="key",
+    )
+    return version
+
 
 def read_csv_rows(path: Path) -> list[dict[str, str]]:
     if not path.exists():
@@ -524,6 +545,14 @@ def main() -> int:
                 if args.stop_on_error:
                     break
 
+    catalog_version = ""
+    changed = stats.catalog_inserted + stats.catalog_updated + stats.alias_inserted
+    if changed and not args.dry_run:
+        try:
+            catalog_version = bump_catalog_version(client)
+        except Exception as exc:
+            print(f"warning: catalog version bump failed (run backend/sql/catalog_version.sql?): {exc}", file=sys.stderr)
+
     print("supabase catalog sync summary")
     print(f"- dry_run:          {bool(args.dry_run)}")
     print(f"- catalog inserted: {stats.catalog_inserted}")
@@ -533,6 +562,8 @@ def main() -> int:
     print(f"- alias inserted:   {stats.alias_inserted}")
     print(f"- alias skipped:    {stats.alias_skipped}")
     print(f"- errors:           {stats.errors}")
+    if catalog_version:
+        print(f"- catalog version:  {catalog_version}")
 
     return 1 if stats.errors else 0
 